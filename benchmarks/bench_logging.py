@@ -0,0 +1,67 @@
+# Copyright FuseSoC contributors
+# Licensed under the 2-Clause BSD License, see LICENSE for details.
+# SPDX-License-Identifier: BSD-2-Clause
+
+"""Benchmark the core query hot path with debug logging disabled
+
+Generates a synthetic library, resolves the dependencies of its root core and
+queries files, parameters, dependencies and tool options of every core, the
+way the edalizer does, with the log level set to INFO.
+
+Run from the repository root with
+
+    python -m benchmarks.bench_logging [--cores N] [--repeat N]
+"""
+
+import argparse
+import logging
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks.synthetic import core_name, generate_library
+from fusesoc.config import Config
+from fusesoc.coremanager import CoreManager
+from fusesoc.librarymanager import Library
+from fusesoc.vlnv import Vlnv
+
+
+def run(cores, repeat):
+    logging.basicConfig(level=logging.INFO)
+    with tempfile.TemporaryDirectory() as tmp:
+        root = generate_library(Path(tmp) / "lib", cores=cores)
+        config_file = Path(tmp) / "fusesoc.conf"
+        config_file.write_text(f"[main]\ncache_root = {Path(tmp) / 'cache'}\n")
+        cm = CoreManager(Config(str(config_file)), use_index=False)
+        cm.add_library(Library("bench", root), [])
+
+        flags = {"tool": "icarus", "target": "sim"}
+        deps = cm.get_depends(Vlnv(core_name(0)), flags)
+
+        best = None
+        for i in range(repeat):
+            for core in deps:
+                core.invalidate_memo()
+            start = time.perf_counter()
+            for core in deps:
+                _flags = dict(flags, is_toplevel=core.name == deps[-1].name)
+                core.get_files(_flags)
+                core.get_parameters(_flags)
+                core.get_depends(_flags)
+                core.get_tool_options(_flags)
+                core.get_flow_options(_flags)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        print(f"Queried {len(deps)} cores: {best * 1000:.1f} ms (best of {repeat})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--cores", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    run(args.cores, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
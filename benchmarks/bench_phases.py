@@ -0,0 +1,238 @@
+# Copyright FuseSoC contributors
+# Licensed under the 2-Clause BSD License, see LICENSE for details.
+# SPDX-License-Identifier: BSD-2-Clause
+
+"""Benchmark the phases of a FuseSoC run on a synthetic core library
+
+The phases are measured one at a time, each starting from a freshly prepared
+state, so that they can be compared between releases:
+
+  scan        Find and register all cores, without the core index
+  scan-cold   Find and register all cores, building the core index
+  scan-warm   Find and register all cores using an up to date core index
+  parse       Fully parse all core files
+  solve       Resolve the dependencies of the root core
+  edam        Create the EDAM for the root core from the resolved cores
+
+Wall time and CPU time are measured without memory tracing. Peak memory is
+measured in a separate run of each phase with tracemalloc.
+
+Run from the repository root with
+
+    python -m benchmarks.bench_phases [options]
+"""
+
+import argparse
+import json
+import logging
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+from benchmarks.synthetic import core_name, generate_library
+from fusesoc.config import Config
+from fusesoc.core import Core
+from fusesoc.coremanager import CoreManager
+from fusesoc.edalizer import Edalizer
+from fusesoc.librarymanager import Library
+from fusesoc.vlnv import Vlnv
+
+FLAGS = {"tool": "icarus", "target": "sim"}
+
+
+class Bench:
+    def __init__(self, root, tmp, jobs):
+        self.root = root
+        self.tmp = tmp
+        self.jobs = jobs
+        self.core_files = sorted(root.glob("**/*.core"))
+        self.top = Vlnv(core_name(0))
+        self._n = 0
+
+    def config(self, cache_root=None):
+        """Create a config with a new cache_root, unless one is given"""
+        if cache_root is None:
+            self._n += 1
+            cache_root = self.tmp / f"cache{self._n}"
+        config_file = self.tmp / "fusesoc.conf"
+        config_file.write_text(f"[main]\ncache_root = {cache_root}\n")
+        return Config(str(config_file))
+
+    def core_manager(self, config=None, use_index=False):
+        cm = CoreManager(config or self.config(), use_index=use_index, jobs=self.jobs)
+        cm.add_library(Library("bench", self.root), [])
+        return cm
+
+    # Each phase has a setup function returning the state for the phase, and
+    # a run function, which is what is measured. The run functions return what
+    # they created, so that it is included in the peak memory.
+
+    def setup_scan(self):
+        return None
+
+    def run_scan(self, state):
+        return self.core_manager()
+
+    def setup_scan_cold(self):
+        return self.config()
+
+    def run_scan_cold(self, config):
+        return self.core_manager(config, use_index=True)
+
+    def setup_scan_warm(self):
+        config = self.config()
+        self.core_manager(config, use_index=True)
+        return config
+
+    def run_scan_warm(self, config):
+        return self.core_manager(config, use_index=True)
+
+    def setup_parse(self):
+        return None
+
+    def run_parse(self, state):
+        return [Core(str(f)) for f in self.core_files]
+
+    def setup_solve(self):
+        return self.core_manager()
+
+    def run_solve(self, cm):
+        return cm.get_depends(self.top, FLAGS)
+
+    def setup_edam(self):
+        cm = self.core_manager()
+        top = cm.get_core(self.top)
+        for core in cm.get_depends(top.name, FLAGS):
+            # Load the full cores, which is measured by the parse phase
+            core.core_root
+        work_root = self.tmp / "work"
+        work_root.mkdir(exist_ok=True)
+        return Edalizer(top.name, FLAGS, work_root, cm)
+
+    def run_edam(self, edalizer):
+        return edalizer.run()
+
+
+PHASES = ["scan", "scan-cold", "scan-warm", "parse", "solve", "edam"]
+
+
+def measure(bench, phase, repeat, memory):
+    setup = getattr(bench, "setup_" + phase.replace("-", "_"))
+    run = getattr(bench, "run_" + phase.replace("-", "_"))
+
+    wall = []
+    cpu = []
+    for i in range(repeat):
+        state = setup()
+        start = (time.perf_counter(), time.process_time())
+        run(state)
+        wall.append(time.perf_counter() - start[0])
+        cpu.append(time.process_time() - start[1])
+
+    result = {
+        "wall_min": min(wall),
+        "wall_mean": sum(wall) / len(wall),
+        "cpu_min": min(cpu),
+    }
+    if memory:
+        state = setup()
+        tracemalloc.start()
+        retained = run(state)
+        result["peak_memory"] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        del retained
+    return result
+
+
+def print_table(results):
+    print(
+        "{:<10} {:>12} {:>12} {:>12} {:>12}".format(
+            "phase", "wall min", "wall mean", "cpu min", "peak mem"
+        )
+    )
+    for phase, r in results.items():
+        mem = r.get("peak_memory")
+        print(
+            "{:<10} {:>9.1f} ms {:>9.1f} ms {:>9.1f} ms {:>12}".format(
+                phase,
+                r["wall_min"] * 1000,
+                r["wall_mean"] * 1000,
+                r["cpu_min"] * 1000,
+                "-" if mem is None else f"{mem / 2**20:.1f} MiB",
+            )
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.splitlines()[0],
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("--cores", type=int, default=2000, help="Number of cores")
+    parser.add_argument(
+        "--fanout", type=int, default=3, help="Number of dependencies per core"
+    )
+    parser.add_argument(
+        "--files", type=int, default=10, help="Number of files per fileset"
+    )
+    parser.add_argument(
+        "--flag-density",
+        type=float,
+        default=0.2,
+        help="Fraction of files and dependencies with use flag conditions",
+    )
+    parser.add_argument(
+        "--virtuals", type=int, default=0, help="Number of virtual cores"
+    )
+    parser.add_argument(
+        "--providers",
+        type=int,
+        default=2,
+        help="Number of cores providing each virtual core",
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=3, help="Number of timed runs per phase"
+    )
+    parser.add_argument(
+        "--jobs", type=int, default=1, help="Number of processes for parsing"
+    )
+    parser.add_argument(
+        "--phase",
+        action="append",
+        choices=PHASES,
+        help="Phase to run. Can be given several times. Default is all phases",
+    )
+    parser.add_argument(
+        "--no-memory", action="store_true", help="Don't measure peak memory"
+    )
+    parser.add_argument("--json", help="Write the results to a JSON file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        root = generate_library(
+            tmp / "lib",
+            cores=args.cores,
+            fanout=args.fanout,
+            files=args.files,
+            flag_density=args.flag_density,
+            virtuals=args.virtuals,
+            providers=args.providers,
+        )
+        bench = Bench(root, tmp, args.jobs)
+        results = {}
+        for phase in args.phase or PHASES:
+            results[phase] = measure(bench, phase, args.repeat, not args.no_memory)
+
+    print_table(results)
+    if args.json:
+        parameters = {k: v for k, v in vars(args).items() if k not in ["phase", "json"]}
+        with open(args.json, "w") as f:
+            json.dump({"parameters": parameters, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+# Copyright FuseSoC contributors
+# Licensed under the 2-Clause BSD License, see LICENSE for details.
+# SPDX-License-Identifier: BSD-2-Clause
+
+"""Generators for synthetic core libraries used by the benchmarks"""
+
+import random
+from pathlib import Path
+
+
+def core_name(i):
+    return f"bench:lib:core{i}:1.0"
+
+
+def virtual_name(k):
+    return f"bench:lib:iface{k}:1.0"
+
+
+def generate_library(
+    root,
+    cores=2000,
+    fanout=3,
+    files=10,
+    flag_density=0.2,
+    virtuals=0,
+    providers=2,
+    seed=0,
+):
+    """Write a synthetic core library to root
+
+    Core i depends on core i + 1 and on fanout - 1 randomly chosen cores with
+    higher numbers, so core 0 is the root of a dependency tree which contains
+    all cores. If virtuals is set, each core additionally depends on one of
+    the virtual cores, and each virtual core is provided by several cores that
+    the solver has to choose between.
+
+    Args:
+        root: Directory to write the library to
+        cores: Number of cores
+        fanout: Number of dependencies of each core
+        files: Number of files in each fileset
+        flag_density: Fraction of files and dependencies which are only used
+            when a flag is set
+        virtuals: Number of virtual cores
+        providers: Number of cores providing each virtual core
+        seed: Seed for the random choices, to make libraries reproducible
+    """
+    rng = random.Random(seed)
+    root = Path(root)
+
+    def conditional(s):
+        if rng.random() < flag_density:
+            flag = rng.choice(["tool_icarus", "!tool_verilator", "use_fast"])
+            return f"{flag} ? ({s})"
+        return s
+
+    for i in range(cores):
+        core_dir = root / f"core{i // 100}" / f"core{i}"
+        core_dir.mkdir(parents=True, exist_ok=True)
+
+        # Always depend on the next core to keep all cores in the tree
+        later = range(i + 2, cores)
+        depends = [core_name(i + 1)] if i + 1 < cores else []
+        depends += [
+            conditional(core_name(d))
+            for d in rng.sample(later, min(fanout - 1, len(later)))
+        ]
+        if virtuals:
+            depends.append(virtual_name(i % virtuals))
+        lines = [
+            "CAPI=2:",
+            f"name: {core_name(i)}",
+            f"description: Synthetic core {i}",
+            "filesets:",
+            "  rtl:",
+            "    file_type: verilogSource",
+            "    files:",
+        ]
+        lines += [
+            f"      - '{conditional(f'rtl/core{i}_{j}.v')}'" for j in range(files)
+        ]
+        lines += ["    depend:"]
+        lines += [f"      - '{d}'" for d in depends]
+        lines += [
+            "  tb:",
+            "    file_type: verilogSource",
+            "    files:",
+            f"      - tb/core{i}_tb.v",
+            "targets:",
+            "  default:",
+            "    filesets: [rtl]",
+            "    parameters: [width]",
+            "  sim:",
+            "    default_tool: icarus",
+            "    filesets: [rtl, tb]",
+            "    parameters: [width=16]",
+            f"    toplevel: core{i}_tb",
+            "parameters:",
+            "  width:",
+            "    datatype: int",
+            "    default: 8",
+            "    paramtype: vlogparam",
+        ]
+        (core_dir / f"core{i}.core").write_text("\n".join(lines) + "\n")
+
+    for k in range(virtuals):
+        for p in range(providers):
+            core_dir = root / "providers" / f"impl{k}_{p}"
+            core_dir.mkdir(parents=True, exist_ok=True)
+            lines = [
+                "CAPI=2:",
+                f"name: bench:lib:impl{k}_{p}:1.0",
+                f"virtual: ['{virtual_name(k)}']",
+                "filesets:",
+                "  rtl:",
+                "    file_type: verilogSource",
+                f"    files: [rtl/impl{k}_{p}.v]",
+                "targets:",
+                "  default:",
+                "    filesets: [rtl]",
+            ]
+            (core_dir / f"impl{k}_{p}.core").write_text("\n".join(lines) + "\n")
+    return root
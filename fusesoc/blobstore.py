@@ -0,0 +1,175 @@
+# Copyright FuseSoC contributors
+# Licensed under the 2-Clause BSD License, see LICENSE for details.
+# SPDX-License-Identifier: BSD-2-Clause
+
+import hashlib
+import logging
+import os
+import tempfile
+from pathlib import Path
+
+from fusesoc.utils import file_digest
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class BlobStore:
+    """Content-addressed store for downloaded files
+
+    Each file is stored once, named after the SHA-256 hash of its contents, in
+    blobs/<first two hex digits>/<hex digest>. The URL a file was downloaded
+    from is recorded in urls/<hash of URL>, so that a file can be found both by
+    its URL and by its hash. The mtime of a blob is updated each time it is
+    used, and trim() removes the least recently used blobs first.
+    """
+
+    def __init__(self, root):
+        self.root = Path(root)
+
+    def _blob_path(self, digest):
+        return self.root / "blobs" / digest[:2] / digest
+
+    def _url_path(self, url):
+        return self.root / "urls" / hashlib.sha256(url.encode()).hexdigest()
+
+    def get(self, url=None, sha256=None):
+        """Get the path of a stored file, or None if there is none
+
+        If sha256 is given, the file is looked up by its hash and the URL is
+        not needed. Otherwise the file most recently stored for the URL is
+        returned. The contents of the file are verified before it is used.
+        """
+        digest = sha256.lower() if sha256 else self._lookup_url(url)
+        if not digest:
+            return None
+        path = self._blob_path(digest)
+        try:
+            actual = file_digest(path)
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            logger.warning(f"Failed to read {path} from download cache: {e}")
+            return None
+        if actual != digest:
+            logger.warning(f"Removing corrupt file {path} from download cache")
+            _unlink(path)
+            return None
+        os.utime(path)
+        return path
+
+    def _lookup_url(self, url):
+        if not url:
+            return None
+        try:
+            return self._url_path(url).read_text().strip()
+        except OSError:
+            return None
+
+    def add(self, fileobj, url=None, sha256=None):
+        """Store the contents of a binary file object and return the path
+
+        If sha256 is given, a RuntimeError is raised if the contents don't
+        match it, and nothing is stored.
+        """
+        with self.writer(url, sha256) as w:
+            while True:
+                chunk = fileobj.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                w.write(chunk)
+        return w.path
+
+    def writer(self, url=None, sha256=None):
+        """Get a BlobWriter for storing a file that is written piece by piece"""
+        return BlobWriter(self, url, sha256)
+
+    def _add_url(self, url, digest):
+        path = self._url_path(url)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        (fd, tmp) = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            f.write(digest + "\n")
+        os.replace(tmp, path)
+
+    def trim(self, max_size):
+        """Remove the least recently used files until at most max_size bytes
+        are used"""
+        blobs = []
+        for path in (self.root / "blobs").glob("*/*"):
+            try:
+                st = path.stat()
+            except OSError:
+                continue
+            blobs.append((st.st_mtime_ns, st.st_size, path))
+        total = sum(size for (_, size, _) in blobs)
+        for (_, size, path) in sorted(blobs):
+            if total <= max_size:
+                break
+            logger.debug("Removing %s from download cache", path)
+            _unlink(path)
+            total -= size
+
+
+class BlobWriter:
+    """Writes a file to a BlobStore while calculating its hash
+
+    The file is written to a temporary file, which is moved into the store when
+    the writer is committed. Used as a context manager, the writer is
+    committed on success and discarded if an exception is raised.
+    """
+
+    def __init__(self, store, url=None, sha256=None):
+        self.store = store
+        self.url = url
+        self.sha256 = sha256.lower() if sha256 else None
+        self.path = None
+        self._hash = hashlib.sha256()
+        tmpdir = store.root / "tmp"
+        tmpdir.mkdir(parents=True, exist_ok=True)
+        (fd, self._tmp) = tempfile.mkstemp(dir=tmpdir)
+        self._f = os.fdopen(fd, "wb")
+
+    def write(self, data):
+        self._hash.update(data)
+        self._f.write(data)
+
+    def commit(self):
+        """Verify the contents and move the file into the store"""
+        self._f.close()
+        digest = self._hash.hexdigest()
+        if self.sha256 and digest != self.sha256:
+            self.discard()
+            source = f" for '{self.url}'" if self.url else ""
+            raise RuntimeError(
+                f"Checksum mismatch{source}. Expected sha256 {self.sha256}, "
+                f"got {digest}"
+            )
+        path = self.store._blob_path(digest)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(self._tmp, path)
+        if self.url:
+            self.store._add_url(self.url, digest)
+        self.path = path
+        return path
+
+    def discard(self):
+        self._f.close()
+        _unlink(self._tmp)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.discard()
+
+
+def _unlink(path):
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
@@ -3,8 +3,10 @@
 # SPDX-License-Identifier: BSD-2-Clause
 
 # FIXME: Add IP-XACT support
+import hashlib
 import logging
 import os
+import pickle
 import shutil
 import warnings
 
@@ -16,8 +18,10 @@ except ImportError:
     from edalize import get_edatools
 
 from fusesoc import utils
-from fusesoc.capi2.exprs import Exprs
+from fusesoc.capi2.exprs import Exprs, FlagDefs
+from fusesoc.filesync import EXPORT_MODES, sync_files
 from fusesoc.provider import get_provider
+from fusesoc.timing import timings
 from fusesoc.vlnv import Vlnv
 
 logger = logging.getLogger(__name__)
@@ -63,8 +67,9 @@ class StringWithUseFlags(str):
         self.exprs = None
 
     def parse(self, flags):
+        """Expand the string for a flags dictionary or a FlagDefs object"""
         if self.exprs is None:
-            self.exprs = Exprs(str(self))
+            self.exprs = Exprs.cached(str(self))
         return self.exprs.expand(flags)
 
 
@@ -189,6 +194,9 @@ class Core:
         # Populated by CoreDB._solve(). TODO: Find a better solution for that.
         self.direct_deps = []
 
+        # Results of flag-dependent queries, see _memoized()
+        self._memo = {}
+
         try:
             _root = Root(utils.yaml_fread(self.core_file))
         except KeyError as e:
@@ -225,6 +233,7 @@ class Core:
             # How about a setup function or setters?
             self.provider.core_root = self.core_root
             self.provider.files_root = self.files_root
+            self.provider.cache_root = cache_root
         else:
             self.files_root = self.core_root
 
@@ -233,14 +242,64 @@ class Core:
     def __repr__(self):
         return str(self.name)
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_memo"] = {}
+        return state
+
+    def _memoized(self, query, flags, compute):
+        """Get the result of compute(flags, flag_defs), computed once per query
+        and flags"""
+        frozen = utils.freeze_flags(flags)
+        key = (query, frozen)
+        try:
+            return self._memo[key]
+        except KeyError:
+            pass
+        result = self._memo[key] = compute(flags, self._flag_defs(flags, frozen))
+        return result
+
+    def _flag_defs(self, flags, frozen=None):
+        """Get the FlagDefs for flags, computed once per flags"""
+        if frozen is None:
+            frozen = utils.freeze_flags(flags)
+        key = ("flag_defs", frozen)
+        try:
+            return self._memo[key]
+        except KeyError:
+            flag_defs = self._memo[key] = FlagDefs.from_flags(flags)
+            return flag_defs
+
+    def invalidate_memo(self):
+        """Forget all memoized flag-dependent query results
+
+        This must be called after changing the targets or filesets of the core.
+        """
+        self._memo = {}
+
     def cache_status(self):
         if self.provider:
             return self.provider.status()
         else:
             return "local"
 
-    def export(self, dst_dir, flags={}):
-        if os.path.exists(dst_dir):
+    def export(self, dst_dir, flags={}, mode="sync", jobs=1):
+        """Export the files of the core to dst_dir
+
+        mode is one of the export modes in fusesoc.filesync. In copy mode,
+        dst_dir is removed before exporting. Otherwise only files which have
+        changed are copied and files left over from earlier exports are
+        removed. Up to jobs files are copied at the same time.
+
+        Returns the set of paths of all exported files.
+        """
+        if mode not in EXPORT_MODES:
+            raise RuntimeError(
+                "Invalid export mode '{}'. Allowed values are {}".format(
+                    mode, ", ".join(EXPORT_MODES)
+                )
+            )
+        if mode == "copy" and os.path.exists(dst_dir):
             shutil.rmtree(dst_dir)
 
         src_files = [f["name"] for f in self.get_files(flags)]
@@ -249,17 +308,14 @@ class Core:
             src_files += [
                 f.name for f in v["src_files"] + v["inc_files"]
             ]  # FIXME include files
-        self._debug("Exporting {}".format(str(src_files)))
+        self._debug("Exporting %s", src_files)
 
         for scripts in self._get_script_names(flags).values():
             for script in scripts:
                 for fs in script.filesets:
                     src_files += [f.name for f in self.filesets[fs].files]
 
-        dirs = list(set(map(os.path.dirname, src_files)))
-        for d in dirs:
-            os.makedirs(os.path.join(dst_dir, d), exist_ok=True)
-
+        files = {}
         for f in src_files:
             if f.startswith(".."):
                 warnings.warn(
@@ -272,25 +328,18 @@ class Core:
                 )
             if not os.path.isabs(f):
                 if os.path.exists(os.path.join(self.core_root, f)):
-                    src = os.path.join(self.core_root, f)
-                    dst = os.path.join(dst_dir, f)
-                    try:
-                        shutil.copyfile(src, dst)
-                    except IsADirectoryError:
-                        shutil.copytree(src, dst, dirs_exist_ok=True)
+                    files[f] = os.path.join(self.core_root, f)
                 elif os.path.exists(os.path.join(self.files_root, f)):
-                    src = os.path.join(self.files_root, f)
-                    dst = os.path.join(dst_dir, f)
-                    try:
-                        shutil.copyfile(src, dst)
-                    except IsADirectoryError:
-                        shutil.copytree(src, dst, dirs_exist_ok=True)
+                    files[f] = os.path.join(self.files_root, f)
                 else:
                     raise RuntimeError(
                         "Cannot find %s in :\n\t%s\n\t%s"
                         % (f, self.files_root, self.core_root)
                     )
 
+        os.makedirs(dst_dir, exist_ok=True)
+        return sync_files(files, dst_dir, mode, delete=True, jobs=jobs)
+
     def _get_script_names(self, flags):
         target = self._get_target(flags)
         hooks = {}
@@ -300,7 +349,7 @@ class Core:
                 scripts = getattr(target.hooks, hook)
                 if scripts:
                     hooks[hook] = []
-                    for script in self._parse_list(flags, scripts):
+                    for script in self._parse_list(self._flag_defs(flags), scripts):
                         if not script in self.scripts:
                             raise SyntaxError(
                                 "Script '{}', requested by target '{}', was not found".format(
@@ -325,7 +374,7 @@ class Core:
         return flags
 
     def get_flow(self, flags):
-        self._debug("Getting flow for flags {}".format(str(flags)))
+        self._debug("Getting flow for flags %s", flags)
         flow = None
         if flags.get("flow"):
             flow = flags["flow"]
@@ -337,13 +386,13 @@ class Core:
                 flow = str(target.flow)
 
         if flow:
-            self._debug(f" Matched flow {flow}")
+            self._debug(" Matched flow %s", flow)
         else:
             self._debug(" Matched no flow")
         return flow
 
     def get_scripts(self, files_root, flags):
-        self._debug("Getting hooks for flags '{}'".format(str(flags)))
+        self._debug("Getting hooks for flags '%s'", flags)
         hooks = {}
 
         for hook, scripts in self._get_script_names(flags).items():
@@ -357,14 +406,13 @@ class Core:
                     "env": env,
                 }
                 hooks[hook].append(_script)
-                _s = " Matched {} hook {}"
-                self._debug(_s.format(hook, str(_script)))
+                self._debug(" Matched %s hook %s", hook, _script)
         return hooks
 
     def get_tool_options(self, flags):
         _flags = flags.copy()
 
-        self._debug("Getting tool options for flags {}".format(str(_flags)))
+        self._debug("Getting tool options for flags %s", _flags)
         target = self._get_target(_flags)
         section = None
         try:
@@ -384,17 +432,17 @@ class Core:
                     _member = getattr(section, member)
                     if _member:
                         options[member] = [str(x) for x in _member]
-        self._debug("Found tool options {}".format(str(options)))
+        self._debug("Found tool options %s", options)
         return options
 
     def get_flow_options(self, flags):
         _flags = flags.copy()
 
-        self._debug("Getting flow options for flags {}".format(str(_flags)))
+        self._debug("Getting flow options for flags %s", _flags)
         target = self._get_target(_flags)
 
         if target and target.flow_options:
-            self._debug(f"Found flow options {target.flow_options}")
+            self._debug("Found flow options %s", target.flow_options)
         else:
             self._debug("Found no flow options")
 
@@ -402,18 +450,23 @@ class Core:
 
     def get_depends(self, flags):  # Add use flags?
         depends = []
-        self._debug("Getting dependencies for flags {}".format(str(flags)))
+        self._debug("Getting dependencies for flags %s", flags)
+        flag_defs = self._flag_defs(flags)
         for fs in self._get_filesets(flags):
-            depends += [Vlnv(d) for d in self._parse_list(flags, fs.depend)]
+            depends += [Vlnv(d) for d in self._parse_list(flag_defs, fs.depend)]
         return depends
 
     def get_files(self, flags):
+        # Return copies, as callers are free to modify the file dicts
+        return [dict(f) for f in self._memoized("files", flags, self._get_files)]
+
+    def _get_files(self, flags, flag_defs):
         src_files = []
         for fs in self._get_filesets(flags):
             src_files += fs.files
         _src_files = []
         for f in src_files:
-            pf = f.name.parse(flags)
+            pf = f.name.parse(flag_defs)
             if pf:
                 _f = {}
                 for k, v in vars(f).items():
@@ -434,6 +487,15 @@ class Core:
         """Get a list of "virtual" VLNVs provided by this core."""
         return self.virtual
 
+    def dependency_fingerprint(self):
+        """Get a hash of everything in the core that affects dependency resolution"""
+        return _dependency_fingerprint(
+            self.name,
+            self.virtual,
+            {k: v.filesets for k, v in self.targets.items()},
+            {k: v.depend for k, v in self.filesets.items()},
+        )
+
     def get_parameters(self, flags={}, ext_parameters={}):
         def _parse_param_value(name, datatype, default):
             if datatype == "bool":
@@ -491,13 +553,14 @@ class Core:
 
             return parsed_param
 
-        self._debug("Getting parameters for flags '{}'".format(str(flags)))
+        self._debug("Getting parameters for flags '%s'", flags)
         target = self._get_target(flags)
         parameters = {}
+        flag_defs = self._flag_defs(flags)
 
         if target:
             for _param in target.parameters:
-                plist = _param.parse(flags).split("=", 1)
+                plist = _param.parse(flag_defs).split("=", 1)
 
                 p = plist[0]
 
@@ -508,7 +571,7 @@ class Core:
 
                 # The parameter exists either in this core...
                 if p in self.parameters:
-                    parameters[p] = _parse_param(flags, p, self.parameters[p])
+                    parameters[p] = _parse_param(flag_defs, p, self.parameters[p])
 
                 # ...or in any of its dependencies
                 elif p in ext_parameters:
@@ -528,24 +591,24 @@ class Core:
                         p, parameters[p]["datatype"], plist[1]
                     )
 
-            self._debug(f"Found parameters {parameters}")
+            self._debug("Found parameters %s", parameters)
         return parameters
 
     def get_toplevel(self, flags):
         _flags = flags.copy()
         _flags["is_toplevel"] = True  # FIXME: Is this correct?
-        self._debug("Getting toplevel for flags {}".format(str(_flags)))
+        self._debug("Getting toplevel for flags %s", _flags)
         target = self._get_target(_flags)
         if target.toplevel:
-            toplevel = self._parse_list(_flags, target.toplevel)
-            self._debug(f"Matched toplevel {toplevel}")
+            toplevel = self._parse_list(self._flag_defs(_flags), target.toplevel)
+            self._debug("Matched toplevel %s", toplevel)
             return " ".join(toplevel)
         else:
             s = "{} : Target '{}' has no toplevel"
             raise SyntaxError(s.format(self.name, target.name))
 
     def get_ttptttg(self, flags):
-        self._debug("Getting ttptttg for flags {}".format(str(flags)))
+        self._debug("Getting ttptttg for flags %s", flags)
         target = self._get_target(flags)
         ttptttg = []
 
@@ -553,14 +616,15 @@ class Core:
             return ttptttg
 
         _ttptttg = []
+        flag_defs = self._flag_defs(flags)
         for f in target.generate:
-            pf = f.name.parse(flags)
+            pf = f.name.parse(flag_defs)
             # f.name might end up empty after parse. In that case, we ignore it
             if pf:
                 _ttptttg.append({"name": pf, "params": f.params})
 
         if _ttptttg:
-            self._debug(f" Matched generator instances {_ttptttg}")
+            self._debug(" Matched generator instances %s", _ttptttg)
         for gen in _ttptttg:
             gen_name = gen["name"]
             if not gen_name in self.generate:
@@ -585,7 +649,7 @@ class Core:
         target = self._get_target(flags)
         if not target:
             return vpi
-        for vpi_name in self._parse_list(flags, target.vpi):
+        for vpi_name in self._parse_list(self._flag_defs(flags), target.vpi):
             vpi_lib = self.vpi[vpi_name]
             files = []
             incfiles = []  # Really do this automatically?
@@ -603,11 +667,11 @@ class Core:
         return vpi
 
     def get_vpi(self, flags):
-        self._debug(f"Getting VPI libraries for flags {flags}")
+        self._debug("Getting VPI libraries for flags %s", flags)
         target = self._get_target(flags)
         vpi = []
         _vpi = self._get_vpi(flags)
-        self._debug(" Matched VPI libraries {}".format([v for v in _vpi]))
+        self._debug(" Matched VPI libraries %s", list(_vpi))
         for k, v in sorted(_vpi.items()):
             vpi.append(
                 {
@@ -645,44 +709,26 @@ Targets:
         )
 
     def patch(self, dst_dir):
-        # FIXME: Use native python patch instead
-        patches = self.provider.patches
-        for f in patches:
-            patch_file = os.path.abspath(os.path.join(self.core_root, f))
-            if os.path.isfile(patch_file):
-                self._debug(
-                    "  applying patch file: "
-                    + patch_file
-                    + "\n"
-                    + "                   to: "
-                    + os.path.join(dst_dir)
-                )
-                try:
-                    utils.Launcher(
-                        "git",
-                        [
-                            "apply",
-                            "--unsafe-paths",
-                            "--directory",
-                            os.path.join(dst_dir),
-                            patch_file,
-                        ],
-                    ).run()
-                except OSError:
-                    print("Error: Failed to call external command 'patch'")
-                    return False
+        self.provider.patch(dst_dir)
         return True
 
     def setup(self):
-        if self.provider:
-            if self.provider.fetch():
-                self.patch(self.files_root)
+        # Patches are applied by the provider as part of the fetch
+        with timings.phase("setup", self.name):
+            if self.provider:
+                self.provider.fetch()
 
-    def _debug(self, msg):
-        logger.debug("{} : {}".format(str(self.name), msg))
+    def _debug(self, msg, *args):
+        # Formatting flags and file lists is expensive, so only do it if the
+        # message is going to be emitted
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("%s : " + msg, self.name, *args)
 
     def _get_target(self, flags):
-        self._debug(" Resolving target for flags '{}'".format(str(flags)))
+        return self._memoized("target", flags, self._resolve_target)
+
+    def _resolve_target(self, flags, flag_defs):
+        self._debug(" Resolving target for flags '%s'", flags)
 
         target_name = None
         if flags.get("is_toplevel") and flags.get("target"):
@@ -691,19 +737,22 @@ Targets:
             target_name = "default"
 
         if target_name in self.targets:
-            self._debug(f" Matched target {target_name}")
+            self._debug(" Matched target %s", target_name)
             return self.targets[target_name]
         else:
             self._debug("Matched no target")
 
     def _get_filesets(self, flags):
-        self._debug("Getting filesets for flags '{}'".format(str(flags)))
+        return self._memoized("filesets", flags, self._resolve_filesets)
+
+    def _resolve_filesets(self, flags, flag_defs):
+        self._debug("Getting filesets for flags '%s'", flags)
         target = self._get_target(flags)
         if not target:
             return []
         filesets = []
 
-        for fs in self._parse_list(flags, target.filesets):
+        for fs in self._parse_list(flag_defs, target.filesets):
             if not fs in self.filesets:
                 raise SyntaxError(
                     "{} : Fileset '{}', requested by target '{}', was not found".format(
@@ -712,13 +761,13 @@ Targets:
                 )
             filesets.append(self.filesets[fs])
 
-        self._debug(f" Matched filesets {target.filesets}")
+        self._debug(" Matched filesets %s", target.filesets)
         return filesets
 
-    def _parse_list(self, flags, l):
+    def _parse_list(self, flag_defs, l):
         r = []
         for x in l:
-            _x = x.parse(flags)
+            _x = x.parse(flag_defs)
             if _x:
                 r.append(_x)
         return r
@@ -726,6 +775,216 @@ Targets:
     # return [x.parse(flags) for x in l if x.parse(flags)]
 
 
+class LazyCore:
+    """A core which is only parsed in full when it is used
+
+    When a library is scanned, only the information needed for dependency
+    resolution is extracted from the core file: the name, the virtual cores it
+    provides and the depend expressions of each target and fileset. The full
+    Core object is created the first time any other attribute is accessed, and
+    all further attribute lookups are forwarded to it.
+    """
+
+    capi_version = 2
+
+    def __init__(self, core_file, cache_root=""):
+        self._init(core_file, cache_root)
+
+        try:
+            tree = utils.yaml_fread(self.core_file)
+        except (yaml.scanner.ScannerError, yaml.constructor.ConstructorError) as e:
+            raise SyntaxError(str(e))
+        if not isinstance(tree, dict):
+            raise SyntaxError("Error while trying to parse the core file")
+
+        if not tree.get("name"):
+            raise SyntaxError("Missing 'name' parameter")
+        if not isinstance(tree["name"], str):
+            raise SyntaxError("The 'name' parameter must be a string")
+        self.name = Vlnv(tree["name"])
+        self.description = tree.get("description")
+        self.virtual = [Vlnv(v) for v in self._tree_list(tree, "virtual")]
+        self._has_provider = bool(tree.get("provider"))
+
+        self._target_filesets = {}
+        for name, target in (self._tree_dict(tree, "targets")).items():
+            target = self._section(target, f"targets.{name}")
+            self._target_filesets[name] = [
+                StringWithUseFlags(fs) for fs in self._tree_list(target, "filesets")
+            ]
+        self._fileset_depends = {}
+        for name, fileset in (self._tree_dict(tree, "filesets")).items():
+            fileset = self._section(fileset, f"filesets.{name}")
+            self._fileset_depends[name] = [
+                StringWithUseFlags(d) for d in self._tree_list(fileset, "depend")
+            ]
+        self._fingerprint = _dependency_fingerprint(
+            self.name, self.virtual, self._target_filesets, self._fileset_depends
+        )
+
+    @classmethod
+    def from_core(cls, core, cache_root=""):
+        """Create a LazyCore from an already parsed Core
+
+        The Core is serialized and kept with the LazyCore, so that it can be
+        restored without parsing the core file again.
+        """
+        lazy = cls.__new__(cls)
+        lazy._init(core.core_file, cache_root)
+        lazy.name = core.name
+        lazy.description = core.description
+        lazy.virtual = core.virtual
+        lazy._has_provider = bool(core.provider)
+        lazy._target_filesets = {k: v.filesets for k, v in core.targets.items()}
+        lazy._fileset_depends = {k: v.depend for k, v in core.filesets.items()}
+        lazy._fingerprint = core.dependency_fingerprint()
+        lazy._payload = pickle.dumps(core, pickle.HIGHEST_PROTOCOL)
+        return lazy
+
+    def _init(self, core_file, cache_root):
+        self.core_file = str(core_file)
+        self.core_root = os.path.dirname(self.core_file)
+        self.cache_root = cache_root
+        self.is_generated = False
+
+        # Populated by CoreDB._solve(). TODO: Find a better solution for that.
+        self.direct_deps = []
+
+        self._core = None
+        self._payload = None
+
+    @staticmethod
+    def _tree_dict(tree, key):
+        d = tree.get(key) or {}
+        if not isinstance(d, dict):
+            raise SyntaxError(f"Object in '{key}' section must be a dict")
+        return d
+
+    @staticmethod
+    def _section(section, name):
+        if section is None:
+            return {}
+        if not isinstance(section, dict):
+            raise SyntaxError(f"Object in '{name}' section must be a dict")
+        return section
+
+    @staticmethod
+    def _tree_list(tree, key):
+        l = []
+        for k in [key, key + "_append"]:
+            v = tree.get(k) or []
+            if not isinstance(v, list):
+                raise SyntaxError(f"Object in '{k}' section must be a list")
+            if not all(isinstance(x, str) for x in v):
+                raise SyntaxError(f"Items in '{k}' section must be strings")
+            l += v
+        return l
+
+    def load(self):
+        """Get the full core, parsing the core file if needed
+
+        Errors in the core file are raised as a RuntimeError.
+        """
+        if self._core is None:
+            core = None
+            if self._payload:
+                try:
+                    core = pickle.loads(self._payload)
+                except Exception as e:
+                    logger.debug("Failed to restore %s: %s", self.name, e)
+            if core is None:
+                logger.debug("Parsing core file %s", self.core_file)
+                try:
+                    core = Core(self.core_file, self.cache_root)
+                except SyntaxError as e:
+                    raise RuntimeError(
+                        f"Parse error in core file {self.core_file}: {e.msg}"
+                    )
+                except ImportError as e:
+                    raise RuntimeError(
+                        f"Unknown provider in core file {self.core_file}: {e}"
+                    )
+                except ValueError as e:
+                    raise RuntimeError(f"Error in core file {self.core_file}: {e}")
+
+            # Share the name with the full core, as the relation of the name
+            # might be changed by the core manager
+            core.name = self.name
+            self._core = core
+            self._payload = None
+        return self._core
+
+    def __getattr__(self, name):
+        # Only called for attributes which are not part of the header
+        if name.startswith("__") or "_core" not in self.__dict__:
+            raise AttributeError(name)
+        return getattr(self.load(), name)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_core"] = None
+        return state
+
+    def __repr__(self):
+        return str(self.name)
+
+    def cache_status(self):
+        if self._has_provider:
+            return self.load().cache_status()
+        else:
+            return "local"
+
+    def get_virtuals(self):
+        """Get a list of "virtual" VLNVs provided by this core."""
+        return self.virtual
+
+    def dependency_fingerprint(self):
+        return self._fingerprint
+
+    def get_depends(self, flags):
+        if flags.get("is_toplevel") and flags.get("target"):
+            target_name = flags.get("target")
+        else:
+            target_name = "default"
+
+        depends = []
+        flag_defs = FlagDefs.from_flags(flags)
+        for fs in self._parse_list(
+            flag_defs, self._target_filesets.get(target_name, [])
+        ):
+            if not fs in self._fileset_depends:
+                raise SyntaxError(
+                    "{} : Fileset '{}', requested by target '{}', was not found".format(
+                        self.name, fs, target_name
+                    )
+                )
+            depends += [
+                Vlnv(d) for d in self._parse_list(flag_defs, self._fileset_depends[fs])
+            ]
+        return depends
+
+    def _parse_list(self, flag_defs, l):
+        r = []
+        for x in l:
+            _x = x.parse(flag_defs)
+            if _x:
+                r.append(_x)
+        return r
+
+
+def _dependency_fingerprint(name, virtual, target_filesets, fileset_depends):
+    """Hash the name, virtual cores, target filesets and fileset dependencies
+    of a core, which together determine how the core takes part in dependency
+    resolution"""
+    data = (
+        str(name),
+        sorted(str(v) for v in virtual),
+        sorted((k, [str(fs) for fs in v]) for k, v in target_filesets.items()),
+        sorted((k, [str(d) for d in v]) for k, v in fileset_depends.items()),
+    )
+    return hashlib.sha256(repr(data).encode()).hexdigest()
+
+
 description = """
 ---
 Root:
@@ -29,175 +29,234 @@ containing each word that matched.
 
 """
 
-from pyparsing import (
-    Forward,
-    Group,
-    OneOrMore,
-    Optional,
-    ParseException,
-    Suppress,
-    Word,
-    alphanums,
-)
+import string as _string
 
+from fusesoc.utils import LRUCache
 
-def _cond_parse_action(string, location, tokens):
-    """A parse action for conditional terms"""
-    # A conditional term (see _make_cond_parser) has 2 or 3 tokens, depending
-    # on whether it was negated or not.
-    assert len(tokens) in [2, 3]
+_WORD_CHARS = frozenset(_string.ascii_letters + _string.digits + ":<>.[]_-,=~/^+")
+_WHITESPACE = frozenset(" \t\n\r")
+_PLAIN_CHARS = _WORD_CHARS | _WHITESPACE
 
-    return (
-        (True, tokens[1], tokens[2])
-        if len(tokens) == 3
-        else (False, tokens[0], tokens[1])
-    )
 
+class _Parser:
+    """A recursive descent parser for the exprs syntax
 
-_PARSER = None
+    The parser produces a simplified AST: a list whose items are strings
+    (representing bare words) or tuples of the form (negated, flag, ast), where
+    negated is a bool, flag is a string and ast is another simplified ast.
+    Adjacent bare words are merged, so "a b" parses to ["a b"]. This is much
+    more efficient to match against flags for the vast majority of ASTs, which
+    have many more raw words than they have conditions.
 
+    """
 
-def _get_parser():
-    """Return a pyparsing parser for the exprs syntax
+    def __init__(self, string):
+        self.string = string
+        self.pos = 0
+
+    def parse(self):
+        ast = self._exprs()
+        self._skip_whitespace()
+        if self.pos < len(self.string):
+            self._error("end of text")
+        return ast
+
+    def _error(self, expected):
+        if self.pos < len(self.string):
+            found = repr(self.string[self.pos])
+        else:
+            found = "end of text"
+        line = self.string.count("\n", 0, self.pos) + 1
+        col = self.pos - (self.string.rfind("\n", 0, self.pos) + 1) + 1
+        raise ValueError(
+            f"Invalid syntax for string: Expected {expected}, found {found}  "
+            f"(at char {self.pos}), (line:{line}, col:{col}). "
+            f"Parsed text was {self.string!r}."
+        )
+
+    def _skip_whitespace(self):
+        string = self.string
+        while self.pos < len(string) and string[self.pos] in _WHITESPACE:
+            self.pos += 1
+
+    def _peek(self):
+        self._skip_whitespace()
+        return self.string[self.pos] if self.pos < len(self.string) else ""
+
+    def _expect(self, char):
+        if self._peek() != char:
+            self._error(repr(char))
+        self.pos += 1
+
+    def _word(self):
+        self._skip_whitespace()
+        string = self.string
+        start = self.pos
+        while self.pos < len(string) and string[self.pos] in _WORD_CHARS:
+            self.pos += 1
+        if self.pos == start:
+            self._error("word")
+        return string[start : self.pos]
+
+    def _exprs(self):
+        children = []
+        str_acc = []
+        while True:
+            negated = self._peek() == "!"
+            if negated:
+                self.pos += 1
+            word = self._word()
+
+            if self._peek() == "?":
+                self.pos += 1
+                self._expect("(")
+                exprs = self._exprs()
+                self._expect(")")
+                if str_acc:
+                    children.append(" ".join(str_acc))
+                    str_acc = []
+                children.append((negated, word, exprs))
+            elif negated:
+                self._error("'?'")
+            else:
+                str_acc.append(word)
+
+            c = self._peek()
+            if not (c == "!" or c in _WORD_CHARS):
+                break
 
-    This returns a basic "AST" that consists of a list of "exprs". Each expr is
-    represented by either a string (if it's just a word) or a tuple of the form
-    (negated, flag, exprs).
+        if str_acc:
+            children.append(" ".join(str_acc))
+        return children
 
-    Here, negated is a boolean which is true if the condition should be
-    negated. flag is a word giving the flag to match for the condition. exprs
-    is the AST for the list of exprs inside the parentheses.
 
-    To avoid creating the parser repeatedly, this function is memoized.
+def _parse(string):
+    """Parse a string to a simplified AST.
+
+    Raises a ValueError if the string is malformed in some way.
 
     """
-    global _PARSER
-    if _PARSER is not None:
-        return _PARSER
-
-    word = Word(alphanums + ":<>.[]_-,=~/^+")
-    exprs = Forward()
-
-    conditional = (
-        Optional("!")
-        + word
-        + Suppress("?")
-        + Suppress("(")
-        + Group(exprs)
-        + Suppress(")")
-    )
-    exprs <<= OneOrMore(conditional ^ word)
-    conditional.setParseAction(_cond_parse_action)
-    _PARSER = exprs
-    return _PARSER
-
-
-def _simplify_ast(raw_ast):
-    """Simplify an AST that comes out of the parser
-
-    As well as replacing pyparsing's ParseResults with bare lists, this merges
-    adjacent non-condition words. For example, "a b" parses to ["a", "b"]. This
-    function merges that to ["a b"].
-
-    The idea is that this will be much more efficient to match against tags for
-    the vast majority of ASTs, which have many more raw words than they have
-    conditions.
-
-    A simplified AST is a list whose items are strings (representing bare
-    words) or tuples of the form (negated, flag, ast), where negated is a bool,
-    flag is a string and ast is another simplified ast.
+    # Fast path for strings without any conditions
+    if _PLAIN_CHARS.issuperset(string):
+        words = string.split()
+        if words:
+            return [" ".join(words)]
+
+    return _Parser(string).parse()
+
+
+def _compile(ast):
+    """Compile a simplified AST to a flat tuple of operations
+
+    Each operation is either a string, which is added to the expansion, or a
+    tuple of the form (negated, flag, skip) which tests a condition. If the
+    condition is false, the next skip operations, which make up the body of
+    the conditional, are skipped. This allows expanding an AST with a single
+    loop instead of walking it recursively.
 
     """
-    children = []
-    str_acc = []
-    for expr in raw_ast:
-        if isinstance(expr, str):
-            str_acc.append(expr)
+    ops = []
+    for child in ast:
+        if isinstance(child, str):
+            ops.append(child)
             continue
 
-        # We have a term that isn't a string. This must be a conditional. Join
-        # together any items in str_acc and add them to children then recurse
-        # to simplify the conditional's sub-expression.
-        if str_acc:
-            children.append(" ".join(str_acc))
-            str_acc = []
+        negated, flag, exprs = child
+        body = _compile(exprs)
+        ops.append((negated, flag, len(body)))
+        ops += body
+    return tuple(ops)
 
-        negated, flag, exprs = expr
-        children.append((negated, flag, _simplify_ast(exprs)))
 
-    if str_acc:
-        children.append(" ".join(str_acc))
+def _run(ops, flag_defs):
+    """Run compiled operations for the given flag_defs.
 
-    return children
+    Returns a (possibly empty) list of strings
 
+    """
+    expanded = []
+    i = 0
+    n = len(ops)
+    while i < n:
+        op = ops[i]
+        i += 1
+        if type(op) is str:
+            expanded.append(op)
+        elif (op[1] in flag_defs) == op[0]:
+            # The condition was false
+            i += op[2]
+    return expanded
+
+
+class FlagDefs(frozenset):
+    """The set of flags that are defined by a flags dictionary
+
+    A flag with the value True defines its own name, and a flag with any other
+    value except False and None defines "<name>_<value>". Expanding many exprs
+    with the same flags is cheaper when a FlagDefs is created once and passed
+    to Exprs.expand instead of the flags dictionary.
 
-def _parse(string):
-    """Parse a string to a simplified AST.
+    """
 
-    Raises a ValueError if the string is malformed in some way.
+    @classmethod
+    def from_flags(cls, flags):
+        """Get the FlagDefs for flags, which can also be a FlagDefs already"""
+        if isinstance(flags, FlagDefs):
+            return flags
+        ret = []
+        for k, v in flags.items():
+            if v is True:
+                ret.append(k)
+            elif v not in [False, None]:
+                ret.append(k + "_" + v)
+        return cls(ret)
 
-    """
-    try:
-        raw_ast = _get_parser().parseString(string, parseAll=True)
-    except ParseException as err:
-        raise ValueError(
-            f"Invalid syntax for string: {err}. Parsed text was {string!r}."
-        ) from None
 
-    return _simplify_ast(raw_ast)
+# Parsed exprs indexed by source string, shared by all cores. Most strings in
+# core files (file types, dependencies, common conditionals) are repeated many
+# times, so this avoids parsing each of them more than once.
+_CACHE = LRUCache(maxsize=16384)
+
+
+def cache_info():
+    """Get hit, miss and eviction statistics for the shared exprs cache"""
+    return _CACHE.info()
 
 
 class Exprs:
     """A parsed list of exprs"""
 
+    @classmethod
+    def cached(cls, string):
+        """Get a shared Exprs object for string, parsing it only if needed
+
+        Exprs objects are immutable after creation, so the same object can be
+        used by all strings with the same contents.
+        """
+        exprs = _CACHE.get(string)
+        if exprs is None:
+            exprs = cls(string)
+            _CACHE.put(string, exprs)
+        return exprs
+
     def __init__(self, string):
         self.ast = _parse(string)
         self.as_string = None
+        self.ops = None
 
         # An extra optimisation for the common case where the whole ast boils
         # down to a single string with no conditions.
         if len(self.ast) == 1 and isinstance(self.ast[0], str):
             self.as_string = self.ast[0]
+        else:
+            self.ops = _compile(self.ast)
 
-    @staticmethod
-    def _expand(ast, flag_defs):
-        """Expand ast for the given flag_defs.
-
-        Returns a (possibly empty) list of strings
+    def expand(self, flags):
+        """Expand the parsed string in the presence of the given flags
 
+        flags is either a flags dictionary or a FlagDefs object
         """
-        expanded = []
-        for child in ast:
-            if isinstance(child, str):
-                expanded.append(child)
-                continue
-
-            # We have a conditional expression. Is the condition true? If not,
-            # skip it.
-            negated, flag, exprs = child
-            if (flag in flag_defs) == negated:
-                # The condition was false
-                continue
-
-            # The condition was true
-            expanded += Exprs._expand(exprs, flag_defs)
-        return expanded
-
-    @staticmethod
-    def _flags_to_flag_defs(flags):
-        """Convert a flags dictionary to the set of flags that are defined"""
-        ret = []
-        for k, v in flags.items():
-            if v is True:
-                ret.append(k)
-            elif v not in [False, None]:
-                ret.append(k + "_" + v)
-        return set(ret)
-
-    def expand(self, flags):
-        """Expand the parsed string in the presence of the given flags"""
         if self.as_string is not None:
             return self.as_string
 
-        flag_defs = Exprs._flags_to_flag_defs(flags)
-        return " ".join(Exprs._expand(self.ast, flag_defs))
+        return " ".join(_run(self.ops, FlagDefs.from_flags(flags)))
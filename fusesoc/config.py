@@ -9,6 +9,7 @@ from configparser import ConfigParser as CP
 from pathlib import Path
 from typing import Optional
 
+from fusesoc.filesync import EXPORT_MODES
 from fusesoc.librarymanager import Library
 
 logger = logging.getLogger(__name__)
@@ -54,6 +55,12 @@ class Config:
         systems_root = self._get_systems_root(config)
         self.library_root = self._get_library_root(config)
         self.ignored_dirs = self._get_ignored_dirs(config)
+        self.jobs = self._get_jobs(config, "jobs")
+        self.fetch_jobs = self._get_jobs(config, "fetch_jobs")
+        self.export_jobs = self._get_jobs(config, "export_jobs")
+        self.solver_cache_size = self._get_solver_cache_size(config)
+        self.download_cache_size = self._get_download_cache_size(config)
+        self.export_mode = self._get_export_mode(config)
 
         os.makedirs(self.cache_root, exist_ok=True)
 
@@ -177,6 +184,46 @@ class Config:
     def _get_ignored_dirs(self, config):
         return self._paths_from_cfg(config, "ignored_dirs")
 
+    def _get_jobs(self, config, option):
+        try:
+            jobs = config.getint("main", option, fallback=1)
+        except ValueError as e:
+            logger.warning(f"Error parsing {option} '{e}'. Using 1")
+            return 1
+        if jobs < 0:
+            logger.warning(f"Invalid number of {option} '{jobs}'. Using 1")
+            return 1
+        return jobs
+
+    def _get_solver_cache_size(self, config):
+        try:
+            size = config.getint("main", "solver_cache_size", fallback=256)
+        except ValueError as e:
+            logger.warning(f"Error parsing solver_cache_size '{e}'. Using 256")
+            return 256
+        if size < 0:
+            logger.warning(f"Invalid solver_cache_size '{size}'. Using 256")
+            return 256
+        return size
+
+    def _get_download_cache_size(self, config):
+        try:
+            size = config.getint("main", "download_cache_size", fallback=4096)
+        except ValueError as e:
+            logger.warning(f"Error parsing download_cache_size '{e}'. Using 4096")
+            return 4096
+        if size < 0:
+            logger.warning(f"Invalid download_cache_size '{size}'. Using 4096")
+            return 4096
+        return size
+
+    def _get_export_mode(self, config):
+        mode = config.get("main", "export_mode", fallback="sync")
+        if mode not in EXPORT_MODES:
+            logger.warning(f"Invalid export_mode '{mode}'. Using sync")
+            return "sync"
+        return mode
+
     def add_library(self, library):
         from fusesoc.provider import get_provider
 
@@ -211,7 +258,7 @@ class Config:
         except ImportError:
             raise RuntimeError("Invalid sync-type '{}'".format(library["sync-type"]))
 
-        provider.init_library(library)
+        provider.init_library(library, self.cache_root)
 
         with open(self._path, "w") as conf_file:
             config.write(conf_file)
@@ -0,0 +1,177 @@
+# Copyright FuseSoC contributors
+# Licensed under the 2-Clause BSD License, see LICENSE for details.
+# SPDX-License-Identifier: BSD-2-Clause
+
+import hashlib
+import logging
+import os
+import pickle
+import tempfile
+from pathlib import Path
+
+from fusesoc import __version__
+from fusesoc.utils import file_digest
+
+logger = logging.getLogger(__name__)
+
+
+class CoreIndex:
+    """Persistent index of parsed core files for a library
+
+    The index lives in <cache_root>/core_index and contains one file per
+    library. Each entry is keyed by the path of a core file and stores the
+    mtime, size and SHA-256 hash of the file together with the pickled
+    LazyCore, which in turn carries the serialized full Core. Cores whose files
+    are unchanged are rehydrated from the index instead of being parsed again.
+
+    The index also keeps a snapshot of the directory tree of the library, with
+    the mtime and the scanner listing of each directory. Directories whose mtime
+    is unchanged don't have to be listed again.
+    """
+
+    # Bump when the layout of the index or of the stored objects changes
+    FORMAT = 5
+
+    def __init__(self, cache_root, library_path, rebuild=False):
+        self.cache_root = str(cache_root)
+        _id = hashlib.sha256(str(library_path).encode()).hexdigest()[:16]
+        self.path = Path(cache_root) / "core_index" / (_id + ".pickle")
+        self._entries = {}
+        self._seen = set()
+        self._dirs = {}
+        self._seen_dirs = set()
+        self._dirty = False
+
+        if rebuild:
+            logger.debug(f"Rebuilding core index {self.path}")
+            self._dirty = True
+        else:
+            self._load()
+
+    def _header(self):
+        return (self.FORMAT, __version__, self.cache_root)
+
+    def _load(self):
+        try:
+            with open(self.path, "rb") as f:
+                data = pickle.load(f)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            logger.debug(f"Ignoring unreadable core index {self.path}: {e}")
+            return
+
+        if data.get("header") != self._header():
+            logger.debug(f"Ignoring outdated core index {self.path}")
+            return
+        self._entries = data["entries"]
+        self._dirs = data["dirs"]
+
+    def save(self):
+        """Write the index to disk if it has changed
+
+        Entries for core files and directories that were not seen since the
+        index was loaded are dropped.
+        """
+        stale = set(self._entries) - self._seen
+        for core_file in stale:
+            del self._entries[core_file]
+        stale_dirs = set(self._dirs) - self._seen_dirs
+        for d in stale_dirs:
+            del self._dirs[d]
+        if not (self._dirty or stale or stale_dirs):
+            return
+
+        data = {"header": self._header(), "entries": self._entries, "dirs": self._dirs}
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            # Write to a temporary file and rename it into place to avoid
+            # leaving a truncated index behind if we are interrupted
+            (fd, tmp) = tempfile.mkstemp(dir=self.path.parent, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(data, f, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            logger.warning(f"Failed to write core index {self.path}: {e}")
+            return
+        self._dirty = False
+
+    def get(self, core_file):
+        """Get a LazyCore object for core_file from the index
+
+        Returns None if the file is not in the index or has changed since it
+        was indexed.
+        """
+        core_file = str(core_file)
+        self._seen.add(core_file)
+        entry = self._entries.get(core_file)
+        if entry is None:
+            return None
+
+        (mtime, size, digest, payload) = entry
+        try:
+            st = os.stat(core_file)
+        except OSError:
+            return None
+
+        if (st.st_mtime_ns, st.st_size) != (mtime, size):
+            # The file was touched. Compare contents before giving up.
+            if st.st_size != size or file_digest(core_file) != digest:
+                return None
+            self._entries[core_file] = (st.st_mtime_ns, size, digest, payload)
+            self._dirty = True
+
+        try:
+            return pickle.loads(payload)
+        except Exception as e:
+            logger.debug(f"Failed to load {core_file} from core index: {e}")
+            return None
+
+    def put(self, core_file, core):
+        """Add or update the entry for core_file"""
+        core_file = str(core_file)
+        self._seen.add(core_file)
+        try:
+            st = os.stat(core_file)
+            with open(core_file, "rb") as f:
+                content = f.read()
+        except OSError:
+            return
+
+        # File names are subject to environment variable expansion when the
+        # core is parsed, so the parsed result depends on more than the file
+        # contents. Don't index such cores.
+        if b"$" in content:
+            self._entries.pop(core_file, None)
+            return
+
+        try:
+            payload = pickle.dumps(core, pickle.HIGHEST_PROTOCOL)
+        except Exception as e:
+            logger.debug(f"Not indexing {core_file}: {e}")
+            return
+
+        digest = hashlib.sha256(content).hexdigest()
+        self._entries[core_file] = (st.st_mtime_ns, st.st_size, digest, payload)
+        self._dirty = True
+
+    def get_dir(self, path, mtime):
+        """Get the stored listing of a directory
+
+        Returns None if the directory is not in the index or if its mtime
+        differs from the one stored in the index.
+        """
+        self._seen_dirs.add(path)
+        entry = self._dirs.get(path)
+        if entry is None or entry[0] is None or entry[0] != mtime:
+            return None
+        return entry[1]
+
+    def put_dir(self, path, mtime, listing):
+        """Add or update the listing of a directory
+
+        An mtime of None means that the listing must not be reused.
+        """
+        self._seen_dirs.add(path)
+        self._dirs[path] = (mtime, listing)
+        self._dirty = True
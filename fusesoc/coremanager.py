@@ -4,6 +4,9 @@
 
 import logging
 import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
 
 from okonomiyaki.versions import EnpkgVersion
@@ -14,12 +17,21 @@ from simplesat.pool import Pool
 from simplesat.repository import Repository
 from simplesat.request import Request
 
+from fusesoc import utils
+from fusesoc.blobstore import BlobStore
+from fusesoc.capi2.core import LazyCore
 from fusesoc.core import Core
+from fusesoc.coreindex import CoreIndex
 from fusesoc.librarymanager import LibraryManager
+from fusesoc.solvercache import PersistentSolverCache
+from fusesoc.timing import timings
 
 logger = logging.getLogger(__name__)
 
 
+_MISSING = object()
+
+
 class DependencyError(Exception):
     def __init__(self, value, msg=""):
         self.value = value
@@ -30,9 +42,21 @@ class DependencyError(Exception):
 
 
 class CoreDB:
-    def __init__(self):
+    def __init__(self, solver_cache_dir=None, solver_cache_size=256):
         self._cores = {}
-        self._solver_cache = {}
+        self._solver_cache = utils.LRUCache(solver_cache_size)
+        # Dependency resolution results from earlier invocations
+        if solver_cache_dir:
+            self._persistent_cache = PersistentSolverCache(solver_cache_dir)
+        else:
+            self._persistent_cache = None
+        # Names of all cores, and of all cores providing virtual cores, indexed
+        # by (vendor, library, name)
+        self._names = {}
+        self._providers = {}
+        # simplesat packages for each core, indexed by core name and flags
+        self._packages = {}
+        self._package_parser = PrettyPackageStringParser(EnpkgVersion.from_string)
 
     # simplesat doesn't allow ':', '-' or leading '_'
     def _package_name(self, vlnv):
@@ -57,6 +81,10 @@ class CoreDB:
                 )
         return ", ".join(deps)
 
+    @staticmethod
+    def _vln(vlnv):
+        return (vlnv.vendor, vlnv.library, vlnv.name)
+
     def _parse_virtual(self, virtuals):
         package_names = []
         for virtual in virtuals:
@@ -68,105 +96,245 @@ class CoreDB:
         self._solver_cache_invalidate_all()
 
         name = str(core.name)
-        logger.debug("Adding core " + name)
+        logger.debug("Adding core %s", name)
         if name in self._cores:
-            _s = "Replacing {} in {} with the version found in {}"
             logger.debug(
-                _s.format(name, self._cores[name]["core"].core_root, core.core_root)
+                "Replacing %s in %s with the version found in %s",
+                name,
+                self._cores[name]["core"].core_root,
+                core.core_root,
             )
+            for virtual in self._cores[name]["core"].get_virtuals():
+                self._providers[self._vln(virtual)].pop(name, None)
         self._cores[name] = {"core": core, "library": library}
+        self._packages.pop(name, None)
+
+        self._names.setdefault(self._vln(core.name), {})[name] = None
+        for virtual in core.get_virtuals():
+            self._providers.setdefault(self._vln(virtual), {})[name] = None
+
+    def _get_package(self, core, flags, flags_key):
+        """Get the simplesat package for a core
+
+        Packages are created once for each combination of core and flags and
+        reused for all later solver runs. A flags value of None creates a
+        package without dependencies.
+        """
+        packages = self._packages.setdefault(str(core.name), {})
+        package = packages.get(flags_key)
+        if package:
+            return package
+
+        # Build a "pretty" package string in a format expected by
+        # PrettyPackageStringParser()
+        package_str = "{} {}-{}".format(
+            self._package_name(core.name), core.name.version, core.name.revision
+        )
+
+        _virtuals = core.get_virtuals()
+        if _virtuals:
+            _s = "; provides ( {} )"
+            package_str += _s.format(self._parse_virtual(_virtuals))
+
+        if flags is not None:
+            _depends = core.get_depends(flags)
+            if _depends:
+                _s = "; depends ( {} )"
+                package_str += _s.format(self._parse_depend(_depends))
+
+        package = self._package_parser.parse_to_package(package_str)
+        package.core = core
+        package.depends = _depends if flags is not None else []
+        packages[flags_key] = package
+        return package
+
+    def _candidates(self, vln):
+        """Get the names of all cores which have the VLN vln or provide it as a
+        virtual core"""
+        return list(self._names.get(vln, {})) + [
+            name
+            for name in self._providers.get(vln, {})
+            if name not in self._names.get(vln, {})
+        ]
+
+    def _find(self, vlnv):
+        """Find the core with the highest version matching vlnv
+
+        Names which are provided by virtual cores are handed over to the
+        solver, which defines how versions of virtual cores are matched.
+        """
+        vln = self._vln(vlnv)
+        if not self._providers.get(vln):
+            requirement = Requirement._from_string(
+                "{} {} {}".format(
+                    self._package_name(vlnv), vlnv.relation, self._package_version(vlnv)
+                )
+            )
+            found = None
+            for name in self._names.get(vln, {}):
+                core = self._cores[name]["core"]
+                version = EnpkgVersion.from_string(self._package_version(core.name))
+                if requirement.matches(version) and (
+                    found is None or version > found[0]
+                ):
+                    found = (version, core)
+            if found:
+                return found[1]
+
+        # Let the solver deal with virtual cores and report errors
+        return self._solve(vlnv, only_matching_vlnv=True)[-1]
 
     def find(self, vlnv=None):
         if vlnv:
-            found = self._solve(vlnv, only_matching_vlnv=True)[-1]
+            found = self._find(vlnv)
         else:
             found = list([core["core"] for core in self._cores.values()])
         return found
 
     def _solver_cache_lookup(self, key):
-        if key in self._solver_cache:
-            return self._solver_cache[key]
-        return False
+        """Get a cached solution, or None if there is none
+
+        If the direct dependencies of the cores were stored with the solution,
+        they are restored, as they might have been overwritten by another solve.
+        """
+        cached = self._solver_cache.get(key, _MISSING)
+        if cached is _MISSING:
+            return None
+        (result, direct_deps) = cached
+        if direct_deps is not None:
+            for core in result:
+                core.direct_deps = direct_deps[str(core.name)]
+        return result
 
-    def _solver_cache_store(self, key, value):
-        self._solver_cache[key] = value
+    def _solver_cache_store(self, key, value, store_direct_deps=False):
+        if store_direct_deps:
+            direct_deps = {str(core.name): core.direct_deps for core in value}
+        else:
+            direct_deps = None
+        self._solver_cache.put(key, (value, direct_deps))
 
     def _solver_cache_invalidate(self, key):
-        if key in self._solver_cache:
-            del self._solver_cache[key]
+        self._solver_cache.pop(key)
 
     def _solver_cache_invalidate_all(self):
-        self._solver_cache = {}
+        self._solver_cache.clear()
+
+    def _solver_cache_key(self, top_core, flags, only_matching_vlnv):
+        # Vlnv objects compare equal regardless of relation and revision, so
+        # use the full string representation in the key
+        return (
+            top_core.relation,
+            str(top_core),
+            utils.freeze_flags(flags),
+            only_matching_vlnv,
+        )
 
-    def _hash_flags_dict(self, flags):
-        """Hash the flags dict.
+    def solver_cache_info(self):
+        """Get hit, miss and eviction statistics for the solver cache"""
+        return self._solver_cache.info()
 
-        Python's mutable sequences, like dict, are not generally hashable. For
-        the dict we're using for the flags, we can simply implement hashing
-        ourselves without the need to worry about nested dicts.
+    def _persistent_cache_key(self, top_core, flags):
+        _flags = repr(sorted(flags.items(), key=lambda x: x[0]))
+        return (top_core.relation + str(top_core), _flags)
+
+    def _dependency_closure(self, top_core, package_flags):
+        """Get all cores which the solver could have considered for top_core
+
+        Starting from top_core, this collects all cores with a matching VLN or
+        providing it, and continues with the dependencies of each of those
+        cores. The solver can not have looked at any other cores.
+
+        Returns:
+            A list of [vln, candidates] pairs, where candidates is a sorted list
+            of [core name, dependency fingerprint] pairs
+        """
+        closure = {}
+        queue = [self._vln(top_core)]
+        while queue:
+            vln = queue.pop()
+            if vln in closure:
+                continue
+            candidates = []
+            for name in self._candidates(vln):
+                core = self._cores[name]["core"]
+                candidates.append([name, core.dependency_fingerprint()])
+                (_flags, flags_key) = package_flags[core.name == top_core]
+                package = self._get_package(core, _flags, flags_key)
+                queue += [self._vln(d) for d in package.depends]
+            closure[vln] = sorted(candidates)
+        return [[list(vln), candidates] for (vln, candidates) in closure.items()]
+
+    def _persistent_cache_lookup(self, top_core, flags):
+        """Get a solution stored by an earlier invocation
+
+        The solution is only used if all cores that were considered when it was
+        found are still the same, i.e. if the same core names are found for
+        each VLN in the stored dependency closure and their dependency
+        declarations are unchanged.
         """
-        h = 0
-        for pair in sorted(flags.items()):
-            h ^= hash(pair)
-        return h
+        entry = self._persistent_cache.get(self._persistent_cache_key(top_core, flags))
+        if entry is None:
+            return None
+        for (vln, candidates) in entry["closure"]:
+            current = sorted(
+                [name, self._cores[name]["core"].dependency_fingerprint()]
+                for name in self._candidates(tuple(vln))
+            )
+            if current != candidates:
+                logger.debug("Stored solution for %s is outdated", top_core)
+                return None
+
+        logger.debug("Using stored solution for %s", top_core)
+        for (name, direct_deps) in entry["direct_deps"].items():
+            self._cores[name]["core"].direct_deps = direct_deps
+        return [self._cores[name]["core"] for name in entry["result"]]
+
+    def _persistent_cache_store(self, top_core, flags, package_flags, result):
+        entry = {
+            "closure": self._dependency_closure(top_core, package_flags),
+            "result": [str(core.name) for core in result],
+            "direct_deps": {},
+        }
+        if len(result) > 1:
+            for core in result:
+                entry["direct_deps"][str(core.name)] = core.direct_deps
+        self._persistent_cache.put(self._persistent_cache_key(top_core, flags), entry)
 
     def solve(self, top_core, flags):
         return self._solve(top_core, flags)
 
     def _solve(self, top_core, flags={}, only_matching_vlnv=False):
-        def eq_vln(this, that):
-            return (
-                this.vendor == that.vendor
-                and this.library == that.library
-                and this.name == that.name
-            )
-
         # Try to return a cached result
-        solver_cache_key = (top_core, self._hash_flags_dict(flags), only_matching_vlnv)
+        solver_cache_key = self._solver_cache_key(top_core, flags, only_matching_vlnv)
         cached_solution = self._solver_cache_lookup(solver_cache_key)
-        if cached_solution:
+        if cached_solution is not None:
             return cached_solution
 
-        repo = Repository()
-        _flags = flags.copy()
-        cores = [x["core"] for x in self._cores.values()]
-        for core in cores:
-            if only_matching_vlnv:
-                if not any(
-                    [eq_vln(core.name, top_core)]
-                    + [
-                        eq_vln(virtual_vlnv, top_core)
-                        for virtual_vlnv in core.get_virtuals()
-                    ]
-                ):
-                    continue
-
-            # Build a "pretty" package string in a format expected by
-            # PrettyPackageStringParser()
-            package_str = "{} {}-{}".format(
-                self._package_name(core.name), core.name.version, core.name.revision
-            )
-
-            _virtuals = core.get_virtuals()
-            if _virtuals:
-                _s = "; provides ( {} )"
-                package_str += _s.format(self._parse_virtual(_virtuals))
-
-            # Add dependencies only if we want to build the whole dependency
-            # tree.
-            if not only_matching_vlnv:
-                _flags["is_toplevel"] = core.name == top_core
-                _depends = core.get_depends(_flags)
-                if _depends:
-                    _s = "; depends ( {} )"
-                    package_str += _s.format(self._parse_depend(_depends))
-
-            parser = PrettyPackageStringParser(EnpkgVersion.from_string)
+        if self._persistent_cache and not only_matching_vlnv:
+            result = self._persistent_cache_lookup(top_core, flags)
+            if result:
+                self._solver_cache_store(solver_cache_key, result, True)
+                return result
 
-            package = parser.parse_to_package(package_str)
-            package.core = core
+        # Only add dependencies if we want to build the whole dependency tree
+        if only_matching_vlnv:
+            package_flags = {False: (None, None), True: (None, None)}
+        else:
+            package_flags = {}
+            for is_toplevel in [False, True]:
+                _flags = dict(flags, is_toplevel=is_toplevel)
+                package_flags[is_toplevel] = (_flags, utils.freeze_flags(_flags))
 
-            repo.add_package(package)
+        repo = Repository()
+        if only_matching_vlnv:
+            cores = [
+                self._cores[n]["core"] for n in self._candidates(self._vln(top_core))
+            ]
+        else:
+            cores = [x["core"] for x in self._cores.values()]
+        for core in cores:
+            (_flags, flags_key) = package_flags[core.name == top_core]
+            repo.add_package(self._get_package(core, _flags, flags_key))
 
         request = Request()
         _top_dep = "{} {} {}".format(
@@ -199,111 +367,334 @@ class CoreDB:
         result = [op.package.core for op in transaction.operations]
 
         # Cache the solution for further lookups
-        self._solver_cache_store(solver_cache_key, result)
+        self._solver_cache_store(solver_cache_key, result, not only_matching_vlnv)
+        if self._persistent_cache and not only_matching_vlnv:
+            self._persistent_cache_store(top_core, flags, package_flags, result)
 
         return result
 
 
+def _detect_capi_version(core_file, messages) -> int:
+    """Detect the CAPI version in a .core file
+
+    Warnings are appended as (level, message) tuples to messages.
+
+    Returns:
+        Version of the core file (1 or 2)
+    """
+    try:
+        with open(core_file) as f:
+            l = f.readline().split()
+            if l:
+                first_line = l[0]
+            else:
+                first_line = ""
+            if first_line == "CAPI=1":
+                return 1
+            elif first_line == "CAPI=2:":
+                return 2
+            else:
+                error_msg = (
+                    "The first line of the core file {} must be "
+                    ' "CAPI=1" or "CAPI=2:".'.format(core_file)
+                )
+                error_msg += '  The first line of this core file is "{}".'.format(
+                    first_line
+                )
+                if first_line == "CAPI=2":
+                    error_msg += "  Just add a colon on the end!"
+                messages.append((logging.WARNING, error_msg))
+                raise ValueError(
+                    "Unable to determine CAPI version from core file {}.".format(
+                        core_file
+                    )
+                )
+    except Exception as error:
+        error_msg = f"Unable to determine CAPI version from core file {core_file}"
+        messages.append((logging.WARNING, error_msg))
+        return -1
+
+
+def _list_dir(root):
+    """List a directory for the core file scanner
+
+    Returns:
+        A tuple (resolved_root, ignore_tree, dirs, core_files), where
+        ignore_tree is set if the directory contains a FUSESOC_IGNORE file,
+        dirs is a list of subdirectories to descend into and core_files is a
+        list of resolved paths to the core files in the directory
+    """
+    exclude = {".git"}
+    dirs = []
+    files = []
+    with os.scandir(root) as it:
+        for entry in it:
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+            if is_dir:
+                dirs.append(entry.name)
+            else:
+                files.append(entry.name)
+
+    return (
+        str(Path(root).expanduser().resolve()),
+        "FUSESOC_IGNORE" in files,
+        [directory for directory in dirs if directory not in exclude],
+        [
+            str((Path(root) / f).resolve())
+            for f in files
+            if os.path.splitext(f)[1] == ".core"
+        ],
+    )
+
+
+def _parse_core_file(core_file, cache_root, full=False):
+    """Parse a core file
+
+    Unless full is set, only the parts of the core file needed for dependency
+    resolution are parsed, and the rest is deferred until the core is used. A
+    full parse is used when populating the core index, which stores the
+    complete core.
+
+    This function is run in worker processes when cores are parsed in
+    parallel. Instead of logging directly, it returns the log messages so that
+    the caller can emit them in a deterministic order.
+
+    Returns:
+        A tuple (core, messages) where core is None if the file could not be
+        loaded, and messages is a list of (level, message) tuples
+    """
+    messages = []
+    try:
+        capi_version = _detect_capi_version(core_file, messages)
+        if capi_version == 1:
+            # Skip core files which are not in CAPI2 format.
+            messages.append(
+                (
+                    logging.ERROR,
+                    "Core file {} is in CAPI1 format, which is not supported "
+                    "any more since FuseSoC 2.0. The core file is ignored. "
+                    "Please migrate your cores to the CAPI2 file format, or "
+                    "use FuseSoC 1.x as stop-gap.".format(core_file),
+                )
+            )
+        elif capi_version == 2:
+            if full:
+                core = LazyCore.from_core(Core(str(core_file), cache_root), cache_root)
+            else:
+                core = LazyCore(core_file, cache_root)
+            return (core, messages)
+        # Core files which are not FuseSoC format at all are silently skipped
+    except SyntaxError as e:
+        w = "Parse error. Ignoring file " + str(core_file) + ": " + e.msg
+        messages.append((logging.WARNING, w))
+    except ImportError as e:
+        w = 'Failed to register "{}" due to unknown provider: {}'
+        messages.append((logging.WARNING, w.format(str(core_file), str(e))))
+    except ValueError as e:
+        messages.append((logging.WARNING, str(e)))
+    return (None, messages)
+
+
+# Log messages of the core file being parsed in a worker process
+_worker_messages = []
+
+
+class _MessageCollector(logging.Handler):
+    def emit(self, record):
+        _worker_messages.append((record.levelno, record.getMessage()))
+
+
+def _init_parse_worker():
+    """Collect everything logged or warned in a core parsing worker process
+
+    The messages are returned with the parse results instead, so that the
+    parent process can log them in the order of the core files.
+    """
+    loggers = [logging.getLogger()] + [
+        l
+        for l in logging.Logger.manager.loggerDict.values()
+        if isinstance(l, logging.Logger)
+    ]
+    for l in loggers:
+        for handler in list(l.handlers):
+            l.removeHandler(handler)
+    logging.getLogger().addHandler(_MessageCollector())
+    logging.captureWarnings(True)
+
+
+def _parse_core_file_in_worker(core_file, cache_root, full):
+    _worker_messages.clear()
+    (core, messages) = _parse_core_file(core_file, cache_root, full)
+    return (core, _worker_messages + messages)
+
+
+class _ThreadLogBuffer(logging.Filter):
+    """Hold back the log records of threads which have started buffering
+
+    The filter is added to all log handlers while it is in use. Held back
+    records are passed on again with replay().
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._local = threading.local()
+        self._handlers = []
+
+    def __enter__(self):
+        loggers = [logging.getLogger()] + [
+            l
+            for l in logging.Logger.manager.loggerDict.values()
+            if isinstance(l, logging.Logger)
+        ]
+        self._handlers = {h for l in loggers for h in l.handlers}
+        for handler in self._handlers:
+            handler.addFilter(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        for handler in self._handlers:
+            handler.removeFilter(self)
+
+    def start(self):
+        self._local.records = []
+
+    def stop(self):
+        records = self._local.records
+        del self._local.records
+        return records
+
+    def filter(self, record):
+        records = getattr(self._local, "records", None)
+        if records is None:
+            return True
+        # Each record passes through all handlers it is sent to
+        if not records or records[-1] is not record:
+            records.append(record)
+        return False
+
+    def replay(self, records):
+        for record in records:
+            logging.getLogger(record.name).handle(record)
+
+
 class CoreManager:
-    def __init__(self, config):
+    def __init__(
+        self, config, use_index=True, rebuild_index=False, jobs=None, fetch_jobs=None
+    ):
         self.config = config
-        self.db = CoreDB()
+        if use_index:
+            solver_cache_dir = Path(config.cache_root) / "solver_cache"
+        else:
+            solver_cache_dir = None
+        self.db = CoreDB(solver_cache_dir, config.solver_cache_size)
         self._lm = LibraryManager(config.library_root)
+        self.use_index = use_index
+        self.rebuild_index = rebuild_index
+        self.jobs = config.jobs if jobs is None else jobs
+        self.fetch_jobs = config.fetch_jobs if fetch_jobs is None else fetch_jobs
+        if self.jobs < 0 or self.fetch_jobs < 0:
+            raise ValueError("The number of jobs must be 0 or more")
+
+    def _walk_core_files(self, path, ignored_dirs, index=None):
+        """Get a list of all core files in a library, in discovery order
+
+        If an index is given, the directory listings stored in it are reused
+        for all directories whose mtime is unchanged since the last scan, and
+        the listings of all other directories are updated in the index.
+        """
+        core_files = []
+        ignored_dirs = {str(d) for d in ignored_dirs}
+
+        # Directories modified right before the scan might be modified again
+        # within the timestamp granularity of the file system. Don't trust the
+        # mtime of those the next time.
+        racy_limit = time.time_ns() - 2 * 10**9
+
+        # Walk the tree depth first, in the same order as os.walk
+        stack = [str(path)]
+        while stack:
+            root = stack.pop()
+            try:
+                mtime = os.stat(root).st_mtime_ns
+            except OSError:
+                continue
+
+            listing = index.get_dir(root, mtime) if index else None
+            if listing is None:
+                try:
+                    listing = _list_dir(root)
+                except OSError:
+                    continue
+                if index:
+                    index.put_dir(root, mtime if mtime < racy_limit else None, listing)
+
+            (resolved_root, ignore_tree, dirs, files) = listing
+            if ignore_tree or resolved_root in ignored_dirs:
+                continue
+
+            core_files += [Path(f) for f in files]
+            stack += [os.path.join(root, d) for d in reversed(dirs)]
+        return core_files
+
+    def _parse_core_files(self, core_files, full):
+        """Parse core files, using a pool of worker processes if enabled
+
+        Results are returned in the same order as core_files
+        """
+        cache_root = self.config.cache_root
+        jobs = self.jobs or os.cpu_count() or 1
+        jobs = min(jobs, len(core_files))
+        if jobs > 1:
+            logger.debug("Parsing %d core files using %d jobs", len(core_files), jobs)
+            chunksize = max(1, len(core_files) // (jobs * 4))
+            with ProcessPoolExecutor(
+                max_workers=jobs, initializer=_init_parse_worker
+            ) as executor:
+                return list(
+                    executor.map(
+                        _parse_core_file_in_worker,
+                        core_files,
+                        [cache_root] * len(core_files),
+                        [full] * len(core_files),
+                        chunksize=chunksize,
+                    )
+                )
+        return [_parse_core_file(f, cache_root, full) for f in core_files]
 
     def find_cores(self, library, ignored_dirs):
-        found_cores = []
         path = Path(library.location).expanduser().resolve()
-        exclude = {".git"}
         if path.is_dir() == False:
             raise OSError(str(path) + " is not a directory")
-        logger.debug("Checking for cores in " + str(path))
-        for root, dirs, files in os.walk(path, followlinks=True):
-            root = Path(root)
-            ignore_tree = ("FUSESOC_IGNORE" in files) or (
-                Path(root).expanduser().resolve() in ignored_dirs
-            )
-            if ignore_tree:
-                del dirs[:]
-                continue
+        logger.debug("Checking for cores in %s", path)
+        if self.use_index:
+            index = CoreIndex(self.config.cache_root, path, self.rebuild_index)
+        else:
+            index = None
 
-            dirs[:] = [directory for directory in dirs if directory not in exclude]
-            for f in files:
-                f = Path(f)
-                if f.suffix == ".core":
-                    core_file = root / f
-                    core_file = core_file.resolve()
-                    try:
-                        capi_version = self._detect_capi_version(core_file)
-                        if capi_version == 1:
-                            # Skip core files which are not in CAPI2 format.
-                            logger.error(
-                                "Core file {} is in CAPI1 format, which is not supported "
-                                "any more since FuseSoC 2.0. The core file is ignored. "
-                                "Please migrate your cores to the CAPI2 file format, or "
-                                "use FuseSoC 1.x as stop-gap.".format(core_file)
-                            )
-                            continue
-                        elif capi_version == -1:
-                            # Skip core files which are not FuseSoc format at all.
-                            continue
-
-                        core = Core(
-                            str(core_file),
-                            self.config.cache_root,
-                        )
-                        found_cores.append(core)
-                    except SyntaxError as e:
-                        w = (
-                            "Parse error. Ignoring file "
-                            + str(core_file)
-                            + ": "
-                            + e.msg
-                        )
-                        logger.warning(w)
-                    except ImportError as e:
-                        w = 'Failed to register "{}" due to unknown provider: {}'
-                        logger.warning(w.format(str(core_file), str(e)))
-                    except ValueError as e:
-                        logger.warning(e)
-        return found_cores
-
-    def _detect_capi_version(self, core_file) -> int:
-        """Detect the CAPI version in a .core file
+        core_files = self._walk_core_files(path, ignored_dirs, index)
 
-        Returns:
-            Version of the core file (1 or 2)
-        """
-        try:
-            with open(core_file) as f:
-                l = f.readline().split()
-                if l:
-                    first_line = l[0]
-                else:
-                    first_line = ""
-                if first_line == "CAPI=1":
-                    return 1
-                elif first_line == "CAPI=2:":
-                    return 2
-                else:
-                    error_msg = (
-                        "The first line of the core file {} must be "
-                        ' "CAPI=1" or "CAPI=2:".'.format(core_file)
-                    )
-                    error_msg += '  The first line of this core file is "{}".'.format(
-                        first_line
-                    )
-                    if first_line == "CAPI=2":
-                        error_msg += "  Just add a colon on the end!"
-                    logger.warning(error_msg)
-                    raise ValueError(
-                        "Unable to determine CAPI version from core file {}.".format(
-                            core_file
-                        )
-                    )
-        except Exception as error:
-            error_msg = f"Unable to determine CAPI version from core file {core_file}"
-            logger.warning(error_msg)
-            return -1
+        # Keep one slot per core file so that the discovery order is retained
+        # regardless of where each core came from
+        found_cores = [index.get(f) if index else None for f in core_files]
+        unparsed = [f for (f, core) in zip(core_files, found_cores) if core is None]
+        parsed = iter(self._parse_core_files(unparsed, full=bool(index)))
+        for i, core in enumerate(found_cores):
+            if core:
+                continue
+            (core, messages) = next(parsed)
+            for (level, msg) in messages:
+                logger.log(level, msg)
+            if core:
+                found_cores[i] = core
+                if index:
+                    index.put(core_files[i], core)
+
+        if index:
+            index.save()
+        return [core for core in found_cores if core]
 
     def _load_cores(self, library, ignored_dirs):
         found_cores = self.find_cores(library, ignored_dirs)
@@ -319,7 +710,8 @@ class CoreManager:
             logger.warning(_s.format(library.name, abspath, _library.name))
             return
 
-        self._load_cores(library, ignored_dirs)
+        with timings.phase("scan", library.name):
+            self._load_cores(library, ignored_dirs)
         self._lm.add_library(library)
 
     def get_libraries(self):
@@ -337,16 +729,86 @@ class CoreManager:
         is the core at the root of the dependency tree.
         """
         logger.debug(
-            "Calculating dependencies for {}{} with flags {}".format(
-                core.relation, str(core), str(flags)
-            )
+            "Calculating dependencies for %s%s with flags %s",
+            core.relation,
+            core,
+            flags,
         )
         resolved_core = self.db.find(core)
         deps = self.db.solve(resolved_core.name, flags)
-        logger.debug(" Resolved core to {}".format(str(resolved_core.name)))
-        logger.debug(" with dependencies " + ", ".join([str(c.name) for c in deps]))
+        logger.debug(" Resolved core to %s", resolved_core.name)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(" with dependencies " + ", ".join(str(c.name) for c in deps))
         return deps
 
+    def setup_cores(self, cores):
+        """Fetch and patch a list of cores
+
+        Fetching is mostly spent waiting for the network, so up to fetch_jobs
+        cores are set up at the same time in separate threads. Cores that share
+        a files_root are set up one after the other in the same thread. The log
+        output of each thread is held back and passed on in the order of the
+        cores. All cores are attempted even if some of them fail, and a
+        RuntimeError listing all failures is raised at the end.
+        """
+        groups = {}
+        for (i, core) in enumerate(cores):
+            logger.info("Preparing %s", core.name)
+            key = str(core.files_root) if core.provider else i
+            groups.setdefault(key, []).append((i, core))
+
+        def _setup(group, log_buffer=None):
+            if log_buffer:
+                log_buffer.start()
+            errors = []
+            try:
+                for (i, core) in group:
+                    try:
+                        core.setup()
+                    except (RuntimeError, OSError) as e:
+                        errors.append((i, core, e))
+            finally:
+                records = log_buffer.stop() if log_buffer else []
+            return (errors, records)
+
+        jobs = self.fetch_jobs or os.cpu_count() or 1
+        jobs = min(jobs, len(groups))
+        results = []
+        if jobs > 1:
+            logger.debug("Setting up %d cores using %d jobs", len(cores), jobs)
+            with _ThreadLogBuffer() as log_buffer, ThreadPoolExecutor(
+                max_workers=jobs, thread_name_prefix="fetch"
+            ) as executor:
+                futures = [
+                    executor.submit(_setup, group, log_buffer)
+                    for group in groups.values()
+                ]
+                for future in futures:
+                    (errors, records) = future.result()
+                    log_buffer.replay(records)
+                    results.append(errors)
+        else:
+            results = [_setup(group)[0] for group in groups.values()]
+
+        # Report failures in the order of the cores, not in the order in
+        # which they happened
+        errors = sorted((e for errors in results for e in errors), key=lambda e: e[0])
+        if errors:
+            raise RuntimeError(
+                "\n".join(
+                    f"Failed to set up {core.name}: {e}" for (_, core, e) in errors
+                )
+            )
+
+    def trim_download_cache(self):
+        """Remove the least recently used downloads until the download cache
+        fits in download_cache_size"""
+        self.download_cache().trim(self.config.download_cache_size * 2**20)
+
+    def download_cache(self):
+        """Get the store of files downloaded by providers"""
+        return BlobStore(Path(self.config.cache_root) / "downloads")
+
     def get_cores(self):
         """Get a dict with all cores, indexed by the core name"""
         return {str(x.name): x for x in self.db.find()}
@@ -361,6 +823,11 @@ class CoreManager:
         """Get a dict with all registered generators, indexed by name"""
         generators = {}
         for core in self.db.find():
+            try:
+                core.load()
+            except RuntimeError as e:
+                logger.warning("Ignoring %s: %s", core.name, e)
+                continue
             if hasattr(core, "get_generators"):
                 _generators = core.get_generators()
                 if _generators:
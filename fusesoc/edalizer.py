@@ -3,6 +3,7 @@
 # SPDX-License-Identifier: BSD-2-Clause
 
 import argparse
+import json
 import logging
 import os
 import shutil
@@ -11,6 +12,8 @@ from pathlib import Path
 
 from fusesoc import utils
 from fusesoc.coremanager import DependencyError
+from fusesoc.filesync import sync_files
+from fusesoc.timing import timings
 from fusesoc.utils import merge_dict
 from fusesoc.vlnv import Vlnv
 
@@ -36,6 +39,9 @@ def str2bool(v):
 
 
 class Edalizer:
+    # Name of the file in export_root that lists the exported files
+    EXPORT_RECORD = ".fusesoc_exported.json"
+
     def __init__(
         self,
         toplevel,
@@ -44,6 +50,8 @@ class Edalizer:
         core_manager,
         export_root=None,
         system_name=None,
+        export_mode="sync",
+        export_jobs=1,
     ):
         logger.debug("Building EDA API")
 
@@ -56,6 +64,8 @@ class Edalizer:
         else:
             self.export_root = None
         self.system_name = system_name
+        self.export_mode = export_mode
+        self.export_jobs = export_jobs
 
         self.generators = {}
 
@@ -90,6 +100,12 @@ class Edalizer:
     def run(self):
         """Run all steps to create a EDAM file"""
 
+        # Resolve the dependencies up front, so that the time spent on it is
+        # reported as a phase of its own. Later lookups reuse the solution.
+        with timings.phase("resolve"):
+            resolved_cores = self.resolved_cores
+        logger.debug("Resolved %d cores", len(resolved_cores))
+
         # Run the setup task on all cores (fetch and patch them as needed)
         self.setup_cores()
 
@@ -101,7 +117,8 @@ class Edalizer:
         self.run_generators()
 
         # Create EDA API file contents
-        self.create_edam()
+        with timings.phase("edam"):
+            self.create_edam()
 
         # Clean up ttptttg temporary directories
         self.clean_temp_dirs()
@@ -117,19 +134,17 @@ class Edalizer:
 
     def setup_cores(self):
         """Setup cores: fetch resources, patch them, etc."""
-        for core in self.cores:
-            logger.info("Preparing " + str(core.name))
-            core.setup()
+        self.core_manager.setup_cores(self.cores)
 
     def extract_generators(self):
         """Get all registered generators from the cores"""
         generators = {}
         for core in self.cores:
-            logger.debug("Searching for generators in " + str(core.name))
+            logger.debug("Searching for generators in %s", core.name)
             if hasattr(core, "get_generators"):
                 core_generators = core.get_generators()
                 if core_generators:
-                    logger.debug(f"Found generators: {core_generators.keys()}")
+                    logger.debug("Found generators: %s", core_generators.keys())
                 generators.update(core_generators)
 
         self.generators = generators
@@ -138,7 +153,7 @@ class Edalizer:
         """Run all generators"""
         self._resolved_or_generated_cores = []
         for core in self.cores:
-            logger.debug("Running generators in " + str(core.name))
+            logger.debug("Running generators in %s", core.name)
             core_flags = self._core_flags(core)
             self._resolved_or_generated_cores.append(core)
             if hasattr(core, "get_ttptttg"):
@@ -148,19 +163,60 @@ class Edalizer:
                         core,
                         self.generators,
                     )
-                    for gen_core in _ttptttg.generate():
+                    with timings.phase("generate", _ttptttg.vlnv):
+                        gen_cores = _ttptttg.generate()
+                    for gen_core in gen_cores:
                         gen_core.pos = _ttptttg.pos
                         self._resolved_or_generated_cores.append(gen_core)
 
+    def _remove_stale_exports(self, exported):
+        """Remove files left over from earlier exports
+
+        The files exported below export_root are recorded in EXPORT_RECORD.
+        Files which were recorded by the previous run but not exported by this
+        one are removed, so that anything else in export_root is left alone.
+        """
+        root = os.path.normpath(str(self.export_root))
+        record = os.path.join(root, self.EXPORT_RECORD)
+        exported = {
+            os.path.relpath(p, root) for p in exported if p.startswith(root + os.sep)
+        }
+
+        try:
+            with open(record) as f:
+                previous = set(json.load(f))
+        except (OSError, ValueError):
+            previous = set()
+
+        for rel in sorted(previous - exported):
+            if os.path.isabs(rel) or rel.split(os.sep)[0] == "..":
+                continue
+            path = os.path.join(root, rel)
+            if not os.path.isfile(path) or os.path.islink(path):
+                continue
+            logger.debug("Removing stale export %s", path)
+            os.remove(path)
+            # Remove directories which became empty
+            d = os.path.dirname(path)
+            while d != root and not os.listdir(d):
+                os.rmdir(d)
+                d = os.path.dirname(d)
+
+        with open(record, "w") as f:
+            json.dump(sorted(exported), f)
+
     def create_edam(self):
         first_snippets = []
         snippets = []
         last_snippets = []
         parameters = {}
+        # Files to copy into work_root, collected from all cores
+        copies = {}
+        exported = set()
         for core in self.cores:
             snippet = {}
 
-            logger.debug("Collecting EDA API parameters from {}".format(str(core.name)))
+            logger.debug("Collecting EDA API parameters from %s", core.name)
             _flags = self._core_flags(core)
 
             # Extract direct dependencies
@@ -169,7 +225,10 @@ class Edalizer:
             # Extract files
             if self.export_root:
                 files_root = self.export_root / core.sanitized_name
-                core.export(files_root, _flags)
+                with timings.phase("export", core.name):
+                    exported |= core.export(
+                        files_root, _flags, self.export_mode, self.export_jobs
+                    )
             else:
                 files_root = Path(core.files_root)
 
@@ -196,18 +255,7 @@ class Edalizer:
                 _f = file
                 if file.get("copyto"):
                     _name = file["copyto"]
-                    dst = self.work_root / _name
-                    _dstdir = dst.expanduser().resolve().parent
-                    if not _dstdir.exists():
-                        _dstdir.mkdir()
-                    try:
-                        shutil.copy2(files_root / file["name"], dst)
-                    except IsADirectoryError:
-                        shutil.copytree(
-                            files_root / file["name"],
-                            dst,
-                            dirs_exist_ok=True,
-                        )
+                    copies[_name] = files_root / file["name"]
                     del _f["copyto"]
                 else:
                     _name = rel_root / file["name"]
@@ -244,6 +292,19 @@ class Edalizer:
             else:
                 snippets.append(snippet)
 
+        if self.export_root and self.export_mode != "copy":
+            self._remove_stale_exports(exported)
+
+        if copies:
+            with timings.phase("copyto"):
+                sync_files(
+                    copies,
+                    self.work_root,
+                    "copy",
+                    jobs=self.export_jobs,
+                    copy_function=shutil.copy2,
+                )
+
         top_core = self.resolved_cores[-1]
         self.edam = {
             "version": "0.2.1",
@@ -263,7 +324,7 @@ class Edalizer:
     def clean_temp_dirs(self):
         for core in self.cores:
             if core.is_generated:
-                logger.debug(f"Removing {core.core_root} ttptttg temporary directory")
+                logger.debug("Removing %s ttptttg temporary directory", core.core_root)
                 shutil.rmtree(core.core_root)
 
     def _build_parser(self, backend_class, edam):
@@ -528,7 +589,7 @@ class Ttptttg:
         Launcher(args[0], args[1:], cwd=generator_cwd).run()
 
         cores = []
-        logger.debug("Looking for generated cores in " + str(generator_cwd))
+        logger.debug("Looking for generated cores in %s", generator_cwd)
         for root, dirs, files in os.walk(generator_cwd):
             root = Path(root)
             for f in files:
@@ -538,5 +599,6 @@ class Ttptttg:
                     except SyntaxError as e:
                         w = "Failed to parse generated core file " + f + ": " + e.msg
                         raise RuntimeError(w)
-        logger.debug("Found " + ", ".join(str(c.name) for c in cores))
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Found " + ", ".join(str(c.name) for c in cores))
         return cores
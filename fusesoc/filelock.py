@@ -0,0 +1,83 @@
+# Copyright FuseSoC contributors
+# Licensed under the 2-Clause BSD License, see LICENSE for details.
+# SPDX-License-Identifier: BSD-2-Clause
+
+import logging
+import os
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+logger = logging.getLogger(__name__)
+
+
+def _try_lock(fd):
+    if fcntl:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    else:
+        msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+
+
+def _unlock(fd):
+    if fcntl:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+    else:
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+
+
+class FileLock:
+    """Exclusive lock held on a file
+
+    The lock is shared between processes as well as between threads in the
+    same process, as each acquisition opens the file anew. The lock file is
+    created if needed and left behind when the lock is released.
+
+    If the lock can't be acquired within timeout seconds, a RuntimeError is
+    raised. A timeout of None waits forever.
+    """
+
+    POLL_INTERVAL = 0.1
+
+    def __init__(self, path, timeout=None):
+        self.path = str(path)
+        self.timeout = timeout
+        self._fd = None
+
+    def acquire(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o666)
+        start = time.monotonic()
+        waiting = False
+        while True:
+            try:
+                _try_lock(fd)
+                break
+            except OSError:
+                pass
+            if self.timeout is not None and time.monotonic() - start >= self.timeout:
+                os.close(fd)
+                raise RuntimeError(
+                    f"Timed out after {self.timeout} s waiting for lock {self.path}"
+                )
+            if not waiting:
+                logger.info(f"Waiting for lock {self.path}")
+                waiting = True
+            time.sleep(self.POLL_INTERVAL)
+        self._fd = fd
+
+    def release(self):
+        _unlock(self._fd)
+        os.close(self._fd)
+        self._fd = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
@@ -0,0 +1,174 @@
+# Copyright FuseSoC contributors
+# Licensed under the 2-Clause BSD License, see LICENSE for details.
+# SPDX-License-Identifier: BSD-2-Clause
+
+import logging
+import os
+import shutil
+import stat
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# copy: Always copy the files
+# sync: Only copy files which have changed since the last export
+# link: Like sync, but hard link the files instead of copying them if possible
+EXPORT_MODES = ["copy", "sync", "link"]
+
+
+def sync_files(
+    files, dst_root, mode="sync", delete=False, jobs=1, copy_function=shutil.copyfile
+):
+    """Make copies of files below dst_root
+
+    files is a dict with paths relative to dst_root as keys and the paths of
+    the source files or directories as values. Directories are copied
+    recursively.
+
+    In sync and link modes, destination files with the same size and
+    modification time as their source are left alone. If delete is set, files
+    and directories below dst_root which don't correspond to any of the source
+    files are removed. Symbolic links to directories are followed.
+
+    All directories are created up front, after which the files are copied by
+    up to jobs threads (0 = one per CPU). All files are attempted even if some
+    of them fail, and a RuntimeError listing all failures is raised at the end.
+
+    Returns the set of paths of all files below dst_root that correspond to
+    source files.
+    """
+    if mode not in EXPORT_MODES:
+        raise ValueError(f"Invalid export mode '{mode}'")
+
+    (dirs, copies) = _plan(files, dst_root)
+    for d in sorted(dirs):
+        _makedirs(d)
+
+    def _copy(item):
+        (dst, src) = item
+        try:
+            _sync_file(src, dst, mode, copy_function)
+        except OSError as e:
+            return (dst, e)
+        return None
+
+    jobs = jobs or os.cpu_count() or 1
+    jobs = min(jobs, len(copies))
+    if jobs > 1:
+        logger.debug("Copying %d files using %d jobs", len(copies), jobs)
+        with ThreadPoolExecutor(max_workers=jobs, thread_name_prefix="copy") as ex:
+            results = list(ex.map(_copy, copies.items()))
+    else:
+        results = [_copy(item) for item in copies.items()]
+
+    errors = [r for r in results if r]
+    if errors:
+        raise RuntimeError(
+            "Failed to copy {} files:\n".format(len(errors))
+            + "\n".join(f"\t{dst}: {e}" for (dst, e) in errors)
+        )
+
+    if delete:
+        _remove_stale(os.path.normpath(dst_root), dirs | set(copies))
+    return set(copies)
+
+
+def _plan(files, dst_root):
+    """Get the directories to create and a dict of files to copy"""
+    dirs = set()
+    copies = {}
+    for (dst, src) in files.items():
+        dst = os.path.normpath(os.path.join(dst_root, dst))
+        if os.path.isdir(src):
+            src = os.path.normpath(src)
+            for (d, subdirs, names) in os.walk(src, followlinks=True):
+                if _is_loop(src, d):
+                    subdirs[:] = []
+                    continue
+                dst_dir = os.path.normpath(os.path.join(dst, os.path.relpath(d, src)))
+                dirs.add(dst_dir)
+                for name in names:
+                    copies[os.path.join(dst_dir, name)] = os.path.join(d, name)
+        else:
+            dirs.add(os.path.dirname(dst))
+            copies[dst] = src
+    return (dirs, copies)
+
+
+def _is_loop(top, path):
+    """Check if path is a symbolic link to one of its parents below top"""
+    real = os.path.realpath(path)
+    while path != top and path != os.path.dirname(path):
+        path = os.path.dirname(path)
+        if os.path.realpath(path) == real:
+            return True
+    return False
+
+
+def _makedirs(path):
+    # A file may be in the way from an earlier export
+    if os.path.lexists(path) and not os.path.isdir(path):
+        os.remove(path)
+    os.makedirs(path, exist_ok=True)
+
+
+def _sync_file(src, dst, mode, copy_function):
+    st = os.stat(src)
+    try:
+        dst_st = os.lstat(dst)
+    except FileNotFoundError:
+        dst_st = None
+
+    if dst_st is not None:
+        if mode == "link" and dst_st.st_dev == st.st_dev:
+            # Files on the same file system are expected to be linked
+            if dst_st.st_ino == st.st_ino:
+                return
+        elif (
+            mode != "copy"
+            and stat.S_ISREG(dst_st.st_mode)
+            and dst_st.st_size == st.st_size
+            and dst_st.st_mtime_ns == st.st_mtime_ns
+        ):
+            return
+        # Never write into an existing file, as it may be a hard link to the
+        # source
+        if stat.S_ISDIR(dst_st.st_mode):
+            shutil.rmtree(dst)
+        else:
+            os.remove(dst)
+
+    if mode == "link":
+        try:
+            os.link(src, dst)
+            return
+        except OSError as e:
+            logger.debug("Copying %s instead of linking it: %s", src, e)
+    copy_function(src, dst)
+    if mode != "copy":
+        os.utime(dst, ns=(st.st_atime_ns, st.st_mtime_ns))
+
+
+def _remove_stale(dst_root, expected):
+    keep = set(expected)
+    for path in expected:
+        # Keep all directories leading up to the expected files
+        while path.startswith(dst_root + os.sep):
+            path = os.path.dirname(path)
+            if path in keep:
+                break
+            keep.add(path)
+
+    for (d, dirs, names) in os.walk(dst_root, topdown=False):
+        for name in names:
+            path = os.path.join(d, name)
+            if path not in keep:
+                os.remove(path)
+        for name in dirs:
+            path = os.path.join(d, name)
+            if path in keep:
+                continue
+            if os.path.islink(path):
+                os.remove(path)
+            else:
+                shutil.rmtree(path)
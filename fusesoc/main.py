@@ -32,7 +32,9 @@ except ImportError:
 from fusesoc.config import Config
 from fusesoc.coremanager import CoreManager, DependencyError
 from fusesoc.edalizer import Edalizer
+from fusesoc.filesync import EXPORT_MODES
 from fusesoc.librarymanager import Library
+from fusesoc.timing import timings
 from fusesoc.utils import Launcher, setup_logging, yaml_fread
 from fusesoc.vlnv import Vlnv
 
@@ -43,6 +45,7 @@ def _get_core(cm, name):
     core = None
     try:
         core = cm.get_core(Vlnv(name))
+        core.load()
     except RuntimeError as e:
         logger.error(str(e))
         exit(1)
@@ -77,12 +80,47 @@ def pgm(cm, args):
 def fetch(cm, args):
     core = _get_core(cm, args.core)
 
+    if args.deps:
+        flags = _flags_from_args(args)
+        try:
+            flags = dict(core.get_flags(flags["target"]), **flags)
+            cores = cm.get_depends(core.name, flags)
+        except DependencyError as e:
+            logger.error(e.msg + f"\nFailed to resolve dependencies for {core.name}")
+            exit(1)
+        except SyntaxError as e:
+            logger.error(e.msg)
+            exit(1)
+    else:
+        cores = [core]
+
     try:
-        core.setup()
+        cm.setup_cores(cores)
     except RuntimeError as e:
-        logger.error("Failed to fetch '{}': {}".format(core.name, str(e)))
+        logger.error("Failed to fetch '{}':\n{}".format(core.name, str(e)))
+        exit(1)
+    cm.trim_download_cache()
+
+
+def cache_add(cm, args):
+    if args.url and len(args.file) > 1:
+        logger.error("--url can only be used when adding a single file")
         exit(1)
 
+    store = cm.download_cache()
+    for f in args.file:
+        try:
+            with open(f, "rb") as fileobj:
+                path = store.add(fileobj, args.url, args.sha256)
+        except (OSError, RuntimeError) as e:
+            logger.error(f"Failed to add '{f}' to the download cache: {e}")
+            exit(1)
+        logger.info(f"Added {f} as {path.name}")
+
+
+def cache_clean(cm, args):
+    cm.trim_download_cache()
+
 
 def init(cm, args):
     warnings.warn(
@@ -192,6 +230,13 @@ def list_cores(cm, args):
     print("=" * 80)
     for name in sorted(cores.keys()):
         core = cores[name]
+        # Cores are only parsed in full when they are used. Skip the ones
+        # which turn out to be broken, like when the library was scanned.
+        try:
+            core.load()
+        except RuntimeError as e:
+            logger.warning("Ignoring %s: %s", name, e)
+            continue
         print(
             name.ljust(maxlen)
             + " : "
@@ -282,36 +327,43 @@ def run(cm, args):
         do_build = args.build
         do_run = args.run
 
-    flags = {"target": args.target or "default"}
-    if args.tool:
-        flags["tool"] = args.tool
-    for flag in args.flag:
-        if flag[0] == "+":
-            flags[flag[1:]] = True
-        elif flag[0] == "-":
-            flags[flag[1:]] = False
-        else:
-            flags[flag] = True
-
     run_backend(
         cm,
         not args.no_export,
         do_configure,
         do_build,
         do_run,
-        flags,
+        _flags_from_args(args),
         args.system_name,
         args.system,
         args.backendargs,
         args.build_root,
         args.verbose,
+        args.export_mode or cm.config.export_mode,
+        cm.config.export_jobs if args.export_jobs is None else args.export_jobs,
     )
 
 
+def _flags_from_args(args):
+    flags = {"target": args.target or "default"}
+    if args.tool:
+        flags["tool"] = args.tool
+    for flag in args.flag:
+        if flag[0] == "+":
+            flags[flag[1:]] = True
+        elif flag[0] == "-":
+            flags[flag[1:]] = False
+        else:
+            flags[flag] = True
+    return flags
+
+
 # Clean out old work root
-def prepare_work_root(work_root):
+def prepare_work_root(work_root, keep=[]):
     if os.path.exists(work_root):
         for f in os.listdir(work_root):
+            if f in keep:
+                continue
             if os.path.isdir(os.path.join(work_root, f)):
                 shutil.rmtree(os.path.join(work_root, f))
             else:
@@ -332,6 +384,8 @@ def run_backend(
     backendargs,
     build_root_arg,
     verbose,
+    export_mode="sync",
+    export_jobs=1,
 ):
     tool_error = (
         "No flow or tool was supplied on command line or found in '{}' core description"
@@ -404,11 +458,16 @@ def run_backend(
         work_root=work_root,
         export_root=export_root,
         system_name=system_name,
+        export_mode=export_mode,
+        export_jobs=export_jobs,
     )
 
     if do_configure:
         try:
-            prepare_work_root(work_root)
+            # Keep the exported files around, so that only changed files
+            # need to be exported again
+            keep = ["src"] if export and export_mode != "copy" else []
+            prepare_work_root(work_root, keep)
             edam = edalizer.run()
             parsed_args = edalizer.parse_args(backend_class, backendargs, edam)
             edalizer.add_parsed_args(backend_class, parsed_args)
@@ -419,7 +478,9 @@ def run_backend(
         except RuntimeError as e:
             logger.error("Setup failed : {}".format(str(e)))
             exit(1)
-        edalizer.to_yaml(edam_file)
+        with timings.phase("write-edam"):
+            edalizer.to_yaml(edam_file)
+        cm.trim_download_cache()
     else:
         edam = yaml_fread(edam_file)
         parsed_args = edalizer.parse_args(backend_class, backendargs, edam)
@@ -438,7 +499,8 @@ def run_backend(
 
     if do_configure:
         try:
-            backend.configure()
+            with timings.phase("configure"):
+                backend.configure()
             print("")
         except RuntimeError as e:
             logger.error("Failed to configure the system")
@@ -447,14 +509,16 @@ def run_backend(
 
     if do_build:
         try:
-            backend.build()
+            with timings.phase("build"):
+                backend.build()
         except RuntimeError as e:
             logger.error("Failed to build {} : {}".format(str(core.name), str(e)))
             exit(1)
 
     if do_run:
         try:
-            backend.run(parsed_args)
+            with timings.phase("run"):
+                backend.run(parsed_args)
         except RuntimeError as e:
             logger.error("Failed to run {} : {}".format(str(core.name), str(e)))
             exit(1)
@@ -483,9 +547,22 @@ def init_logging(verbose, monochrome, log_file=None):
         logger.debug("Colorful output")
 
 
-def init_coremanager(config, args_cores_root):
+def init_coremanager(
+    config,
+    args_cores_root,
+    use_index=True,
+    rebuild_index=False,
+    jobs=None,
+    fetch_jobs=None,
+):
     logger.debug("Initializing core manager")
-    cm = CoreManager(config)
+    cm = CoreManager(
+        config,
+        use_index=use_index,
+        rebuild_index=rebuild_index,
+        jobs=jobs,
+        fetch_jobs=fetch_jobs,
+    )
 
     args_libs = [Library(acr, acr) for acr in args_cores_root]
     # Add libraries from config file, env var and command-line
@@ -499,6 +576,18 @@ def init_coremanager(config, args_cores_root):
     return cm
 
 
+def _jobs(value):
+    try:
+        jobs = int(value)
+    except ValueError:
+        jobs = -1
+    if jobs < 0:
+        raise argparse.ArgumentTypeError(
+            f"invalid number of jobs '{value}', must be 0 or more"
+        )
+    return jobs
+
+
 def get_parser():
     parser = argparse.ArgumentParser()
     subparsers = parser.add_subparsers()
@@ -527,6 +616,48 @@ def get_parser():
     )
     parser.add_argument("--verbose", help="More info messages", action="store_true")
     parser.add_argument("--log-file", help="Write log messages to file")
+    parser.add_argument(
+        "--no-index",
+        help="Don't use the core index and stored dependency solutions in cache_root",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--rebuild-index",
+        help="Discard the core index in cache_root and build it from scratch",
+        action="store_true",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        help="Number of processes used to parse core files (0 = one per CPU)",
+        type=_jobs,
+    )
+    parser.add_argument(
+        "--fetch-jobs",
+        help="Number of cores fetched at the same time (0 = one per CPU)",
+        type=_jobs,
+    )
+    parser.add_argument(
+        "--timings",
+        help="Show the time spent in each phase of the run",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--timings-json",
+        help="Write the time spent in each phase of the run to a JSON file",
+        metavar="FILE",
+    )
+    parser.add_argument(
+        "--trace",
+        help="Write a trace of the run, which can be loaded in Perfetto or "
+        "chrome://tracing, to a file",
+        metavar="FILE",
+    )
+    parser.add_argument(
+        "--profile",
+        help="Profile the run with cProfile and write the statistics to a file",
+        metavar="FILE",
+    )
 
     # init subparser
     parser_init = subparsers.add_parser(
@@ -551,8 +682,57 @@ def get_parser():
         "fetch", help="Fetch a remote core and its dependencies to local cache"
     )
     parser_fetch.add_argument("core")
+    parser_fetch.add_argument(
+        "--deps",
+        help="Also fetch all dependencies of the core",
+        action="store_true",
+    )
+    parser_fetch.add_argument(
+        "--target",
+        help="Override default target when resolving dependencies",
+    )
+    parser_fetch.add_argument(
+        "--tool", help="Override default tool when resolving dependencies"
+    )
+    parser_fetch.add_argument(
+        "--flag",
+        help="Set a custom use flag when resolving dependencies. Can be specified "
+        "multiple times",
+        action="append",
+        default=[],
+    )
     parser_fetch.set_defaults(func=fetch)
 
+    # cache subparser
+    parser_cache = subparsers.add_parser(
+        "cache", help="Subcommands for dealing with the download cache"
+    )
+    cache_subparsers = parser_cache.add_subparsers()
+    parser_cache.set_defaults(subparser=parser_cache)
+
+    # cache add subparser
+    parser_cache_add = cache_subparsers.add_parser(
+        "add",
+        help="Add local files to the download cache, e.g. to fetch cores without "
+        "network access",
+    )
+    parser_cache_add.add_argument("file", nargs="+", help="Files to add")
+    parser_cache_add.add_argument(
+        "--url", help="Make the file available to cores downloading it from URL"
+    )
+    parser_cache_add.add_argument(
+        "--sha256", help="Verify that the file has this SHA-256 hash"
+    )
+    parser_cache_add.set_defaults(func=cache_add)
+
+    # cache clean subparser
+    parser_cache_clean = cache_subparsers.add_parser(
+        "clean",
+        help="Remove the least recently used downloads until the download cache "
+        "fits in download_cache_size",
+    )
+    parser_cache_clean.set_defaults(func=cache_clean)
+
     # core subparser
     parser_core = subparsers.add_parser(
         "core", help="Subcommands for dealing with cores"
@@ -677,6 +857,16 @@ def get_parser():
         action="store_true",
         help="Reference source files from their current location instead of exporting to a build tree",
     )
+    parser_run.add_argument(
+        "--export-mode",
+        choices=EXPORT_MODES,
+        help="How to export source files. copy recreates the build tree, sync only copies changed files and link also hard links files when possible. Defaults to sync",
+    )
+    parser_run.add_argument(
+        "--export-jobs",
+        help="Number of files exported at the same time (0 = one per CPU)",
+        type=_jobs,
+    )
     parser_run.add_argument(
         "--build-root", help="Output directory for build. Defaults to build/$VLNV"
     )
@@ -735,9 +925,27 @@ def fusesoc(args):
     init_logging(args.verbose, args.monochrome, args.log_file)
     config = Config(args.config)
 
-    cm = init_coremanager(config, args.cores_root)
-    # Run the function
-    args.func(cm, args)
+    timings.enabled = args.timings or bool(args.timings_json)
+    timings.tracing = bool(args.trace)
+    try:
+        cm = init_coremanager(
+            config,
+            args.cores_root,
+            use_index=not args.no_index,
+            rebuild_index=args.rebuild_index,
+            jobs=args.jobs,
+            fetch_jobs=args.fetch_jobs,
+        )
+        # Run the function
+        args.func(cm, args)
+    finally:
+        # Also report the timings if the run failed
+        if args.timings:
+            print(timings.report(), file=sys.stderr)
+        if args.timings_json:
+            timings.write_json(args.timings_json)
+        if args.trace:
+            timings.write_trace(args.trace)
 
 
 def main():
@@ -747,7 +955,16 @@ def main():
 
     logger.debug("Command line arguments: " + str(sys.argv))
 
-    fusesoc(args)
+    if args.profile:
+        import cProfile
+
+        profiler = cProfile.Profile()
+        try:
+            profiler.runcall(fusesoc, args)
+        finally:
+            profiler.dump_stats(args.profile)
+    else:
+        fusesoc(args)
 
 
 if __name__ == "__main__":
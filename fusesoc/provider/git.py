@@ -2,22 +2,90 @@
 # Licensed under the 2-Clause BSD License, see LICENSE for details.
 # SPDX-License-Identifier: BSD-2-Clause
 
+import hashlib
 import logging
 import os.path
+import re
 import shutil
 import subprocess
+import tempfile
+import threading
+from pathlib import Path
 
-from fusesoc.provider.provider import Provider
+from fusesoc.filelock import FileLock
+from fusesoc.provider.provider import Provider, lock_timeout
 from fusesoc.utils import Launcher
 
 logger = logging.getLogger(__name__)
 
+# Mirrors which have been created or fetched by this process
+_fetched = set()
+_locks = {}
+_locks_lock = threading.Lock()
+
+
+def _mirror_lock(path):
+    with _locks_lock:
+        return _locks.setdefault(path, threading.Lock())
+
+
+def mirror_path(cache_root, repo):
+    """Get the path of the mirror of repo in cache_root"""
+    name = os.path.basename(repo.rstrip("/"))
+    if name.endswith(".git"):
+        name = name[:-4]
+    _id = hashlib.sha256(repo.encode()).hexdigest()[:16]
+    return Path(cache_root) / "git_mirrors" / f"{name}-{_id}.git"
+
+
+def update_mirror(cache_root, repo, version=None):
+    """Create or update a bare mirror of repo in cache_root
+
+    Each mirror is fetched at most once per process. A mirror that already
+    contains version, given as a full commit hash, is not fetched at all.
+    Returns the path of the mirror.
+    """
+    path = mirror_path(cache_root, repo)
+    with _mirror_lock(path), FileLock(str(path) + ".lock", lock_timeout()):
+        if str(path) in _fetched:
+            return path
+        if path.exists():
+            if _has_commit(path, version):
+                return path
+            logger.info(f"Updating mirror of {repo}")
+            Launcher("git", ["-C", path, "fetch", "-q", "--prune"]).run()
+        else:
+            logger.info(f"Creating mirror of {repo}")
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = tempfile.mkdtemp(dir=path.parent, prefix=path.name + ".")
+            try:
+                Launcher("git", ["clone", "-q", "--mirror", repo, tmp]).run()
+                # Checkouts borrow objects from the mirror, so they must never
+                # be pruned
+                Launcher("git", ["-C", tmp, "config", "gc.auto", "0"]).run()
+                os.rename(tmp, path)
+            finally:
+                shutil.rmtree(tmp, ignore_errors=True)
+        _fetched.add(str(path))
+    return path
+
+
+def _has_commit(path, version):
+    if not (version and re.fullmatch("[0-9a-fA-F]{40}", str(version))):
+        return False
+    args = ["git", "-C", str(path), "cat-file", "-e", f"{version}^{{commit}}"]
+    return subprocess.run(args, stderr=subprocess.DEVNULL).returncode == 0
+
 
 class Git(Provider):
     @staticmethod
-    def init_library(library):
+    def init_library(library, cache_root=None):
         logger.info(f"Cloning library into {library.location}")
         git_args = ["clone", library.sync_uri, library.location]
+        if cache_root:
+            # Get the objects from the mirror, but don't depend on it
+            mirror = update_mirror(cache_root, library.sync_uri)
+            git_args[1:1] = ["--reference", mirror, "--dissociate"]
         try:
             Launcher("git", git_args).run()
         except subprocess.CalledProcessError as e:
@@ -36,9 +104,27 @@ class Git(Provider):
 
         # TODO : Sanitize URL
         repo = self.config.get("repo")
+        if not self.cache_root:
+            logger.info("Checking out " + repo + " to " + local_dir)
+            args = ["clone", "-q", "--depth", "1", "--no-single-branch"]
+            Launcher("git", args + [repo, local_dir]).run()
+            if version:
+                args = ["-C", local_dir, "checkout", "-q", version]
+                Launcher("git", args).run()
+            return
+
+        mirror = update_mirror(self.cache_root, repo, version)
         logger.info("Checking out " + repo + " to " + local_dir)
-        args = ["clone", "-q", "--depth", "1", "--no-single-branch", repo, local_dir]
+        args = ["clone", "-q", "--shared", "--no-checkout", mirror, local_dir]
         Launcher("git", args).run()
-        if version:
-            args = ["-C", local_dir, "checkout", "-q", version]
-            Launcher("git", args).run()
+        Launcher("git", ["-C", local_dir, "remote", "set-url", "origin", repo]).run()
+        args = ["-C", local_dir, "checkout", "-q", version or "HEAD"]
+        Launcher("git", args).run()
+
+    def _resolved(self, files_root):
+        args = ["git", "-C", files_root, "rev-parse", "HEAD"]
+        try:
+            commit = subprocess.check_output(args, text=True).strip()
+        except (OSError, subprocess.CalledProcessError):
+            commit = None
+        return {"url": self.config.get("repo"), "commit": commit}
@@ -23,14 +23,20 @@ URL = "https://github.com/{user}/{repo}/archive/{version}.tar.gz"
 
 
 class Github(Provider):
-    def _checkout(self, local_dir):
+    def _url(self):
         user = self.config.get("user")
         repo = self.config.get("repo")
-
         version = self.config.get("version", "master")
-
         # TODO : Sanitize URL
-        url = URL.format(user=user, repo=repo, version=version)
+        return URL.format(user=user, repo=repo, version=version)
+
+    def _resolved(self, files_root):
+        return {"url": self._url()}
+
+    def _checkout(self, local_dir):
+        user = self.config.get("user")
+        repo = self.config.get("repo")
+        url = self._url()
         logger.info(f"Downloading {user}/{repo} from github")
         try:
             (filename, headers) = urllib.urlretrieve(url)
@@ -12,7 +12,7 @@ logger = logging.getLogger(__name__)
 
 class Local(Provider):
     @staticmethod
-    def init_library(library):
+    def init_library(library, cache_root=None):
         if not os.path.isdir(library.location):
             logger.error(f"Local library at location '{library.location}' not found.")
             exit(1)
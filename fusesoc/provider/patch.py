@@ -0,0 +1,269 @@
+# Copyright FuseSoC contributors
+# Licensed under the 2-Clause BSD License, see LICENSE for details.
+# SPDX-License-Identifier: BSD-2-Clause
+
+"""Apply unified diffs without calling external tools
+
+Handles the subset of unified diffs produced by diff -u and git diff that
+consists of modifying, creating and deleting text files, including git patches
+that create or delete empty files. Anything else, like
+renames, mode changes and binary patches, raises UnsupportedPatch, so that the
+caller can fall back to git apply.
+"""
+
+import os
+import re
+
+_HUNK_RE = re.compile(rb"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+
+# Git extended headers which describe something other than a change of the
+# contents of a file
+_UNSUPPORTED = (
+    b"old mode ",
+    b"new mode ",
+    b"rename from ",
+    b"rename to ",
+    b"copy from ",
+    b"copy to ",
+    b"GIT binary patch",
+    b"Binary files ",
+)
+
+
+class PatchError(RuntimeError):
+    pass
+
+
+class UnsupportedPatch(PatchError):
+    pass
+
+
+class FilePatch:
+    """Changes to a single file"""
+
+    def __init__(self, old_path, new_path):
+        self.old_path = old_path
+        self.new_path = new_path
+        self.hunks = []
+
+
+class Hunk:
+    def __init__(self, old_start, new_start):
+        self.old_start = old_start
+        self.new_start = new_start
+        self.old = []
+        self.new = []
+
+
+def _path(header, strip):
+    path = header.split(b"\t")[0].rstrip(b"\r\n")
+    if path.startswith(b'"'):
+        raise UnsupportedPatch("Quoted file names are not supported")
+    if path == b"/dev/null":
+        return None
+    path = path.decode("utf-8", "surrogateescape")
+    return "/".join(path.split("/")[strip:])
+
+
+def parse_patch(data, strip=1):
+    """Parse a unified diff into a list of FilePatch objects
+
+    strip leading components are removed from the file names, like with the
+    -p option of patch.
+    """
+    lines = data.splitlines(keepends=True)
+    patches = []
+    # Git header of the current file, until its ---/+++ header is found
+    git_header = None
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        if line.startswith(_UNSUPPORTED):
+            raise UnsupportedPatch(
+                "Unsupported patch line '{}'".format(line.decode(errors="replace"))
+            )
+        if line.startswith(b"diff --git "):
+            _add_header_only(patches, git_header)
+            git_header = {"path": _git_path(line, strip), "mode": None}
+        elif git_header and line.startswith((b"new file mode ", b"deleted file mode ")):
+            git_header["mode"] = line.split()[0]
+        if (
+            line.startswith(b"--- ")
+            and lines[i + 1 : i + 2]
+            and (lines[i + 1].startswith(b"+++ "))
+        ):
+            git_header = None
+            patches.append(
+                FilePatch(_path(line[4:], strip), _path(lines[i + 1][4:], strip))
+            )
+            i += 2
+            continue
+        m = _HUNK_RE.match(line)
+        if m:
+            if not patches:
+                raise PatchError("Hunk without file header")
+            (hunk, i) = _parse_hunk(lines, i, m)
+            patches[-1].hunks.append(hunk)
+            continue
+        i += 1
+    _add_header_only(patches, git_header)
+    return patches
+
+
+def _git_path(line, strip):
+    """Get the file name from a diff --git line
+
+    Only used for patches that create or delete empty files, which git writes
+    without ---/+++ headers. The old and new names are the same for these, so
+    the line is split in the middle.
+    """
+    names = line[len(b"diff --git ") :].rstrip(b"\r\n")
+    n = len(names) // 2
+    (old, new) = (_path(names[:n], strip), _path(names[n + 1 :], strip))
+    if names[n : n + 1] != b" " or old != new:
+        return None
+    return old
+
+
+def _add_header_only(patches, git_header):
+    """Add a git patch which only creates or deletes an empty file"""
+    if not (git_header and git_header["mode"]):
+        return
+    if not git_header["path"]:
+        raise UnsupportedPatch("Unable to parse file name in diff --git line")
+    if git_header["mode"] == b"new":
+        patches.append(FilePatch(None, git_header["path"]))
+    else:
+        patches.append(FilePatch(git_header["path"], None))
+
+
+def _parse_hunk(lines, i, m):
+    old_len = 1 if m.group(2) is None else int(m.group(2))
+    new_len = 1 if m.group(4) is None else int(m.group(4))
+    hunk = Hunk(int(m.group(1)), int(m.group(3)))
+    # Patches don't put a file position in hunks that create a file, or add
+    # lines to an empty one
+    if old_len == 0:
+        hunk.old_start += 1
+    i += 1
+    # Which of old and new the previous line belonged to
+    last = ()
+    while i < len(lines) and (
+        len(hunk.old) < old_len or len(hunk.new) < new_len or lines[i][:1] == b"\\"
+    ):
+        line = lines[i]
+        op = line[:1]
+        if op == b"\\":
+            # "\ No newline at end of file" applies to the previous line
+            for l in last:
+                l[-1] = l[-1].rstrip(b"\r\n")
+        elif op in [b" ", b"\n", b"\r"]:
+            # Some tools strip the space from empty context lines
+            text = line[1:] if op == b" " else line
+            hunk.old.append(text)
+            hunk.new.append(text)
+            last = (hunk.old, hunk.new)
+        elif op == b"-":
+            hunk.old.append(line[1:])
+            last = (hunk.old,)
+        elif op == b"+":
+            hunk.new.append(line[1:])
+            last = (hunk.new,)
+        else:
+            break
+        i += 1
+    if len(hunk.old) != old_len or len(hunk.new) != new_len:
+        raise PatchError(f"Truncated hunk at line {i}")
+    return (hunk, i)
+
+
+def _apply_hunks(lines, hunks, patch_file, name):
+    offset = 0
+    # Hunks must not overlap with the ones before them
+    min_pos = 0
+    for (n, hunk) in enumerate(hunks, 1):
+        expected = hunk.old_start - 1 + offset
+        pos = _find(lines, hunk.old, expected, min_pos)
+        if pos is None:
+            raise PatchError(f"{patch_file}: Hunk #{n} does not apply to {name}")
+        lines[pos : pos + len(hunk.old)] = hunk.new
+        offset = pos - (hunk.old_start - 1) + len(hunk.new) - len(hunk.old)
+        min_pos = pos + len(hunk.new)
+    return lines
+
+
+def _find(lines, old, expected, min_pos):
+    """Find old in lines, as close to expected as possible"""
+    last = len(lines) - len(old)
+    for delta in range(max(expected - min_pos, last - expected, 0) + 1):
+        for pos in [expected + delta, expected - delta]:
+            if min_pos <= pos <= last and lines[pos : pos + len(old)] == old:
+                return pos
+    return None
+
+
+def _safe_path(root, path, patch_file):
+    if os.path.isabs(path) or ".." in path.split("/"):
+        raise PatchError(f"{patch_file}: Refusing to patch '{path}' outside {root}")
+    return os.path.join(root, *path.split("/"))
+
+
+def _read_lines(path):
+    try:
+        with open(path, "rb") as f:
+            return f.read().splitlines(keepends=True)
+    except FileNotFoundError:
+        return None
+
+
+def apply_patches(patch_files, root, strip=1, dry_run=False):
+    """Apply a list of patch files to the directory root
+
+    The patches are applied in order, each one to the result of the ones
+    before it. All changes are made in memory first, so that nothing is
+    written unless all patches apply cleanly. With dry_run, nothing is written
+    at all. A PatchError is raised if any patch doesn't apply.
+    """
+    # Path -> list of lines, or None for deleted files
+    files = {}
+    for patch_file in patch_files:
+        with open(patch_file, "rb") as f:
+            data = f.read()
+        try:
+            file_patches = parse_patch(data, strip)
+        except PatchError as e:
+            raise type(e)(f"{patch_file}: {e}")
+        for fp in file_patches:
+            name = fp.old_path or fp.new_path
+            path = _safe_path(root, name, patch_file)
+            if path not in files:
+                files[path] = _read_lines(path)
+            if fp.old_path is None:
+                if files[path] is not None:
+                    raise PatchError(f"{patch_file}: {name} already exists")
+                lines = []
+            elif files[path] is None:
+                raise PatchError(f"{patch_file}: {name} does not exist")
+            else:
+                lines = files[path]
+            lines = _apply_hunks(lines, fp.hunks, patch_file, name)
+            if fp.new_path is None:
+                if lines:
+                    raise PatchError(
+                        f"{patch_file}: {name} is not empty after patching"
+                    )
+                lines = None
+            elif fp.new_path != name:
+                raise UnsupportedPatch(f"{patch_file}: Renaming files is not supported")
+            files[path] = lines
+
+    if dry_run:
+        return
+    for (path, lines) in files.items():
+        if lines is None:
+            if os.path.exists(path):
+                os.remove(path)
+            continue
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(b"".join(lines))
@@ -2,79 +2,228 @@
 # Licensed under the 2-Clause BSD License, see LICENSE for details.
 # SPDX-License-Identifier: BSD-2-Clause
 
+import json
 import logging
 import os
 import shutil
 import stat
+import tempfile
+import threading
 
-from fusesoc.utils import Launcher
+from fusesoc.filelock import FileLock
+from fusesoc.provider.patch import UnsupportedPatch, apply_patches
+from fusesoc.timing import timings
+from fusesoc.utils import Launcher, file_digest
 
 logger = logging.getLogger(__name__)
 
+# Written to files_root after a successful fetch
+MANIFEST = ".fusesoc_manifest.json"
+
+# Bump when the layout of the manifest changes
+MANIFEST_FORMAT = 1
+
+
+def lock_timeout():
+    """Get the number of seconds to wait for another process fetching the same
+    files"""
+    timeout = os.environ.get("FUSESOC_LOCK_TIMEOUT", "600")
+    try:
+        return float(timeout)
+    except ValueError:
+        logger.warning(f"Invalid FUSESOC_LOCK_TIMEOUT '{timeout}'. Using 600")
+        return 600.0
+
+
+def _make_tree_writable(topdir):
+    # Ensure all files and directories under topdir are writable
+    # (and readable) by owner.
+    for d, _, files in os.walk(topdir):
+        os.chmod(d, os.stat(d).st_mode | stat.S_IWRITE | stat.S_IREAD)
+        for fname in files:
+            fpath = os.path.join(d, fname)
+            if os.path.isfile(fpath):
+                os.chmod(fpath, os.stat(fpath).st_mode | stat.S_IWRITE | stat.S_IREAD)
+
+
+def _rmtree(path):
+    if os.path.exists(path):
+        _make_tree_writable(path)
+        shutil.rmtree(path)
+
 
 class Provider:
+    # Options which only affect how the files are fetched, not what is
+    # fetched. Changing them doesn't make already fetched files out of date.
+    TRANSPORT_OPTIONS = ["cachable"]
+
     def __init__(self, config, core_root, files_root):
         self.config = config
         self.core_root = core_root
         self.files_root = files_root
+        # Set by the core. Providers may keep shared downloads below it.
+        self.cache_root = None
         self.cachable = not (config.get("cachable", "") == False)
         self.patches = config.get("patches", [])
 
     def clean_cache(self):
-        def _make_tree_writable(topdir):
-            # Ensure all files and directories under topdir are writable
-            # (and readable) by owner.
-            for d, _, files in os.walk(topdir):
-                os.chmod(d, os.stat(d).st_mode | stat.S_IWRITE | stat.S_IREAD)
-                for fname in files:
-                    fpath = os.path.join(d, fname)
-                    if os.path.isfile(fpath):
-                        os.chmod(
-                            fpath, os.stat(fpath).st_mode | stat.S_IWRITE | stat.S_IREAD
-                        )
-
-        if os.path.exists(self.files_root):
-            _make_tree_writable(self.files_root)
-            shutil.rmtree(self.files_root)
+        _rmtree(self.files_root)
+
+    @property
+    def download_cache(self):
+        return os.path.join(self.cache_root, "downloads")
 
     def fetch(self):
+        with timings.phase("fetch", os.path.basename(self.files_root)):
+            return self._fetch()
+
+    def _fetch(self):
+        if self._check_status() == "downloaded":
+            return
+
+        # Several processes may share cache_root. Only let one of them fetch
+        # the files, and have the others wait and use the result.
+        with FileLock(self.files_root + ".lock", lock_timeout()):
+            if self._check_status() == "downloaded":
+                return
+
+            # Fetch into a temporary sibling directory, which is renamed into
+            # place once it's complete, so that nobody sees a partial fetch
+            (parent, name) = os.path.split(self.files_root)
+            os.makedirs(parent or ".", exist_ok=True)
+            staging = tempfile.mkdtemp(dir=parent or ".", prefix=f".{name}.")
+            try:
+                local_dir = os.path.join(staging, name)
+                self._checkout(local_dir)
+                # Some providers don't put anything in files_root
+                if not os.path.isdir(local_dir):
+                    return
+                patched = self.patch(local_dir)
+                self._write_manifest(local_dir, patched)
+                if os.path.exists(self.files_root):
+                    os.rename(self.files_root, os.path.join(staging, "old"))
+                os.rename(local_dir, self.files_root)
+            finally:
+                _rmtree(staging)
+
+    def _check_status(self):
         status = self.status()
-        if status == "empty":
-            self._checkout(self.files_root)
-            _fetched = True
-        elif status == "outofdate":
-            self.clean_cache()
-            self._checkout(self.files_root)
-            _fetched = True
-        elif status == "downloaded":
-            _fetched = False
-        else:
+        if status not in ["empty", "outofdate", "downloaded"]:
             raise RuntimeError(
                 "Provider status is: '" + status + "'. This shouldn't happen"
             )
-        if _fetched:
-            self._patch()
+        return status
+
+    def patch(self, files_root):
+        """Apply the patches of the core to files_root
 
-    def _patch(self):
+        All patches are checked before any of them is applied. Patches which
+        the built-in patch implementation can't handle are applied with git
+        instead. Returns the names of the applied patches.
+        """
+        names = []
+        patch_files = []
         for f in self.patches:
             patch_file = os.path.abspath(os.path.join(self.core_root, f))
             if os.path.isfile(patch_file):
-                logger.debug(
-                    "  applying patch file: "
-                    + patch_file
-                    + "\n"
-                    + "                   to: "
-                    + os.path.join(self.files_root)
-                )
-                try:
-                    Launcher("git", ["apply", patch_file], self.files_root).run()
-                except OSError:
-                    raise RuntimeError("Failed to call 'git' for patching core")
+                names.append(f)
+                patch_files.append(patch_file)
+        if not patch_files:
+            return names
+
+        logger.debug(
+            "  applying patch files: %s\n                    to: %s",
+            " ".join(patch_files),
+            files_root,
+        )
+        try:
+            apply_patches(patch_files, files_root)
+        except UnsupportedPatch as e:
+            logger.debug("Patching with git: %s", e)
+            args = ["apply", "--unsafe-paths", "--directory", files_root]
+            Launcher("git", args + patch_files).run()
+        return names
+
+    def _requested(self):
+        """Get everything that determines the contents of files_root"""
+        config = {
+            k: v for (k, v) in self.config.items() if k not in self.TRANSPORT_OPTIONS
+        }
+        patches = []
+        for f in self.patches:
+            try:
+                digest = file_digest(os.path.join(self.core_root, f))
+            except OSError:
+                digest = None
+            patches.append([f, digest])
+        # Round trip through JSON to compare like with like
+        return json.loads(
+            json.dumps({"config": config, "patches": patches}, default=str)
+        )
+
+    def _resolved(self, files_root):
+        """Get provider-specific details of what was actually fetched, e.g. the
+        commit a branch name resolved to"""
+        return {}
+
+    def manifest(self):
+        """Get the manifest written by the last fetch, or None"""
+        try:
+            with open(os.path.join(self.files_root, MANIFEST)) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if manifest.get("format") != MANIFEST_FORMAT:
+            return None
+        return manifest
+
+    def _write_manifest(self, files_root, patched):
+        manifest = {
+            "format": MANIFEST_FORMAT,
+            "provider": self.config.get("name"),
+            **self._requested(),
+            "patched": patched,
+            "resolved": self._resolved(files_root),
+        }
+        # Other processes may be reading the manifest of an existing fetch
+        path = os.path.join(files_root, MANIFEST)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}"
+        try:
+            with open(tmp, "w") as f:
+                json.dump(manifest, f, indent=2)
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    def _adopt(self):
+        """Write a manifest for files fetched without one
+
+        It's not known which patches were applied, so patched is None.
+        """
+        logger.debug("Writing missing manifest for %s", self.files_root)
+        try:
+            self._write_manifest(self.files_root, None)
+        except OSError as e:
+            logger.debug("Failed to write manifest: %s", e)
 
     def status(self):
         if not self.cachable:
             return "outofdate"
         if not os.path.isdir(self.files_root):
             return "empty"
-        else:
+        manifest = self.manifest()
+        if manifest is None:
+            if os.path.exists(os.path.join(self.files_root, MANIFEST)):
+                return "outofdate"
+            if not os.listdir(self.files_root):
+                return "empty"
+            # Fetched before manifests were introduced. Trust the files, like
+            # before, and record what they are assumed to be from now on.
+            self._adopt()
             return "downloaded"
+        requested = self._requested()
+        if any(manifest.get(k) != v for (k, v) in requested.items()):
+            return "outofdate"
+        return "downloaded"
@@ -7,6 +7,8 @@ import os.path
 import shutil
 import sys
 import tarfile
+import tempfile
+import time
 import zipfile
 
 logger = logging.getLogger(__name__)
@@ -19,40 +21,160 @@ else:
     from urllib2 import URLError
     from urllib2 import HTTPError
 
+from fusesoc.blobstore import CHUNK_SIZE, BlobStore
 from fusesoc.provider.provider import Provider
 
 
 class Url(Provider):
+    TRANSPORT_OPTIONS = Provider.TRANSPORT_OPTIONS + [
+        "chunk_size",
+        "user-agent",
+        "verify_cert",
+    ]
+
     def _checkout(self, local_dir):
         url = self.config.get("url")
-        logger.info("Downloading...")
-        user_agent = self.config.get("user-agent")
-        if not self.config.get("verify_cert", True):
-            import ssl
+        sha256 = self.config.get("sha256")
+        filetype = self.config.get("filetype")
+        if filetype not in ["tar", "zip", "simple"]:
+            raise RuntimeError(
+                "Unknown file type '" + str(filetype) + "' in [provider] section"
+            )
 
-            ssl._create_default_https_context = ssl._create_unverified_context
+        try:
+            if self.cache_root:
+                store = BlobStore(self.download_cache)
+                self._checkout_from(store, url, sha256, filetype, local_dir)
+            else:
+                with tempfile.TemporaryDirectory() as d:
+                    store = BlobStore(d)
+                    self._checkout_from(store, url, sha256, filetype, local_dir)
+        except BaseException:
+            # Don't leave a partially extracted core behind
+            shutil.rmtree(local_dir, ignore_errors=True)
+            raise
 
-        if user_agent and sys.version_info[0] >= 3:
-            opener = urllib.build_opener()
-            opener.addheaders = [("User-agent", user_agent)]
-            urllib.install_opener(opener)
+    def _checkout_from(self, store, url, sha256, filetype, local_dir):
+        filename = store.get(url, sha256)
+        if filename:
+            logger.info("Using cached download of %s", url)
+            self._extract(filename, url, filetype, local_dir)
+            self._sha256 = filename.name
+            return
+
+        # Tar archives and simple files are extracted while they are being
+        # downloaded. Zip archives need to be complete before they can be read.
+        chunk_size = int(self.config.get("chunk_size", CHUNK_SIZE))
         try:
-            (filename, headers) = urllib.urlretrieve(url)
+            with self._urlopen(url) as response, store.writer(url, sha256) as writer:
+                download = _Download(response, writer, url, chunk_size)
+                if filetype == "tar":
+                    with tarfile.open(
+                        fileobj=download, mode="r|*", bufsize=chunk_size
+                    ) as t:
+                        t.extractall(local_dir)
+                elif filetype == "simple":
+                    os.makedirs(local_dir)
+                    with open(os.path.join(local_dir, _basename(url)), "wb") as f:
+                        download.copy_to(f)
+                download.finish()
         except (URLError, HTTPError) as e:
             raise RuntimeError(f"Failed to download '{url}'. '{e.reason}'")
+        except tarfile.TarError as e:
+            raise RuntimeError(f"Failed to extract '{url}'. '{e}'")
 
-        filetype = self.config.get("filetype")
+        if filetype == "zip":
+            self._extract(writer.path, url, filetype, local_dir)
+        self._sha256 = writer.path.name
+
+    def _extract(self, filename, url, filetype, local_dir):
         if filetype == "tar":
-            t = tarfile.open(filename)
-            t.extractall(local_dir)
+            with tarfile.open(filename) as t:
+                t.extractall(local_dir)
         elif filetype == "zip":
             with zipfile.ZipFile(filename, "r") as z:
                 z.extractall(local_dir)
         elif filetype == "simple":
-            _filename = url.rsplit("/", 1)[1]
             os.makedirs(local_dir)
-            shutil.copy2(filename, os.path.join(local_dir, _filename))
-        else:
-            raise RuntimeError(
-                "Unknown file type '" + filetype + "' in [provider] section"
+            shutil.copyfile(filename, os.path.join(local_dir, _basename(url)))
+
+    def _resolved(self, files_root):
+        return {"url": self.config.get("url"), "sha256": getattr(self, "_sha256", None)}
+
+    def _urlopen(self, url):
+        logger.info("Downloading %s", url)
+        # Downloads may run in parallel threads, so the options are set on an
+        # opener for this download only instead of the global one
+        handlers = []
+        if not self.config.get("verify_cert", True):
+            import ssl
+
+            handlers.append(
+                urllib.HTTPSHandler(context=ssl._create_unverified_context())
+            )
+        opener = urllib.build_opener(*handlers)
+        user_agent = self.config.get("user-agent")
+        if user_agent:
+            opener.addheaders = [("User-agent", user_agent)]
+        return opener.open(url)
+
+
+class _Download:
+    """File object reading a download while storing it and reporting progress"""
+
+    # Minimum number of seconds between progress messages
+    PROGRESS_INTERVAL = 2
+
+    def __init__(self, response, writer, url, chunk_size):
+        self.response = response
+        self.writer = writer
+        self.url = url
+        self.chunk_size = chunk_size
+        self.size = int(response.headers.get("Content-Length") or 0)
+        self.done = 0
+        self._start = time.monotonic()
+        self._last = self._start
+
+    def read(self, size=-1):
+        data = self.response.read(size)
+        self.writer.write(data)
+        self.done += len(data)
+        now = time.monotonic()
+        if now - self._last >= self.PROGRESS_INTERVAL:
+            self._last = now
+            self._progress()
+        return data
+
+    def _progress(self):
+        if self.size:
+            logger.info(
+                "Downloaded %.1f of %.1f MiB (%d%%)",
+                self.done / 2**20,
+                self.size / 2**20,
+                100 * self.done // self.size,
             )
+        else:
+            logger.info("Downloaded %.1f MiB", self.done / 2**20)
+
+    def copy_to(self, f):
+        while True:
+            data = self.read(self.chunk_size)
+            if not data:
+                break
+            f.write(data)
+
+    def finish(self):
+        """Read the rest of the download, e.g. the padding after a tar
+        archive"""
+        while self.read(self.chunk_size):
+            pass
+        logger.info(
+            "Downloaded %.1f MiB from %s in %.1f s",
+            self.done / 2**20,
+            self.url,
+            time.monotonic() - self._start,
+        )
+
+
+def _basename(url):
+    return url.rsplit("/", 1)[1]
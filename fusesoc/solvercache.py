@@ -0,0 +1,87 @@
+# Copyright FuseSoC contributors
+# Licensed under the 2-Clause BSD License, see LICENSE for details.
+# SPDX-License-Identifier: BSD-2-Clause
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+
+class PersistentSolverCache:
+    """Dependency resolution results stored on disk
+
+    Each result is stored as a JSON file in the cache directory, named after a
+    hash of the key. It is up to the caller to validate that a stored result is
+    still valid before using it.
+
+    At most max_entries results are kept. When more are stored, the least
+    recently used ones are removed.
+    """
+
+    # Bump when the layout of the stored results changes
+    FORMAT = 1
+
+    MAX_ENTRIES = 1024
+
+    def __init__(self, cache_dir, max_entries=MAX_ENTRIES):
+        self.cache_dir = Path(cache_dir)
+        self.max_entries = max_entries
+
+    def _path(self, key):
+        _key = repr((self.FORMAT, key)).encode()
+        return self.cache_dir / (hashlib.sha256(_key).hexdigest() + ".json")
+
+    def get(self, key):
+        """Get the stored result for key, or None if there is none"""
+        try:
+            with open(self._path(key)) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.debug(f"Ignoring unreadable solver cache entry: {e}")
+            return None
+        if data.get("key") != repr(key):
+            return None
+        # Keep track of when the entry was last used
+        try:
+            os.utime(self._path(key))
+        except OSError:
+            pass
+        return data["value"]
+
+    def put(self, key, value):
+        """Store a JSON-serializable result for key"""
+        path = self._path(key)
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            (fd, tmp) = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+            with os.fdopen(fd, "w") as f:
+                json.dump({"key": repr(key), "value": value}, f)
+            os.replace(tmp, path)
+        except OSError as e:
+            logger.warning(f"Failed to write solver cache entry {path}: {e}")
+            return
+        self.trim()
+
+    def trim(self):
+        """Remove the least recently used entries beyond max_entries"""
+        entries = []
+        for path in self.cache_dir.glob("*.json"):
+            try:
+                entries.append((path.stat().st_mtime_ns, path))
+            except OSError:
+                pass
+        if len(entries) <= self.max_entries:
+            return
+        entries.sort()
+        for (_, path) in entries[: len(entries) - self.max_entries]:
+            try:
+                path.unlink()
+            except OSError:
+                pass
@@ -0,0 +1,136 @@
+# Copyright FuseSoC contributors
+# Licensed under the 2-Clause BSD License, see LICENSE for details.
+# SPDX-License-Identifier: BSD-2-Clause
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+class Timings:
+    """Wall and CPU time spent in each phase of a FuseSoC run
+
+    Phases are measured with the phase() context manager. A phase can be
+    entered several times, e.g. once per core, in which case the time of each
+    item is recorded in addition to the total for the phase. Nothing is
+    measured unless the timings are enabled.
+
+    CPU time is measured for the whole process, so it includes the time of
+    other threads running at the same time.
+
+    If tracing is enabled, each time a phase is entered is also recorded as a
+    span, with the thread it ran in, so that the run can be inspected in a
+    trace viewer.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.tracing = False
+        self.phases = {}
+        self.spans = []
+        self._origin = time.perf_counter()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name, item=None):
+        if not (self.enabled or self.tracing):
+            yield
+            return
+
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            if self.enabled:
+                self._add(name, item, end - wall, time.process_time() - cpu)
+            if self.tracing:
+                span = (name, item, wall, end, threading.current_thread())
+                with self._lock:
+                    self.spans.append(span)
+
+    def _add(self, name, item, wall, cpu):
+        with self._lock:
+            phase = self.phases.setdefault(
+                name, {"wall": 0.0, "cpu": 0.0, "count": 0, "items": {}}
+            )
+            phase["wall"] += wall
+            phase["cpu"] += cpu
+            phase["count"] += 1
+            if item is not None:
+                _item = phase["items"].setdefault(str(item), {"wall": 0.0, "cpu": 0.0})
+                _item["wall"] += wall
+                _item["cpu"] += cpu
+
+    def report(self, max_items=10):
+        """Get the timings as a table
+
+        Items of each phase are listed below the phase, slowest first. At most
+        max_items items are listed for each phase.
+        """
+        names = [name for name in self.phases]
+        for phase in self.phases.values():
+            names += ["  " + item for item in phase["items"]]
+        w = max([len(name) for name in names] + [20])
+
+        lines = [f"{'Phase':<{w}} {'Wall':>10} {'CPU':>10} {'Count':>7}"]
+        for name, phase in self.phases.items():
+            lines.append(
+                f"{name:<{w}} {phase['wall']:>9.3f}s {phase['cpu']:>9.3f}s "
+                f"{phase['count']:>7}"
+            )
+            items = sorted(
+                phase["items"].items(), key=lambda x: x[1]["wall"], reverse=True
+            )
+            for (item, t) in items[:max_items]:
+                item = "  " + item
+                lines.append(f"{item:<{w}} {t['wall']:>9.3f}s {t['cpu']:>9.3f}s")
+            if len(items) > max_items:
+                lines.append(f"  ({len(items) - max_items} more)")
+        return "\n".join(lines)
+
+    def write_json(self, path):
+        with open(path, "w") as f:
+            json.dump(self.phases, f, indent=2)
+
+    def write_trace(self, path):
+        """Write the recorded spans as a Trace Event Format JSON file
+
+        The file can be loaded in Perfetto or chrome://tracing.
+        """
+        pid = os.getpid()
+        events = []
+        threads = {}
+        for (name, item, start, end, thread) in self.spans:
+            threads[thread.ident] = thread.name
+            event = {
+                "name": name if item is None else f"{name} {item}",
+                "cat": name,
+                "ph": "X",
+                "ts": (start - self._origin) * 1e6,
+                "dur": (end - start) * 1e6,
+                "pid": pid,
+                "tid": thread.ident,
+            }
+            if item is not None:
+                event["args"] = {"item": str(item)}
+            events.append(event)
+        for (tid, thread_name) in threads.items():
+            events.append(
+                {
+                    "name": "thread_name",
+                    "ph": "M",
+                    "pid": pid,
+                    "tid": tid,
+                    "args": {"name": thread_name},
+                }
+            )
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+
+# Timings of the current run
+timings = Timings()
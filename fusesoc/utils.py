@@ -2,10 +2,12 @@
 # Licensed under the 2-Clause BSD License, see LICENSE for details.
 # SPDX-License-Identifier: BSD-2-Clause
 
+import hashlib
 import logging
 import subprocess
 import sys
 import warnings
+from collections import OrderedDict
 
 import yaml
 
@@ -163,6 +165,106 @@ def yaml_read(data):
     return yaml.load(data, Loader=YamlLoader)
 
 
+def file_digest(path, chunk_size=1024 * 1024):
+    """Get the SHA-256 hash of a file as a hex string"""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def freeze_flags(flags):
+    """Get a hashable representation of a flags dict
+
+    The result can be used as a dict key. Two flags dicts give the same result
+    if and only if they are equal.
+    """
+
+    # Fast path for the common case where all values are hashable scalars
+    try:
+        return frozenset(flags.items())
+    except TypeError:
+        pass
+
+    def _freeze(value):
+        if isinstance(value, dict):
+            return frozenset((k, _freeze(v)) for k, v in value.items())
+        elif isinstance(value, list):
+            return tuple(_freeze(v) for v in value)
+        return value
+
+    return _freeze(flags)
+
+
+class LRUCache:
+    """A dict-like cache which holds at most maxsize entries
+
+    When the cache is full, the least recently used entry is evicted. A
+    maxsize of None means that the cache is unbounded, and a maxsize of 0
+    disables caching. The number of hits, misses and evictions are counted for
+    tuning purposes.
+    """
+
+    def __init__(self, maxsize=None):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        """Get the value for key, or default if key is not in the cache
+
+        Values can be anything, including None, so callers that need to tell
+        a miss apart from a stored None should pass a sentinel as default.
+        """
+        try:
+            value = self._data[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        if self.maxsize == 0:
+            return
+        self._data[key] = value
+        self._data.move_to_end(key)
+        if self.maxsize is not None:
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key, default=None):
+        return self._data.pop(key, default)
+
+    def clear(self):
+        """Remove all entries. Statistics are kept."""
+        self._data.clear()
+
+    def info(self):
+        """Get the cache statistics as a dict"""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+        }
+
+
 def merge_dict(d1, d2):
     for key, value in d2.items():
         if isinstance(value, dict):
@@ -52,7 +52,6 @@ setup(
     ],
     install_requires=[
         "edalize @ git+https://github.com/zhayden14/edalize.git#egg=edalize",
-        "pyparsing",
         "pyyaml",
         "simplesat>=0.8.0",
     ],
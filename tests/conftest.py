@@ -0,0 +1,17 @@
+# Copyright FuseSoC contributors
+# Licensed under the 2-Clause BSD License, see LICENSE for details.
+# SPDX-License-Identifier: BSD-2-Clause
+
+import pytest
+
+
+@pytest.fixture
+def config(tmp_path_factory):
+    """A Config which keeps its cache_root in a temporary directory, so that
+    tests don't touch the cache of the user running them"""
+    from fusesoc.config import Config
+
+    tmp = tmp_path_factory.mktemp("config")
+    config_file = tmp / "fusesoc.conf"
+    config_file.write_text(f"[main]\ncache_root = {tmp / 'cache'}\n")
+    return Config(str(config_file))
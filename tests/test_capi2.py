@@ -98,6 +98,61 @@ def test_capi2_export():
     assert expected == sorted(result)
 
 
+def test_capi2_export_sync(tmp_path):
+    from fusesoc.core import Core
+
+    core_root = tmp_path / "core"
+    export_root = tmp_path / "export"
+    (core_root / "sub").mkdir(parents=True)
+
+    def make_core(files):
+        core_file = core_root / "sync.core"
+        core_file.write_text(
+            "CAPI=2:\n"
+            "name: ::sync:0\n"
+            "filesets:\n"
+            "  rtl:\n"
+            "    files: [{}]\n"
+            "    file_type: verilogSource\n"
+            "targets:\n"
+            "  default:\n"
+            "    filesets: [rtl]\n".format(", ".join(files))
+        )
+        return Core(str(core_file))
+
+    (core_root / "a.v").write_text("a")
+    (core_root / "sub" / "b.v").write_text("b")
+    core = make_core(["a.v", "sub/b.v"])
+    core.export(export_root)
+    (export_root / "stale.v").write_text("stale")
+    a_ino = (export_root / "a.v").stat().st_ino
+
+    # Only changed files are copied and stale files are removed
+    (core_root / "sub" / "b.v").write_text("bb")
+    core.export(export_root)
+    assert (export_root / "a.v").stat().st_ino == a_ino
+    assert (export_root / "sub" / "b.v").read_text() == "bb"
+    assert not (export_root / "stale.v").exists()
+
+    core = make_core(["a.v"])
+    core.export(export_root)
+    assert sorted(p.name for p in export_root.iterdir()) == ["a.v"]
+
+    # Linked files share the inode with the source
+    core.export(export_root, mode="link")
+    src_ino = (core_root / "a.v").stat().st_ino
+    assert (export_root / "a.v").stat().st_ino == src_ino
+
+    # Replacing linked files doesn't touch the source
+    (core_root / "a.v").write_text("new")
+    core.export(export_root, mode="copy")
+    (export_root / "a.v").write_text("changed")
+    assert (core_root / "a.v").read_text() == "new"
+
+    with pytest.raises(RuntimeError, match="Invalid export mode"):
+        core.export(export_root, mode="rsync")
+
+
 def test_capi2_append():
     from fusesoc.core import Core
 
@@ -206,6 +261,58 @@ def test_capi2_get_files():
     assert expected == result
 
 
+def test_capi2_memo(monkeypatch):
+    import pickle
+
+    from fusesoc.core import Core
+
+    core_file = os.path.join(tests_dir, "capi2_cores", "misc", "files.core")
+    core = Core(core_file)
+
+    resolved = []
+    _resolve_filesets = core._resolve_filesets
+
+    def resolve_filesets(flags, flag_defs):
+        resolved.append(flags)
+        return _resolve_filesets(flags, flag_defs)
+
+    monkeypatch.setattr(core, "_resolve_filesets", resolve_filesets)
+
+    from fusesoc.capi2.exprs import FlagDefs
+
+    flag_defs = []
+    from_flags = FlagDefs.from_flags
+
+    def count_flag_defs(flags):
+        if not isinstance(flags, FlagDefs):
+            flag_defs.append(flags)
+        return from_flags(flags)
+
+    monkeypatch.setattr(FlagDefs, "from_flags", count_flag_defs)
+
+    # Filesets and flag defs are resolved once per flags
+    files = core.get_files({"tool": "icarus"})
+    core.get_depends({"tool": "icarus"})
+    assert len(resolved) == 1
+    assert flag_defs == [{"tool": "icarus"}]
+    core.get_files({"tool": "verilator"})
+    assert len(resolved) == 2
+
+    # Modifying the result doesn't affect later queries
+    files[0]["name"] = "modified"
+    assert core.get_files({"tool": "icarus"})[0]["name"] == "vlogfile"
+    assert len(resolved) == 2
+
+    core.invalidate_memo()
+    core.get_files({"tool": "icarus"})
+    assert len(resolved) == 3
+
+    # The memo is not pickled
+    monkeypatch.undo()
+    assert core._memo
+    assert pickle.loads(pickle.dumps(core))._memo == {}
+
+
 def test_capi2_type_check():
     from fusesoc.core import Core
 
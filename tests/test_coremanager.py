@@ -8,10 +8,9 @@ import pytest
 
 
 # FIXME: fails on windows if FuseSoC is on a different drive from temp folder location
-def test_deptree(tmp_path):
+def test_deptree(tmp_path, config):
     import os
 
-    from fusesoc.config import Config
     from fusesoc.coremanager import CoreManager
     from fusesoc.edalizer import Edalizer
     from fusesoc.librarymanager import Library
@@ -23,7 +22,7 @@ def test_deptree(tmp_path):
     deptree_cores_dir = tests_dir / "capi2_cores" / "deptree"
     lib = Library("deptree", deptree_cores_dir)
 
-    cm = CoreManager(Config())
+    cm = CoreManager(config)
     cm.add_library(lib, [])
 
     root_core = cm.get_core(Vlnv("::deptree-root"))
@@ -122,11 +121,10 @@ def test_deptree(tmp_path):
 
 
 # FIXME: fails on windows if FuseSoC is on a different drive from temp folder location
-def test_copyto():
+def test_copyto(config):
     import os
     import tempfile
 
-    from fusesoc.config import Config
     from fusesoc.coremanager import CoreManager
     from fusesoc.edalizer import Edalizer
     from fusesoc.librarymanager import Library
@@ -140,7 +138,7 @@ def test_copyto():
     core_dir = this_dir / "cores" / "misc" / "copytocore"
     lib = Library("misc", core_dir)
 
-    cm = CoreManager(Config())
+    cm = CoreManager(config)
     cm.add_library(lib, [])
 
     core = cm.get_core(Vlnv("::copytocore"))
@@ -171,11 +169,10 @@ def test_copyto():
     assert (Path(work_root) / "subdir" / "another.file").exists()
 
 
-def test_export():
+def test_export(config):
     import os
     import tempfile
 
-    from fusesoc.config import Config
     from fusesoc.coremanager import CoreManager
     from fusesoc.edalizer import Edalizer
     from fusesoc.librarymanager import Library
@@ -190,7 +187,7 @@ def test_export():
     this_dir = Path(__file__).resolve().parent
     core_dir = this_dir / "cores"
 
-    cm = CoreManager(Config())
+    cm = CoreManager(config)
     cm.add_library(Library("cores", core_dir), [])
 
     core = cm.get_core(Vlnv("::wb_intercon"))
@@ -219,12 +216,75 @@ def test_export():
         assert (export_root / f).is_file()
 
 
+def test_export_sync(tmp_path):
+    from fusesoc.config import Config
+    from fusesoc.coremanager import CoreManager
+    from fusesoc.edalizer import Edalizer
+    from fusesoc.librarymanager import Library
+    from fusesoc.vlnv import Vlnv
+
+    core_dir = tmp_path / "cores"
+    (core_dir / "common").mkdir(parents=True)
+    (core_dir / "common" / "c.v").write_text("c")
+    (core_dir / "top").mkdir()
+    (core_dir / "top" / "top.v").write_text("top")
+    (core_dir / "dep").mkdir()
+    (core_dir / "dep" / "dep.v").write_text("dep")
+    (core_dir / "dep" / "dep.core").write_text(
+        "CAPI=2:\nname: ::dep:0\n"
+        "filesets: {rtl: {files: [dep.v], file_type: verilogSource}}\n"
+        "targets: {default: {filesets: [rtl]}}\n"
+    )
+
+    def write_top(depend):
+        (core_dir / "top" / "top.core").write_text(
+            "CAPI=2:\nname: ::top:0\n"
+            "filesets:\n"
+            "  rtl:\n"
+            "    files: [top.v, ../common/c.v]\n"
+            "    file_type: verilogSource\n"
+            "    depend: [{}]\n"
+            "targets: {{default: {{filesets: [rtl], toplevel: top}}}}\n".format(depend)
+        )
+
+    config_file = tmp_path / "fusesoc.conf"
+    config_file.write_text(f"[main]\ncache_root = {tmp_path / 'cache'}\n")
+    export_root = tmp_path / "work" / "src"
+
+    def export():
+        cm = CoreManager(Config(str(config_file)), use_index=False)
+        cm.add_library(Library("cores", core_dir), [])
+        Edalizer(
+            toplevel=Vlnv("::top:0"),
+            flags={"tool": "icarus"},
+            core_manager=cm,
+            work_root=str(tmp_path / "work"),
+            export_root=str(export_root),
+        ).run()
+
+    write_top('"::dep:0"')
+    export()
+    (export_root / "user.txt").write_text("not exported")
+    export()
+
+    # Files from outside the core directory are exported next to it
+    assert (export_root / "common" / "c.v").read_text() == "c"
+    assert (export_root / "top_0" / "top.v").is_file()
+    assert (export_root / "dep_0" / "dep.v").is_file()
+
+    # Only files from earlier exports are removed
+    write_top("")
+    export()
+    assert not (export_root / "dep_0").exists()
+    assert (export_root / "common" / "c.v").is_file()
+    assert (export_root / "user.txt").is_file()
+
+
 # FIXME: fails on windows if FuseSoC is on a different drive from temp folder location
-def test_virtual():
+def test_virtual(config):
     import os
     import tempfile
 
-    from fusesoc.config import Config
     from fusesoc.coremanager import CoreManager
     from fusesoc.edalizer import Edalizer
     from fusesoc.librarymanager import Library
@@ -238,7 +298,7 @@ def test_virtual():
     this_dir = Path(__file__).resolve().parent
     core_dir = this_dir / "capi2_cores" / "virtual"
 
-    cm = CoreManager(Config())
+    cm = CoreManager(config)
     cm.add_library(Library("virtual", core_dir), [])
 
     root_core = cm.get_core(Vlnv("::user"))
@@ -255,3 +315,528 @@ def test_virtual():
     deps_names = [str(c) for c in deps]
 
     assert deps_names == ["::impl2:0", "::user:0"]
+
+
+def test_core_index(tmp_path):
+    import os
+
+    from fusesoc.config import Config
+    from fusesoc.coremanager import CoreManager
+    from fusesoc.librarymanager import Library
+
+    core_dir = tmp_path / "cores"
+    core_dir.mkdir()
+    core_file = core_dir / "indexed.core"
+    core_file.write_text("CAPI=2:\nname: ::indexed:1.0\ndescription: first\n")
+
+    config_file = tmp_path / "fusesoc.conf"
+    config_file.write_text(f"[main]\ncache_root = {tmp_path / 'cache'}\n")
+    config = Config(str(config_file))
+
+    def load(**kwargs):
+        cm = CoreManager(config, **kwargs)
+        cm.add_library(Library("indexed", core_dir), [])
+        return cm.get_cores()["::indexed:1.0"]
+
+    assert load().description == "first"
+    assert list((tmp_path / "cache" / "core_index").iterdir())
+
+    # Cores are loaded from the index as long as mtime and size match
+    st = os.stat(core_file)
+    core_file.write_text("CAPI=2:\nname: ::indexed:1.0\ndescription: other\n")
+    os.utime(core_file, ns=(st.st_atime_ns, st.st_mtime_ns))
+    assert load().description == "first"
+    assert load(use_index=False).description == "other"
+
+    # ...and are reparsed when the contents change
+    os.utime(core_file, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    assert load().description == "other"
+    assert load(rebuild_index=True).description == "other"
+
+
+def test_parallel_find_cores(tmp_path, config):
+    from fusesoc.coremanager import CoreManager
+    from fusesoc.librarymanager import Library
+
+    core_dir = tmp_path / "cores"
+    for i in range(8):
+        d = core_dir / f"dir{i}"
+        d.mkdir(parents=True)
+        (d / "core.core").write_text(
+            f"CAPI=2:\nname: ::core{i % 3}:1.0\ndescription: dir{i}\n"
+        )
+    (core_dir / "broken.core").write_text("CAPI=2:\ndescription: no name\n")
+
+    def load(jobs):
+        cm = CoreManager(config, use_index=False, jobs=jobs)
+        cores = cm.find_cores(Library("parallel", core_dir), [])
+        return [(str(c.name), c.description) for c in cores]
+
+    assert load(jobs=1) == load(jobs=4)
+    assert len(load(jobs=4)) == 8
+
+
+def test_parallel_find_cores_messages(tmp_path, config, caplog):
+    """Messages from worker processes are logged in the order of the cores"""
+    from fusesoc.coremanager import CoreManager
+    from fusesoc.librarymanager import Library
+
+    core_dir = tmp_path / "cores"
+    for i in range(8):
+        d = core_dir / f"dir{i}"
+        d.mkdir(parents=True)
+        (d / "core.core").write_text(
+            f"CAPI=2:\nname: ::core{i}:1.0\ntargets:\n  default:\n    bogus{i}: 1\n"
+        )
+
+    cm = CoreManager(config, jobs=4)
+    cores = cm.find_cores(Library("parallel", core_dir), [])
+
+    warnings = [r.getMessage() for r in caplog.records if "Unknown item" in r.message]
+    assert warnings == [
+        f"Unknown item bogus{c.name.name[4:]} in section Target" for c in cores
+    ]
+    assert len(warnings) == 8
+
+
+def test_jobs_validation(config):
+    from fusesoc.coremanager import CoreManager
+    from fusesoc.main import get_parser
+
+    with pytest.raises(ValueError):
+        CoreManager(config, jobs=-1)
+
+    parser = get_parser()
+    assert parser.parse_args(["--jobs", "0", "list-cores"]).jobs == 0
+    for option in ["--jobs", "--fetch-jobs"]:
+        for value in ["-1", "x"]:
+            with pytest.raises(SystemExit):
+                parser.parse_args([option, value, "list-cores"])
+    with pytest.raises(SystemExit):
+        parser.parse_args(["run", "--export-jobs", "-1", "::core"])
+
+
+def test_lazy_core(config):
+    from fusesoc.capi2.core import LazyCore
+    from fusesoc.core import Core
+    from fusesoc.coremanager import CoreManager
+    from fusesoc.librarymanager import Library
+    from fusesoc.vlnv import Vlnv
+
+    tests_dir = Path(__file__).resolve().parent
+    deptree_cores_dir = tests_dir / "capi2_cores" / "deptree"
+
+    cm = CoreManager(config, use_index=False)
+    cm.add_library(Library("deptree", deptree_cores_dir), [])
+
+    cores = cm.get_cores()
+    assert all(isinstance(c, LazyCore) for c in cores.values())
+
+    # Dependency resolution only needs the information from the header
+    root_core = cm.get_core(Vlnv("::deptree-root"))
+    cm.get_depends(root_core.name, {"is_toplevel": True})
+    assert not any(c._core for c in cores.values())
+
+    flags = {"is_toplevel": True, "tool": "icarus"}
+    for core in cores.values():
+        full_core = Core(core.core_file)
+        assert core.get_depends(flags) == full_core.get_depends(flags)
+
+    # Anything else parses the full core file
+    assert root_core.get_toplevel({}) == "root"
+    assert root_core._core
+    assert root_core._core.name is root_core.name
+    assert not any(c._core for c in cores.values() if c is not root_core)
+
+
+@pytest.mark.parametrize(
+    "body",
+    [
+        "name: ::malformed:0\ntargets: {default: foo}\n",
+        "name: ::malformed:0\nfilesets: {fs: [1, 2]}\n",
+        "name: ::malformed:0\nfilesets: {fs: {depend: [1]}}\n",
+        "name: 123\n",
+        "name: ::malformed:0\nvirtual: [1]\n",
+    ],
+)
+def test_lazy_core_malformed(tmp_path, config, caplog, body):
+    from fusesoc.coremanager import CoreManager
+    from fusesoc.librarymanager import Library
+
+    core_dir = tmp_path / "cores"
+    core_dir.mkdir()
+    (core_dir / "good.core").write_text("CAPI=2:\nname: ::good:0\n")
+    (core_dir / "malformed.core").write_text("CAPI=2:\n" + body)
+
+    cm = CoreManager(config, use_index=False)
+    cm.add_library(Library("cores", core_dir), [])
+
+    assert list(cm.get_cores()) == ["::good:0"]
+    assert "Parse error. Ignoring file" in caplog.text
+
+
+def test_lazy_core_broken(tmp_path, capsys, caplog):
+    from fusesoc.config import Config
+    from fusesoc.coremanager import CoreManager
+    from fusesoc.librarymanager import Library
+    from fusesoc.main import list_cores
+    from fusesoc.vlnv import Vlnv
+
+    core_dir = tmp_path / "cores"
+    core_dir.mkdir()
+    (core_dir / "good.core").write_text("CAPI=2:\nname: ::good:0\n")
+    # The header is fine, but the rest of the core is not
+    (core_dir / "broken.core").write_text(
+        "CAPI=2:\nname: ::broken:0\nfilesets:\n  rtl:\n    files: {a: 1}\n"
+    )
+
+    config_file = tmp_path / "fusesoc.conf"
+    config_file.write_text(f"[main]\ncache_root = {tmp_path / 'cache'}\n")
+    cm = CoreManager(Config(str(config_file)), use_index=False)
+    cm.add_library(Library("cores", core_dir), [])
+
+    with pytest.raises(RuntimeError, match="broken.core"):
+        cm.get_core(Vlnv("::broken:0")).load()
+
+    list_cores(cm, None)
+    out = capsys.readouterr().out
+    assert "::good:0" in out
+    assert "::broken:0" not in out
+    assert "Ignoring ::broken:0" in caplog.text
+
+
+def test_incremental_rescan(tmp_path, monkeypatch):
+    import os
+
+    import fusesoc.coremanager
+    from fusesoc.config import Config
+    from fusesoc.coremanager import CoreManager
+    from fusesoc.librarymanager import Library
+
+    core_dir = tmp_path / "cores"
+    for name in ["a", "b"]:
+        (core_dir / name).mkdir(parents=True)
+        (core_dir / name / f"{name}.core").write_text(f"CAPI=2:\nname: ::{name}\n")
+
+    def age_dirs():
+        # Make the directory mtimes old enough to be trusted by the scanner
+        for d in [core_dir, core_dir / "a", core_dir / "b"]:
+            os.utime(d, (1e9, 1e9))
+
+    config_file = tmp_path / "fusesoc.conf"
+    config_file.write_text(f"[main]\ncache_root = {tmp_path / 'cache'}\n")
+    config = Config(str(config_file))
+
+    listed = []
+    _list_dir = fusesoc.coremanager._list_dir
+
+    def list_dir(root):
+        listed.append(Path(root).name)
+        return _list_dir(root)
+
+    monkeypatch.setattr(fusesoc.coremanager, "_list_dir", list_dir)
+
+    def scan(ignored_dirs=[]):
+        listed.clear()
+        cm = CoreManager(config)
+        cores = cm.find_cores(Library("incremental", core_dir), ignored_dirs)
+        return sorted(str(c.name) for c in cores)
+
+    age_dirs()
+    assert scan() == ["::a:0", "::b:0"]
+    assert sorted(listed) == ["a", "b", "cores"]
+
+    # Unchanged directories are not listed again
+    assert scan() == ["::a:0", "::b:0"]
+    assert listed == []
+
+    # ignored_dirs is applied to unchanged directories
+    assert scan([core_dir / "a"]) == ["::b:0"]
+    assert listed == []
+
+    # Changed directories are listed again
+    (core_dir / "b" / "FUSESOC_IGNORE").touch()
+    (core_dir / "c").mkdir()
+    (core_dir / "c" / "c.core").write_text("CAPI=2:\nname: ::c\n")
+    assert scan() == ["::a:0", "::c:0"]
+    assert sorted(listed) == ["b", "c", "cores"]
+
+
+def test_solver_package_reuse(monkeypatch, config):
+    from fusesoc.core import Core
+    from fusesoc.coremanager import CoreManager
+    from fusesoc.librarymanager import Library
+    from fusesoc.vlnv import Vlnv
+
+    tests_dir = Path(__file__).resolve().parent
+    deptree_cores_dir = tests_dir / "capi2_cores" / "deptree"
+    cm = CoreManager(config, use_index=False)
+    cm.add_library(Library("deptree", deptree_cores_dir), [])
+
+    flags = {"tool": "icarus"}
+    deps = cm.get_depends(Vlnv("::deptree-root"), flags)
+
+    parsed = []
+    _parse_to_package = cm.db._package_parser.parse_to_package
+
+    def parse_to_package(s):
+        parsed.append(s)
+        return _parse_to_package(s)
+
+    monkeypatch.setattr(cm.db._package_parser, "parse_to_package", parse_to_package)
+
+    # Packages are reused when solving again
+    cm.db._solver_cache_invalidate_all()
+    assert cm.get_depends(Vlnv("::deptree-root"), flags) == deps
+    assert parsed == []
+
+    # Only the package for a newly added core is created
+    core_file = deptree_cores_dir / "child4.core"
+    cm.db.add(Core(str(core_file)), "deptree")
+    assert [str(c.name) for c in cm.get_depends(Vlnv("::deptree-root"), flags)] == [
+        str(c.name) for c in deps
+    ]
+    assert len(parsed) == 1
+    assert parsed[0].startswith("deptree__child4 ")
+
+
+def test_find_name_index(tmp_path, monkeypatch, config):
+    from fusesoc.coremanager import CoreManager, DependencyError
+    from fusesoc.librarymanager import Library
+    from fusesoc.vlnv import Vlnv
+
+    for name in ["multi:1.0", "multi:1.1", "multi:2.0", "multi:2.0-r1", "other:1.0"]:
+        core_file = tmp_path / (name.replace(":", "-") + ".core")
+        core_file.write_text(f"CAPI=2:\nname: ::{name}\nvirtual: ['::iface']\n")
+
+    cm = CoreManager(config, use_index=False)
+    cm.add_library(Library("multi", tmp_path), [])
+
+    solved = []
+    _solve = cm.db._solve
+
+    def solve(*args, **kwargs):
+        solved.append(args[0])
+        return _solve(*args, **kwargs)
+
+    monkeypatch.setattr(cm.db, "_solve", solve)
+
+    for (name, expected) in [
+        ("::multi", "::multi:2.0-r1"),
+        ("::multi:1.1", "::multi:1.1"),
+        ("<::multi:2.0", "::multi:1.1"),
+        (">=::multi:1.1", "::multi:2.0-r1"),
+        ("::multi:2.0", "::multi:2.0"),
+    ]:
+        vlnv = Vlnv(name)
+        assert str(cm.db.find(vlnv).name) == expected
+        assert str(_solve(vlnv, only_matching_vlnv=True)[-1].name) == expected
+    assert solved == []
+
+    # Virtual cores and errors are handled by the solver
+    assert str(cm.db.find(Vlnv("::iface")).name) in ["::multi:2.0-r1", "::other:1.0"]
+    with pytest.raises(DependencyError):
+        cm.db.find(Vlnv("::multi:3.0"))
+    with pytest.raises(DependencyError):
+        cm.db.find(Vlnv("::missing"))
+    assert len(solved) == 3
+
+
+def test_solver_cache(tmp_path):
+    from fusesoc.config import Config
+    from fusesoc.coremanager import CoreManager
+    from fusesoc.librarymanager import Library
+    from fusesoc.vlnv import Vlnv
+
+    for name in ["multi:1.0", "multi:2.0"]:
+        core_file = tmp_path / (name.replace(":", "-") + ".core")
+        core_file.write_text(f"CAPI=2:\nname: ::{name}\n")
+
+    config_file = tmp_path / "fusesoc.conf"
+    config_file.write_text(
+        f"[main]\ncache_root = {tmp_path / 'cache'}\nsolver_cache_size = 2\n"
+    )
+    cm = CoreManager(Config(str(config_file)), use_index=False)
+    cm.add_library(Library("multi", tmp_path), [])
+
+    def solve(name, flags={}):
+        return [str(c.name) for c in cm.db.solve(Vlnv(name), flags)]
+
+    # Vlnvs that only differ in relation don't share cache entries
+    assert solve("::multi:2.0") == ["::multi:2.0"]
+    assert solve("<::multi:2.0") == ["::multi:1.0"]
+    assert cm.db.solver_cache_info()["misses"] == 2
+
+    # Equal flags give the same key regardless of order
+    assert solve("::multi:2.0", {"a": True, "b": "x"}) == ["::multi:2.0"]
+    assert solve("::multi:2.0", {"b": "x", "a": True}) == ["::multi:2.0"]
+    assert cm.db.solver_cache_info() == {
+        "hits": 1,
+        "misses": 3,
+        "evictions": 1,
+        "size": 2,
+        "maxsize": 2,
+    }
+
+    # The least recently used entry was evicted
+    assert solve("<::multi:2.0") == ["::multi:1.0"]
+    assert cm.db.solver_cache_info()["hits"] == 2
+    assert solve("::multi:2.0") == ["::multi:2.0"]
+    assert cm.db.solver_cache_info()["misses"] == 4
+
+
+def test_persistent_solver_cache(tmp_path, monkeypatch):
+    import fusesoc.coremanager
+    from fusesoc.config import Config
+    from fusesoc.coremanager import CoreManager
+    from fusesoc.librarymanager import Library
+    from fusesoc.vlnv import Vlnv
+
+    core_dir = tmp_path / "cores"
+    core_dir.mkdir()
+
+    def write_core(name, depend="[]", description=""):
+        (core_dir / f"{name.replace(':', '_')}.core").write_text(
+            f"""CAPI=2:
+name: ::{name}
+description: "{description}"
+filesets:
+  fs:
+    depend: {depend}
+targets:
+  default:
+    filesets: [fs]
+"""
+        )
+
+    write_core("top:1.0", "['>=::lib:1.0']")
+    write_core("lib:1.0")
+    write_core("lib:2.0")
+
+    config_file = tmp_path / "fusesoc.conf"
+    config_file.write_text(f"[main]\ncache_root = {tmp_path / 'cache'}\n")
+    config = Config(str(config_file))
+
+    solved = []
+    _DependencySolver = fusesoc.coremanager.DependencySolver
+
+    def DependencySolver(*args):
+        solved.append(True)
+        return _DependencySolver(*args)
+
+    monkeypatch.setattr(fusesoc.coremanager, "DependencySolver", DependencySolver)
+
+    def get_depends():
+        solved.clear()
+        cm = CoreManager(config)
+        cm.add_library(Library("cores", core_dir), [])
+        deps = cm.get_depends(Vlnv("::top:1.0"), {"tool": "icarus"})
+        return [(str(c.name), c.direct_deps) for c in deps]
+
+    expected = [("::lib:2.0", []), ("::top:1.0", ["::lib:2.0"])]
+    assert get_depends() == expected
+    assert solved
+
+    # The stored solution is used by later invocations
+    assert get_depends() == expected
+    assert not solved
+
+    # Changes which don't affect dependencies keep the stored solution valid
+    write_core("lib:2.0", description="changed")
+    assert get_depends() == expected
+    assert not solved
+
+    # Changed dependencies of a core in the closure invalidate the solution
+    write_core("lib:2.0", "['::missing']")
+    assert get_depends() == [("::lib:1.0", []), ("::top:1.0", ["::lib:1.0"])]
+    assert solved
+
+    # New candidates invalidate the solution
+    write_core("lib:3.0")
+    assert get_depends() == [("::lib:3.0", []), ("::top:1.0", ["::lib:3.0"])]
+    assert solved
+
+    # The stored solution is ignored when the index is disabled
+    cm = CoreManager(config, use_index=False)
+    cm.add_library(Library("cores", core_dir), [])
+    solved.clear()
+    cm.get_depends(Vlnv("::top:1.0"), {"tool": "icarus"})
+    assert solved
+
+
+def test_persistent_solver_cache_size(tmp_path):
+    import os
+
+    from fusesoc.solvercache import PersistentSolverCache
+
+    cache = PersistentSolverCache(tmp_path, max_entries=3)
+    for i in range(3):
+        cache.put(i, i)
+        os.utime(cache._path(i), ns=(i * 10**9, i * 10**9))
+    # Using an entry makes it the most recently used one
+    assert cache.get(0) == 0
+    cache.put(3, 3)
+    assert len(list(tmp_path.glob("*.json"))) == 3
+    assert [cache.get(i) for i in range(4)] == [0, None, 2, 3]
+
+
+def test_setup_cores(tmp_path, config, caplog):
+    import logging
+    import threading
+    import time
+
+    from fusesoc.coremanager import CoreManager
+
+    events = []
+
+    class FakeCore:
+        def __init__(self, name, files_root, fail=False):
+            self.name = name
+            self.files_root = str(tmp_path / files_root)
+            self.provider = True
+            self.fail = fail
+
+        def setup(self):
+            events.append(("start", self.name, threading.get_ident()))
+            logging.getLogger("fusesoc.test").info("start %s", self.name)
+            time.sleep(0.01)
+            logging.getLogger("fusesoc.test").info("end %s", self.name)
+            events.append(("end", self.name, threading.get_ident()))
+            if self.fail:
+                raise RuntimeError("no network")
+
+    cores = [
+        FakeCore("::a:0", "a"),
+        FakeCore("::b:0", "b", fail=True),
+        FakeCore("::c:0", "shared"),
+        FakeCore("::d:0", "shared", fail=True),
+        FakeCore("::e:0", "e"),
+    ]
+
+    cm = CoreManager(config, use_index=False, fetch_jobs=4)
+    with pytest.raises(RuntimeError) as excinfo, caplog.at_level(logging.INFO):
+        cm.setup_cores(cores)
+
+    # All cores are attempted and failures are reported in core order
+    assert sorted(e[1] for e in events if e[0] == "end") == [c.name for c in cores]
+    assert str(excinfo.value).splitlines() == [
+        "Failed to set up ::b:0: no network",
+        "Failed to set up ::d:0: no network",
+    ]
+
+    # Cores sharing a files_root are set up one after the other in one thread
+    shared = [e for e in events if e[1] in ["::c:0", "::d:0"]]
+    assert [e[:2] for e in shared] == [
+        ("start", "::c:0"),
+        ("end", "::c:0"),
+        ("start", "::d:0"),
+        ("end", "::d:0"),
+    ]
+    assert len({e[2] for e in shared}) == 1
+
+    # Other cores are set up in parallel
+    assert len({e[2] for e in events}) > 1
+
+    # ...but their log messages are not interleaved
+    messages = [r.message for r in caplog.records if r.name == "fusesoc.test"]
+    assert messages == [f"{e} {c.name}" for c in cores for e in ["start", "end"]]
@@ -3,10 +3,9 @@
 # SPDX-License-Identifier: BSD-2-Clause
 
 
-def test_tool_or_flow():
+def test_tool_or_flow(config):
     import os
 
-    from fusesoc.config import Config
     from fusesoc.coremanager import CoreManager
     from fusesoc.edalizer import Edalizer
     from fusesoc.librarymanager import Library
@@ -17,7 +16,7 @@ def test_tool_or_flow():
 
     lib = Library("edalizer", cores_dir)
 
-    cm = CoreManager(Config())
+    cm = CoreManager(config)
     cm.add_library(lib, [])
 
     core = cm.get_core(Vlnv("::flow"))
@@ -89,11 +88,10 @@ def test_tool_or_flow():
     assert edam == ref_edam
 
 
-def test_generators():
+def test_generators(config):
     import os
     import tempfile
 
-    from fusesoc.config import Config
     from fusesoc.coremanager import CoreManager
     from fusesoc.edalizer import Edalizer
     from fusesoc.librarymanager import Library
@@ -104,7 +102,7 @@ def test_generators():
 
     lib = Library("edalizer", cores_dir)
 
-    cm = CoreManager(Config())
+    cm = CoreManager(config)
     cm.add_library(lib, [])
 
     core = cm.get_core(Vlnv("::generate"))
@@ -2,9 +2,11 @@
 # Licensed under the 2-Clause BSD License, see LICENSE for details.
 # SPDX-License-Identifier: BSD-2-Clause
 
+import random
+
 import pytest
 
-from fusesoc.capi2.exprs import Exprs
+from fusesoc.capi2.exprs import Exprs, FlagDefs, cache_info
 
 
 def check_parses_to(string, ast):
@@ -51,3 +53,135 @@ def test_expand():
     check_expand("mode_foo ? (a)", {"mode": "bar"}, "")
     check_expand("!mode_foo ? (a)", {"mode": "foo"}, "")
     check_expand("!mode_foo ? (a)", {"mode": "bar"}, "a")
+
+
+def test_expand_nested():
+    string = "a ? (b c ? (d) !e ? (f)) g"
+    check_expand(string, {}, "g")
+    check_expand(string, {"a": True}, "b f g")
+    check_expand(string, {"a": True, "c": True, "e": True}, "b d g")
+    check_expand(string, {"c": True}, "g")
+
+    assert Exprs(string).ops == (
+        (False, "a", 5),
+        "b",
+        (False, "c", 1),
+        "d",
+        (True, "e", 1),
+        "f",
+        "g",
+    )
+
+
+def test_flag_defs():
+    flag_defs = FlagDefs.from_flags(
+        {"a": True, "b": False, "c": None, "tool": "icarus"}
+    )
+    assert flag_defs == {"a", "tool_icarus"}
+    assert FlagDefs.from_flags(flag_defs) is flag_defs
+
+    exprs = Exprs("a ? (x) b ? (y) tool_icarus ? (z)")
+    assert exprs.expand(flag_defs) == "x z"
+    assert exprs.expand(flag_defs) == exprs.expand({"a": True, "tool": "icarus"})
+
+
+def test_cached():
+    string = "cached_flag ? (cached_word)"
+    info = cache_info()
+    exprs = Exprs.cached(string)
+    assert Exprs.cached(string) is exprs
+    assert cache_info()["misses"] == info["misses"] + 1
+    assert cache_info()["hits"] == info["hits"] + 1
+    assert exprs.expand({"cached_flag": True}) == "cached_word"
+
+    # Parse errors are raised every time
+    for i in range(2):
+        with pytest.raises(ValueError):
+            Exprs.cached("a ? b")
+
+
+def _reference_parse(string):
+    """Parse string with the original pyparsing grammar
+
+    Returns the simplified AST, or None if the string is malformed
+    """
+    pp = pytest.importorskip("pyparsing")
+
+    def _cond_parse_action(string, location, tokens):
+        return (
+            (True, tokens[1], tokens[2])
+            if len(tokens) == 3
+            else (False, tokens[0], tokens[1])
+        )
+
+    word = pp.Word(pp.alphanums + ":<>.[]_-,=~/^+")
+    exprs = pp.Forward()
+    conditional = (
+        pp.Optional("!")
+        + word
+        + pp.Suppress("?")
+        + pp.Suppress("(")
+        + pp.Group(exprs)
+        + pp.Suppress(")")
+    )
+    exprs <<= pp.OneOrMore(conditional ^ word)
+    conditional.setParseAction(_cond_parse_action)
+
+    def _simplify_ast(raw_ast):
+        children = []
+        str_acc = []
+        for expr in raw_ast:
+            if isinstance(expr, str):
+                str_acc.append(expr)
+                continue
+            if str_acc:
+                children.append(" ".join(str_acc))
+                str_acc = []
+            negated, flag, _exprs = expr
+            children.append((negated, flag, _simplify_ast(_exprs)))
+        if str_acc:
+            children.append(" ".join(str_acc))
+        return children
+
+    try:
+        return _simplify_ast(exprs.parseString(string, parseAll=True))
+    except pp.ParseException:
+        return None
+
+
+def test_reference_parser():
+    strings = [
+        "",
+        " ",
+        "a",
+        "  a  b\tc\n",
+        "a ? (b)",
+        "a?(b)",
+        "! a ? ( b )",
+        "a ? (b ? (c) d) e !f ? (g h)",
+        "a ? ()",
+        "a ? (b",
+        "a ? b)",
+        "a)",
+        "(a)",
+        "!",
+        "?",
+        "a !b",
+        "a ? (b) !c",
+        "a!b ? (c)",
+        "tool_icarus ? (-g2012 --foo=bar,baz ^1.0 ~2.0 >=::a:1 </x/y.v+[0])",
+        "a ? (b) ? (c)",
+        "a \u00e9",
+    ]
+    rng = random.Random(0)
+    for i in range(2000):
+        strings.append(
+            "".join(rng.choice("ab!?() ") for _ in range(rng.randint(0, 12)))
+        )
+
+    for string in strings:
+        expected = _reference_parse(string)
+        if expected is None:
+            check_parse_error(string)
+        else:
+            check_parses_to(string, expected)
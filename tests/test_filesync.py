@@ -0,0 +1,65 @@
+# Copyright FuseSoC contributors
+# Licensed under the 2-Clause BSD License, see LICENSE for details.
+# SPDX-License-Identifier: BSD-2-Clause
+
+import os
+
+import pytest
+
+from fusesoc.filesync import sync_files
+
+
+def test_sync_files(tmp_path):
+    src = tmp_path / "src"
+    dst = tmp_path / "dst"
+    for i in range(20):
+        f = src / "d{}".format(i % 3) / f"f{i}"
+        f.parent.mkdir(parents=True, exist_ok=True)
+        f.write_text(str(i))
+    (src / "tree" / "empty").mkdir(parents=True)
+    (src / "tree" / "x").write_text("x")
+
+    files = {f"a/d{i % 3}/f{i}": str(src / f"d{i % 3}" / f"f{i}") for i in range(20)}
+    files["b/tree"] = str(src / "tree")
+    sync_files(files, str(dst), jobs=4)
+
+    for i in range(20):
+        assert (dst / "a" / f"d{i % 3}" / f"f{i}").read_text() == str(i)
+    assert (dst / "b" / "tree" / "x").read_text() == "x"
+    assert (dst / "b" / "tree" / "empty").is_dir()
+
+    # Stale files are removed, but only if asked to
+    (dst / "stale").write_text("stale")
+    del files["b/tree"]
+    sync_files(files, str(dst), jobs=4)
+    assert (dst / "b" / "tree").exists()
+    sync_files(files, str(dst), jobs=4, delete=True)
+    assert sorted(os.listdir(dst)) == ["a"]
+
+    # All failures are reported together
+    files["c/missing1"] = str(src / "missing1")
+    files["c/missing2"] = str(src / "missing2")
+    with pytest.raises(RuntimeError) as excinfo:
+        sync_files(files, str(dst), jobs=4, delete=True)
+    msg = str(excinfo.value)
+    assert msg.startswith("Failed to copy 2 files")
+    assert "missing1" in msg and "missing2" in msg
+    # Nothing is removed after a failure
+    assert (dst / "a" / "d0" / "f0").exists()
+
+
+def test_sync_files_symlinks(tmp_path):
+    src = tmp_path / "src"
+    (src / "real").mkdir(parents=True)
+    (src / "real" / "f").write_text("f")
+    (src / "tree").mkdir()
+    (src / "tree" / "linked").symlink_to(src / "real")
+    # A link to a parent directory must not be followed forever
+    (src / "tree" / "loop").symlink_to(src / "tree")
+
+    dst = tmp_path / "dst"
+    written = sync_files({"tree": str(src / "tree")}, str(dst))
+
+    assert (dst / "tree" / "linked" / "f").read_text() == "f"
+    assert not (dst / "tree" / "linked").is_symlink()
+    assert written == {str(dst / "tree" / "linked" / "f")}
@@ -0,0 +1,217 @@
+# Copyright FuseSoC contributors
+# Licensed under the 2-Clause BSD License, see LICENSE for details.
+# SPDX-License-Identifier: BSD-2-Clause
+
+import os
+import random
+import shutil
+import subprocess
+
+import pytest
+
+from fusesoc.provider.patch import PatchError, UnsupportedPatch, apply_patches
+
+
+def _write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(content)
+
+
+def _read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def test_apply_patches(tmp_path):
+    root = str(tmp_path / "root")
+    _write(os.path.join(root, "a.v"), b"".join(b"line %d\n" % i for i in range(20)))
+    _write(os.path.join(root, "gone.v"), b"bye\n")
+
+    # The first hunk is offset by two lines. The second patch applies on top
+    # of the first one.
+    _write(
+        str(tmp_path / "1.patch"),
+        b"diff --git a/a.v b/a.v\n"
+        b"index 0000000..1111111 100644\n"
+        b"--- a/a.v\n"
+        b"+++ b/a.v\n"
+        b"@@ -1,3 +1,3 @@\n"
+        b" line 2\n"
+        b"-line 3\n"
+        b"+line three\n"
+        b" line 4\n"
+        b"@@ -18,2 +18,3 @@\n"
+        b" line 18\n"
+        b" line 19\n"
+        b"+line 20\n"
+        b"\\ No newline at end of file\n"
+        b"--- /dev/null\n"
+        b"+++ b/sub/new.v\n"
+        b"@@ -0,0 +1,2 @@\n"
+        b"+new\n"
+        b"+file\n"
+        b"--- a/gone.v\n"
+        b"+++ /dev/null\n"
+        b"@@ -1 +0,0 @@\n"
+        b"-bye\n",
+    )
+    _write(
+        str(tmp_path / "2.patch"),
+        b"--- a/a.v\t2022-01-01 00:00:00\n"
+        b"+++ b/a.v\t2022-01-01 00:00:00\n"
+        b"@@ -3,3 +3,2 @@\n"
+        b" line 2\n"
+        b"-line three\n"
+        b" line 4\n",
+    )
+    patches = [str(tmp_path / "1.patch"), str(tmp_path / "2.patch")]
+
+    apply_patches(patches, root, dry_run=True)
+    assert _read(os.path.join(root, "a.v")).count(b"\n") == 20
+    assert not os.path.exists(os.path.join(root, "sub"))
+
+    apply_patches(patches, root)
+    expected = [b"line %d\n" % i for i in range(20) if i != 3] + [b"line 20"]
+    assert _read(os.path.join(root, "a.v")) == b"".join(expected)
+    assert _read(os.path.join(root, "sub", "new.v")) == b"new\nfile\n"
+    assert not os.path.exists(os.path.join(root, "gone.v"))
+
+    # Nothing is written unless all patches apply
+    before = _read(os.path.join(root, "a.v"))
+    with pytest.raises(PatchError, match="Hunk #1 does not apply to a.v"):
+        apply_patches(patches, root)
+    assert _read(os.path.join(root, "a.v")) == before
+    assert _read(os.path.join(root, "sub", "new.v")) == b"new\nfile\n"
+
+
+def test_apply_patches_errors(tmp_path):
+    root = str(tmp_path)
+    patch = str(tmp_path / "p.patch")
+
+    _write(patch, b"--- a/../x\n+++ b/../x\n@@ -0,0 +1 @@\n+x\n")
+    with pytest.raises(PatchError, match="outside"):
+        apply_patches([patch], root)
+
+    _write(patch, b"--- a/x\n+++ b/x\n@@ -1,2 +1,2 @@\n-x\n")
+    with pytest.raises(PatchError, match="Truncated hunk"):
+        apply_patches([patch], root)
+
+    for header in [
+        b"diff --git a/x b/y\nsimilarity index 100%\nrename from x\nrename to y\n",
+        b"diff --git a/x b/x\nold mode 100644\nnew mode 100755\n",
+        b"diff --git a/x b/x\nGIT binary patch\nliteral 0\n",
+    ]:
+        _write(patch, header)
+        with pytest.raises(UnsupportedPatch):
+            apply_patches([patch], root)
+
+
+def test_apply_patches_empty_files(tmp_path):
+    """git writes patches creating or deleting empty files without hunks"""
+    root = str(tmp_path / "root")
+    _write(os.path.join(root, "empty.v"), b"")
+    _write(os.path.join(root, "a.v"), b"a\n")
+    _write(
+        str(tmp_path / "p.patch"),
+        b"diff --git a/empty.v b/empty.v\n"
+        b"deleted file mode 100644\n"
+        b"index e69de29..0000000\n"
+        b"diff --git a/sub/new.v b/sub/new.v\n"
+        b"new file mode 100644\n"
+        b"index 0000000..e69de29\n"
+        b"diff --git a/a.v b/a.v\n"
+        b"index 78981922..6178079 100644\n"
+        b"--- a/a.v\n"
+        b"+++ b/a.v\n"
+        b"@@ -1 +1 @@\n"
+        b"-a\n"
+        b"+b\n"
+        b"diff --git a/last.v b/last.v\n"
+        b"new file mode 100644\n"
+        b"index 0000000..e69de29\n",
+    )
+    apply_patches([str(tmp_path / "p.patch")], root)
+
+    assert not os.path.exists(os.path.join(root, "empty.v"))
+    assert _read(os.path.join(root, "sub", "new.v")) == b""
+    assert _read(os.path.join(root, "a.v")) == b"b\n"
+    assert _read(os.path.join(root, "last.v")) == b""
+
+    # Deleting a file that isn't empty needs hunks
+    _write(
+        str(tmp_path / "p.patch"),
+        b"diff --git a/a.v b/a.v\ndeleted file mode 100644\n",
+    )
+    with pytest.raises(PatchError, match="not empty"):
+        apply_patches([str(tmp_path / "p.patch")], root)
+
+
+def test_apply_patches_like_git(tmp_path):
+    """Apply diffs made by git diff to random files and compare the result"""
+    if not shutil.which("git"):
+        pytest.skip("git not available")
+
+    repo = tmp_path / "repo"
+    repo.mkdir()
+    subprocess.run(["git", "init", "-q"], cwd=str(repo), check=True)
+
+    rng = random.Random(0)
+    words = [b"a\n", b"b\n", b"c\n", b"\n", b"module x;\n", b"endmodule\n"]
+    for i in range(50):
+        old = [rng.choice(words) for _ in range(rng.randrange(0, 40))]
+        new = list(old)
+        for _ in range(rng.randrange(1, 6)):
+            pos = rng.randrange(0, len(new) + 1)
+            if new and rng.random() < 0.5:
+                del new[pos : pos + rng.randrange(1, 4)]
+            else:
+                new[pos:pos] = [rng.choice(words) for _ in range(rng.randrange(1, 4))]
+        old = b"".join(old)
+        new = b"".join(new)
+        if rng.random() < 0.3:
+            old = old.rstrip(b"\n")
+        if rng.random() < 0.3:
+            new = new.rstrip(b"\n")
+        if old == new:
+            continue
+
+        # git diff compares the working tree with the index
+        _write(str(repo / "f.v"), old)
+        subprocess.run(["git", "add", "f.v"], cwd=str(repo), check=True)
+        _write(str(repo / "f.v"), new)
+        diff = subprocess.run(
+            ["git", "diff"], cwd=str(repo), capture_output=True, check=True
+        ).stdout
+
+        d = tmp_path / str(i)
+        _write(str(d / "f.v"), old)
+        _write(str(d / "f.patch"), diff)
+        apply_patches([str(d / "f.patch")], str(d))
+        assert _read(str(d / "f.v")) == new
+
+
+def test_patch_git_fallback(tmp_path):
+    """Patches the built-in implementation can't handle are applied by git"""
+    if not shutil.which("git"):
+        pytest.skip("git not available")
+
+    from fusesoc.provider.provider import Provider
+
+    root = tmp_path / "root"
+    _write(str(root / "x.sh"), b"echo old\n")
+    _write(
+        str(tmp_path / "mode.patch"),
+        b"diff --git a/x.sh b/x.sh\n"
+        b"old mode 100644\n"
+        b"new mode 100755\n"
+        b"--- a/x.sh\n"
+        b"+++ b/x.sh\n"
+        b"@@ -1 +1 @@\n"
+        b"-echo old\n"
+        b"+echo new\n",
+    )
+    provider = Provider({"patches": ["mode.patch"]}, str(tmp_path), str(root))
+    assert provider.patch(str(root)) == ["mode.patch"]
+    assert _read(str(root / "x.sh")) == b"echo new\n"
+    assert os.access(str(root / "x.sh"), os.X_OK)
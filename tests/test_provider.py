@@ -47,6 +47,183 @@ def test_git_provider():
         assert os.path.isfile(os.path.join(core.files_root, f))
 
 
+def _git(repo, *args):
+    import subprocess
+
+    return subprocess.run(
+        ["git", "-C", str(repo)] + list(args),
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout.strip()
+
+
+def _make_git_repo(repo):
+    """Create a repository with two versions of file.v, the first tagged v0"""
+    repo.mkdir()
+    _git(repo, "init", "-q")
+    _git(repo, "config", "user.email", "test@example.com")
+    _git(repo, "config", "user.name", "Test")
+    commits = []
+    for i in range(2):
+        (repo / "file.v").write_text(f"// version {i}\n")
+        _git(repo, "add", "file.v")
+        _git(repo, "commit", "-q", "-m", f"version {i}")
+        commits.append(_git(repo, "rev-parse", "HEAD"))
+    _git(repo, "tag", "v0", commits[0])
+    return commits
+
+
+def _write_git_core(path, repo, version, patches=[]):
+    path.write_text(
+        f"CAPI=2:\nname: ::{path.stem}:0\nprovider:\n  name: git\n"
+        f"  repo: {repo}\n  version: {version}\n  patches: {patches}\n"
+    )
+
+
+def test_git_provider_mirror(tmp_path, monkeypatch):
+    from fusesoc.provider import git
+
+    repo = tmp_path / "repo"
+    commits = _make_git_repo(repo)
+
+    fetches = []
+    launcher_run = git.Launcher.run
+
+    def _run(self):
+        if "fetch" in self.args or "--mirror" in self.args:
+            fetches.append(self.args)
+        launcher_run(self)
+
+    monkeypatch.setattr(git.Launcher, "run", _run)
+    monkeypatch.setattr(git, "_fetched", set())
+
+    cache_root = tmp_path / "cache"
+
+    def checkout(name, version):
+        core_file = tmp_path / f"{name}.core"
+        _write_git_core(core_file, repo, version)
+        core = Core(str(core_file), str(cache_root))
+        core.setup()
+        with open(os.path.join(core.files_root, "file.v")) as f:
+            return f.read()
+
+    # Cores from the same repository share a single mirror, which is only
+    # fetched once per process
+    assert checkout("tag", "v0") == "// version 0\n"
+    assert checkout("sha", commits[1]) == "// version 1\n"
+    assert len(fetches) == 1
+    mirrors = list((cache_root / "git_mirrors").glob("*.git"))
+    assert mirrors == [git.mirror_path(cache_root, str(repo))]
+
+    # Checkouts borrow objects from the mirror and point to the original remote
+    files_root = cache_root / "tag_0"
+    alternates = files_root / ".git" / "objects" / "info" / "alternates"
+    assert alternates.read_text().strip() == str(mirrors[0] / "objects")
+    assert _git(files_root, "remote", "get-url", "origin") == str(repo)
+
+    # A new process only fetches the mirror if the commit is missing
+    monkeypatch.setattr(git, "_fetched", set())
+    git.update_mirror(cache_root, str(repo), commits[0])
+    assert len(fetches) == 1
+    git.update_mirror(cache_root, str(repo), "v0")
+    assert len(fetches) == 2
+
+
+def test_provider_manifest(tmp_path):
+    import json
+
+    from fusesoc.provider.provider import MANIFEST
+
+    repo = tmp_path / "repo"
+    commits = _make_git_repo(repo)
+    cache_root = str(tmp_path / "cache")
+    core_file = tmp_path / "manifest.core"
+
+    def status():
+        return Core(str(core_file), cache_root).cache_status()
+
+    _write_git_core(core_file, repo, "v0")
+    assert status() == "empty"
+    core = Core(str(core_file), cache_root)
+    core.setup()
+    assert status() == "downloaded"
+
+    with open(os.path.join(core.files_root, MANIFEST)) as f:
+        manifest = json.load(f)
+    assert manifest["provider"] == "git"
+    assert manifest["config"]["version"] == "v0"
+    assert manifest["resolved"] == {"url": str(repo), "commit": commits[0]}
+
+    # Changing the requested version makes the fetched files out of date
+    _write_git_core(core_file, repo, commits[1])
+    assert status() == "outofdate"
+    Core(str(core_file), cache_root).setup()
+    assert status() == "downloaded"
+    with open(os.path.join(core.files_root, MANIFEST)) as f:
+        manifest = json.load(f)
+    assert manifest["resolved"]["commit"] == commits[1]
+
+    # So do changes to the patches
+    patch = tmp_path / "fix.patch"
+    patch.write_text("")
+    _write_git_core(core_file, repo, commits[1], ["fix.patch"])
+    assert status() == "outofdate"
+    with open(os.path.join(core.files_root, MANIFEST), "w") as f:
+        json.dump(dict(manifest, patches=[["fix.patch", None]]), f)
+    assert status() == "outofdate"
+
+    # Patches are applied once, as part of the fetch
+    patch.write_text(
+        "--- a/file.v\n+++ b/file.v\n@@ -1 +1 @@\n-// version 1\n+// patched\n"
+    )
+    for i in range(2):
+        Core(str(core_file), cache_root).setup()
+        assert status() == "downloaded"
+    with open(os.path.join(core.files_root, "file.v")) as f:
+        assert f.read() == "// patched\n"
+    with open(os.path.join(core.files_root, MANIFEST)) as f:
+        assert json.load(f)["patched"] == ["fix.patch"]
+
+    # A broken manifest is not trusted
+    with open(os.path.join(core.files_root, MANIFEST), "w") as f:
+        f.write("{")
+    assert status() == "outofdate"
+
+
+def test_provider_without_manifest(tmp_path):
+    """Cores fetched before manifests were introduced are not fetched again"""
+    import json
+
+    from fusesoc.provider.provider import MANIFEST
+
+    repo = tmp_path / "repo"
+    commits = _make_git_repo(repo)
+    cache_root = tmp_path / "cache"
+    core_file = tmp_path / "legacy.core"
+    _write_git_core(core_file, repo, "v0")
+
+    # An existing cache directory with no manifest in it
+    files_root = cache_root / "legacy_0"
+    _git(tmp_path, "clone", "-q", str(repo), str(files_root))
+    (files_root / "file.v").write_text("// local\n")
+
+    core = Core(str(core_file), str(cache_root))
+    assert core.cache_status() == "downloaded"
+    core.setup()
+    assert (files_root / "file.v").read_text() == "// local\n"
+
+    # The manifest is written the first time the files are used
+    manifest = json.loads((files_root / MANIFEST).read_text())
+    assert manifest["config"]["version"] == "v0"
+    assert manifest["patched"] is None
+    assert manifest["resolved"]["commit"] == commits[1]
+
+    # and later changes to the core are detected as usual
+    _write_git_core(core_file, repo, commits[0])
+    assert Core(str(core_file), str(cache_root)).cache_status() == "outofdate"
+
+
 def test_github_provider():
     cache_root = tempfile.mkdtemp("github_")
     core = Core(
@@ -108,6 +285,190 @@ def test_url_provider():
         assert os.path.isfile(os.path.join(core.files_root, "file.v"))
 
 
+def _write_url_core(path, url, filetype, sha256=None, chunk_size=None):
+    with open(path, "w") as f:
+        f.write("CAPI=2:\nname: ::urlcore:0\nprovider:\n  name: url\n")
+        f.write(f"  url: {url}\n  filetype: {filetype}\n")
+        if sha256:
+            f.write(f"  sha256: '{sha256}'\n")
+        if chunk_size:
+            f.write(f"  chunk_size: {chunk_size}\n")
+
+
+def test_url_provider_download_cache(tmp_path):
+    import hashlib
+    import tarfile
+
+    from fusesoc.blobstore import BlobStore
+
+    src = tmp_path / "src"
+    src.mkdir()
+    (src / "file.v").write_text("module file;\nendmodule\n")
+    archive = tmp_path / "archive.tar.gz"
+    with tarfile.open(archive, "w:gz") as t:
+        t.add(src / "file.v", "file.v")
+    sha256 = hashlib.sha256(archive.read_bytes()).hexdigest()
+
+    cache_root = str(tmp_path / "cache")
+    core_file = str(tmp_path / "urlcore.core")
+    _write_url_core(core_file, archive.as_uri(), "tar", sha256)
+    core = Core(core_file, cache_root)
+    core.setup()
+    assert os.path.isfile(os.path.join(core.files_root, "file.v"))
+
+    # The archive is fetched from the download cache once it's stored
+    shutil.rmtree(core.files_root)
+    os.rename(archive, tmp_path / "moved.tar.gz")
+    core.setup()
+    assert os.path.isfile(os.path.join(core.files_root, "file.v"))
+
+    # Files with a declared hash are found regardless of the URL
+    store = BlobStore(os.path.join(cache_root, "downloads"))
+    assert store.get("https://example.com/other.tar.gz", sha256)
+    assert store.get("https://example.com/other.tar.gz") is None
+
+    # Corrupt files are detected and discarded
+    path = store.get(sha256=sha256)
+    os.chmod(path, 0o644)
+    path.write_bytes(b"corrupt")
+    assert store.get(archive.as_uri()) is None
+    assert not path.exists()
+
+    # Downloads not matching the declared hash are rejected
+    shutil.rmtree(core.files_root)
+    os.rename(tmp_path / "moved.tar.gz", archive)
+    _write_url_core(core_file, archive.as_uri(), "tar", "0" * 64)
+    with pytest.raises(RuntimeError, match="Checksum mismatch"):
+        Core(core_file, cache_root).setup()
+    assert store.get(sha256="0" * 64) is None
+    assert not os.path.exists(core.files_root)
+
+    # Least recently used files are evicted first
+    paths = []
+    for i in range(3):
+        (tmp_path / "blob").write_bytes(bytes([i]) * 100)
+        with open(tmp_path / "blob", "rb") as f:
+            paths.append(store.add(f, f"file:///blob{i}"))
+        os.utime(paths[-1], ns=(i * 10**9, i * 10**9))
+    os.utime(paths[0])
+    store.trim(250)
+    assert [p.exists() for p in paths] == [True, False, True]
+
+
+@pytest.mark.parametrize("filetype", ["tar", "tar:bz2", "tar:xz", "zip", "simple"])
+def test_url_provider_streaming(tmp_path, caplog, monkeypatch, filetype):
+    import logging
+    import tarfile
+    import zipfile
+
+    from fusesoc.provider import url
+
+    content = os.urandom(100000)
+    src = tmp_path / "file.bin"
+    src.write_bytes(content)
+    if filetype.startswith("tar"):
+        archive = tmp_path / "archive.tar"
+        with tarfile.open(archive, "w:" + filetype[4:]) as t:
+            t.add(src, "file.bin")
+    elif filetype == "zip":
+        archive = tmp_path / "archive.zip"
+        with zipfile.ZipFile(archive, "w") as z:
+            z.write(src, "file.bin")
+    else:
+        archive = src
+
+    core_file = str(tmp_path / "urlcore.core")
+    _write_url_core(
+        core_file, archive.as_uri(), filetype.split(":")[0], chunk_size=4096
+    )
+    core = Core(core_file, str(tmp_path / "cache"))
+
+    monkeypatch.setattr(url._Download, "PROGRESS_INTERVAL", 0)
+    with caplog.at_level(logging.INFO, logger="fusesoc.provider.url"):
+        core.setup()
+    with open(os.path.join(core.files_root, "file.bin"), "rb") as f:
+        assert f.read() == content
+
+    progress = [r.message for r in caplog.records if "%)" in r.message]
+    assert len(progress) > 2
+    assert progress[-1].endswith("(100%)")
+
+    # The chunk size doesn't affect what is fetched
+    _write_url_core(
+        core_file, archive.as_uri(), filetype.split(":")[0], chunk_size=8192
+    )
+    assert Core(core_file, str(tmp_path / "cache")).cache_status() == "downloaded"
+
+
+def test_concurrent_fetch(tmp_path, monkeypatch):
+    import threading
+    import time
+
+    from fusesoc.provider.url import Url
+
+    archive = tmp_path / "file.v"
+    archive.write_text("module file;\nendmodule\n")
+    cache_root = tmp_path / "cache"
+    core_file = str(tmp_path / "urlcore.core")
+    _write_url_core(core_file, archive.as_uri(), "simple")
+
+    checkouts = []
+    url_checkout = Url._checkout
+
+    def _checkout(self, local_dir):
+        checkouts.append(local_dir)
+        # Give the other threads a chance to find the partial fetch
+        time.sleep(0.2)
+        if archive.read_text() == "fail":
+            raise RuntimeError("Failed")
+        url_checkout(self, local_dir)
+
+    monkeypatch.setattr(Url, "_checkout", _checkout)
+
+    def setup():
+        core = Core(core_file, str(cache_root))
+        core.setup()
+        with open(os.path.join(core.files_root, "file.v")) as f:
+            results.append(f.read())
+
+    results = []
+    threads = [threading.Thread(target=setup) for i in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    # Only one of the concurrent fetches does the work, and the files are
+    # fetched to a temporary directory before they are moved into place
+    assert len(checkouts) == 1
+    assert os.path.dirname(os.path.dirname(checkouts[0])) == str(cache_root)
+    assert results == ["module file;\nendmodule\n"] * 4
+
+    # A failed fetch leaves the previously fetched files alone
+    archive.write_text("fail")
+    _write_url_core(core_file, archive.as_uri() + "?v2", "simple")
+    with pytest.raises(RuntimeError):
+        Core(core_file, str(cache_root)).setup()
+    assert sorted(os.listdir(cache_root)) == [
+        "downloads",
+        "urlcore_0",
+        "urlcore_0.lock",
+    ]
+    with open(cache_root / "urlcore_0" / "file.v") as f:
+        assert f.read() == "module file;\nendmodule\n"
+
+
+def test_file_lock(tmp_path):
+    from fusesoc.filelock import FileLock
+
+    lock_file = tmp_path / "lock"
+    with FileLock(lock_file):
+        with pytest.raises(RuntimeError, match="Timed out"):
+            FileLock(lock_file, timeout=0.2).acquire()
+    with FileLock(lock_file, timeout=0):
+        pass
+
+
 def test_uncachable():
     cores_root = os.path.join(tests_dir, "capi2_cores", "misc")
     cache_root = tempfile.mkdtemp("uncachable_")
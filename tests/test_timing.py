@@ -0,0 +1,98 @@
+# Copyright FuseSoC contributors
+# Licensed under the 2-Clause BSD License, see LICENSE for details.
+# SPDX-License-Identifier: BSD-2-Clause
+
+import json
+
+import pytest
+
+
+def test_timings(tmp_path):
+    from fusesoc.timing import Timings
+
+    timings = Timings()
+
+    # Nothing is recorded unless enabled
+    with timings.phase("scan"):
+        pass
+    assert timings.phases == {}
+
+    timings.enabled = True
+    with timings.phase("scan", "lib1"):
+        pass
+    for core in ["::a:0", "::b:0", "::a:0"]:
+        with timings.phase("setup", core):
+            pass
+    with pytest.raises(RuntimeError):
+        with timings.phase("build"):
+            raise RuntimeError
+
+    assert list(timings.phases) == ["scan", "setup", "build"]
+    assert timings.phases["setup"]["count"] == 3
+    assert sorted(timings.phases["setup"]["items"]) == ["::a:0", "::b:0"]
+    assert timings.phases["build"]["count"] == 1
+
+    report = timings.report(max_items=1).splitlines()
+    assert report[0].split() == ["Phase", "Wall", "CPU", "Count"]
+    assert [l.split()[0] for l in report[1:]] == [
+        "scan",
+        "lib1",
+        "setup",
+        report[4].split()[0],
+        "(1",
+        "build",
+    ]
+
+    timings.write_json(tmp_path / "timings.json")
+    with open(tmp_path / "timings.json") as f:
+        assert json.load(f) == timings.phases
+
+
+def test_trace(tmp_path):
+    import threading
+
+    from fusesoc.timing import Timings
+
+    timings = Timings()
+    timings.tracing = True
+    with timings.phase("setup", "::a:0"):
+        with timings.phase("fetch", "a"):
+            pass
+    with timings.phase("build"):
+        pass
+
+    def generate():
+        with timings.phase("generate", "gen"):
+            pass
+
+    t = threading.Thread(target=generate, name="worker")
+    t.start()
+    t.join()
+
+    # Only spans are recorded unless timings are enabled too
+    assert timings.phases == {}
+
+    timings.write_trace(tmp_path / "trace.json")
+    with open(tmp_path / "trace.json") as f:
+        events = json.load(f)["traceEvents"]
+
+    spans = [e for e in events if e["ph"] == "X"]
+    assert [e["name"] for e in spans] == [
+        "fetch a",
+        "setup ::a:0",
+        "build",
+        "generate gen",
+    ]
+    (fetch, setup, build, generate) = spans
+    assert fetch["args"] == {"item": "a"}
+    assert "args" not in build
+    assert setup["ts"] <= fetch["ts"]
+    assert fetch["ts"] + fetch["dur"] <= setup["ts"] + setup["dur"]
+    assert {e["tid"] for e in spans[:3]} == {threading.get_ident()}
+    assert generate["tid"] == t.ident
+
+    names = {e["tid"]: e["args"]["name"] for e in events if e["ph"] == "M"}
+    assert names == {
+        threading.get_ident(): threading.current_thread().name,
+        t.ident: "worker",
+    }